@@ -1,45 +1,284 @@
 import os
-from flask import Flask, render_template, request, send_from_directory, Response
+import json
+import threading
+from flask import Flask, render_template, request, send_from_directory, Response, jsonify
 import cv2
-from ultralytics import YOLO
-from moviepy.editor import VideoFileClip, AudioFileClip
 import numpy as np
-from tensorflow import keras
-import librosa
 import shutil
-app = Flask(__name__)
+from utils.video_pipeline import VideoPipeline
+from utils.job_queue import JobManager, QueueFullError
+from utils.stream_broadcaster import BroadcasterRegistry
+from utils.mjpeg_output import AdaptiveProfile, get_encoder
+from utils.live_reader import LiveDetector
+from utils.audio_stream import (StreamingAudioClassifier, summarize_timeline, mean_probs,
+                                iter_ffmpeg_blocks, clip_mfcc, DEFAULT_SAMPLE_RATE)
+from utils.audio_service import AudioBatchService, MfccCache
+from utils.late_fusion import FusionStream, visual_class_scores
+from utils.model_registry import registry as model_registry, load_keras, warmup_keras
+from utils.detector_backends import register_detector, get_detector, DEFAULT_MODEL_PATHS
+from utils.metrics import metrics, STAGE_SECONDS
+from utils.result_cache import ResultCache, file_version, link_or_copy
+from utils.uploads import StreamingUploadRequest
+from utils.video_processor import VideoProcessor
+from utils.camera_manager import CameraManager
+from utils.tracker import ByteTracker
+from utils.motion_gate import MotionGate
+from utils.tiled_inference import TiledDetector
+from utils.inference_server import (ServedDetector, serve, server_stats, PRIORITY_LIVE,
+                                    PRIORITY_OFFLINE)
+# static_folder=None: /static do route serve_file bên dưới phục vụ (thư mục OUTPUT_FOLDER)
+app = Flask(__name__, static_folder=None)
+# File upload được ghi thẳng xuống uploads/<upload_id>/ trong lúc nhận (không qua bộ đệm tạm)
+app.request_class = StreamingUploadRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'static'
+# Kích thước upload tối đa (MB), kiểm tra cả trong lúc đang nhận dữ liệu
+app.config['MAX_UPLOAD_MB'] = 2048
+app.config['MAX_UPLOAD_BYTES'] = app.config['MAX_UPLOAD_MB'] * 2 ** 20
+# Từ chối sớm theo header Content-Length (cộng thêm phần header multipart)
+app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_BYTES'] + 2 ** 20
+# Giữ lại file upload gốc sau khi xử lý xong
+app.config['KEEP_UPLOADS'] = False
+# Số frame mỗi lần chạy YOLO khi xử lý video upload
+app.config['YOLO_BATCH_SIZE'] = 8
+# Bật để kiểm tra kết quả batch có khớp với chạy từng frame không (chậm hơn)
+app.config['VERIFY_BATCHED_INFERENCE'] = False
+# Số file được xử lý cùng lúc (giới hạn CPU) và số job tối đa được chờ trong hàng đợi
+app.config['MAX_CONCURRENT_JOBS'] = 2
+app.config['MAX_PENDING_JOBS'] = 32
+# Nguồn cho trang Live: 0 (webcam), 'rtsp://...' hoặc file video
+app.config['LIVE_SOURCE'] = 'V_AIRPLANE_007.mp4'
+# Chạy YOLO mỗi N frame (ở giữa dời box bằng optical flow)
+app.config['LIVE_DETECT_EVERY'] = 1
+# Độ trễ tối đa (giây) từ lúc đọc frame đến lúc xử lý, frame cũ hơn sẽ bị bỏ
+app.config['LIVE_MAX_LATENCY'] = 0.5
+# Gán track id cho từng vật thể (class được bỏ phiếu qua nhiều frame + audio)
+app.config['TRACKING'] = True
+# Khi tracking, YOLO chạy ở ngưỡng thấp này: box conf thấp chỉ dùng để giữ track đang có
+# (ByteTrack), box mới vẫn phải >= DETECT_CONF
+app.config['TRACK_LOW_CONF'] = 0.1
+# Video upload: chạy YOLO mỗi N frame, frame ở giữa lấy box nội suy từ tracker
+app.config['VIDEO_DETECT_EVERY'] = 1
+# Chỉ chạy YOLO khi khung hình có thay đổi (tỉ lệ pixel thay đổi >= MOTION_THRESHOLD)
+# hoặc đã quá MOTION_KEEP_ALIVE giây kể từ lần chạy trước; cảnh tĩnh giữ box cũ
+app.config['MOTION_GATE'] = True
+app.config['MOTION_THRESHOLD'] = 0.002
+app.config['MOTION_KEEP_ALIVE'] = 2.0
+# Ảnh / video upload độ phân giải cao: chia frame thành các tile TILE_SIZE chồng lấn
+# (chạy chung một batch) để không mất vật nhỏ như drone ở xa
+app.config['TILED_INFERENCE'] = False
+app.config['TILE_SIZE'] = 640
+app.config['TILE_OVERLAP'] = 0.2
+# Chỉ tìm trong vùng (x1, y1, x2, y2) theo tỉ lệ 0..1 của khung hình, None: cả khung hình
+app.config['TILE_ROI'] = None
+# Trọng số late fusion: alpha * visual + (1 - alpha) * audio
+app.config['FUSION_ALPHA'] = 0.5
+# Lấy audio của nguồn live (file / rtsp) để fuse với hình
+app.config['LIVE_AUDIO_FUSION'] = True
+# Các camera giám sát khởi động cùng app: {id: nguồn (0, 'rtsp://...' hoặc file)}
+# Thêm / bớt lúc đang chạy qua POST /cameras và DELETE /cameras/<id>
+app.config['CAMERAS'] = {}
+# Số frame tối đa (từ nhiều camera) trong một lần chạy YOLO chung
+app.config['CAMERA_BATCH_SIZE'] = 16
+# Luồng MJPEG: encoder ('auto': libjpeg-turbo qua PyTurboJPEG nếu có, không thì OpenCV),
+# chất lượng JPEG tối đa và chiều rộng tối đa (None: giữ nguyên kích thước frame)
+app.config['STREAM_JPEG_ENCODER'] = 'auto'
+app.config['STREAM_JPEG_QUALITY'] = 80
+app.config['STREAM_MAX_WIDTH'] = None
+# Tự giảm chất lượng / độ phân giải cho client nhận không kịp, tăng lại khi theo kịp
+# (client có thể chọn cố định bằng ?quality=..&width=.. hoặc tắt bằng ?adaptive=0)
+app.config['STREAM_ADAPTIVE'] = True
+# Mọi route / nguồn live / camera gửi frame vào MỘT inference server trước YOLO:
+# gom batch động, frame live được chạy trước ảnh / video upload
+app.config['INFERENCE_SERVER'] = True
+app.config['INFERENCE_MAX_BATCH'] = 16
+# Thời gian chờ tối đa (ms) để gom batch: live chờ ngắn, upload chờ lâu hơn cho batch đầy
+app.config['INFERENCE_LIVE_WAIT_MS'] = 2
+app.config['INFERENCE_OFFLINE_WAIT_MS'] = 30
+# Batch có frame live bị giới hạn số frame để thời gian chạy (ước lượng) không vượt ngưỡng này
+app.config['INFERENCE_LIVE_BUDGET_MS'] = 150
+# Ngưỡng confidence / IoU (NMS) của YOLO cho mọi route; tracker lấy DETECT_CONF làm ngưỡng
+# tạo track (khi tracking, YOLO chạy ở TRACK_LOW_CONF và tracker lọc lại theo DETECT_CONF)
+app.config['DETECT_CONF'] = 0.35
+app.config['DETECT_IOU'] = 0.5
+# Engine chạy YOLO: 'torch' (best.pt), 'onnxruntime' (best.onnx) hoặc 'openvino'
+app.config['DETECTOR_ENGINE'] = 'torch'
+# None: dùng model mặc định của engine (xem DEFAULT_MODEL_PATHS)
+app.config['DETECTOR_MODEL_PATH'] = None
+# Số thread intra-op của engine (None: để engine tự chọn)
+app.config['DETECTOR_THREADS'] = None
+# 'fp32', 'fp16' hoặc 'int8' (dùng file model *_fp16 / *_int8 nếu có)
+app.config['DETECTOR_PRECISION'] = 'fp32'
+app.config['DETECTOR_IMGSZ'] = 640
+# Model được load + warm-up ngay khi khởi động (chạy nền) thay vì đợi request đầu tiên:
+# 'audio' và / hoặc 'detector', chỉ liệt kê model tiến trình này phục vụ (vd: ['detector']
+# cho tiến trình chỉ xử lý ảnh / video). Rỗng: model nào dùng tới mới load
+app.config['PRELOAD_MODELS'] = []
+# Cache kết quả theo nội dung file (upload lại cùng file -> trả kết quả cũ ngay), None để tắt
+app.config['RESULT_CACHE_FOLDER'] = 'cache'
+# Dung lượng tối đa của cache (MB), vượt quá thì xóa kết quả lâu không dùng nhất
+app.config['RESULT_CACHE_MAX_MB'] = 2048
+# Model audio: gom MFCC của các request đồng thời thành một batch
+# (tối đa AUDIO_BATCH_SIZE cửa sổ, chờ tối đa AUDIO_BATCH_WAIT_MS ms)
+app.config['AUDIO_BATCH_SIZE'] = 64
+app.config['AUDIO_BATCH_WAIT_MS'] = 10
+# Cache MFCC theo nội dung file (đổi model audio không phải tính lại đặc trưng), None để tắt
+app.config['MFCC_CACHE_FOLDER'] = 'cache_mfcc'
+app.config['MFCC_CACHE_MAX_MB'] = 512
+
+# Encoder JPEG dùng chung cho mọi luồng MJPEG
+get_encoder(app.config['STREAM_JPEG_QUALITY'], app.config['STREAM_JPEG_ENCODER'])
 
 # Tạo thư mục nếu chưa có
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 CLASS_LABELS = ['airplane', 'bird', 'drone', 'helicopter']
 MODEL_PATH = 'models/sound_classification_model.h5'
-audio_model = keras.models.load_model(MODEL_PATH)
+# Model chỉ được load khi dùng lần đầu, dùng chung qua model_registry
+model_registry.register('audio', lambda: load_keras(MODEL_PATH), warmup=warmup_keras)
+
+# Mọi request audio dùng chung một hàng đợi micro-batch trước model
+audio_service = AudioBatchService(lambda: model_registry.get('audio'),
+                                  max_batch=app.config['AUDIO_BATCH_SIZE'],
+                                  max_wait=app.config['AUDIO_BATCH_WAIT_MS'] / 1000)
+mfcc_cache = None
+if app.config['MFCC_CACHE_FOLDER']:
+    mfcc_cache = MfccCache(app.config['MFCC_CACHE_FOLDER'],
+                           max_bytes=app.config['MFCC_CACHE_MAX_MB'] * 2 ** 20)
+
+def get_audio_classifier():
+    # Phân loại audio theo cửa sổ trượt 174 frame MFCC (chồng lấn 50%)
+    return StreamingAudioClassifier(audio_service, CLASS_LABELS, feature_cache=mfcc_cache)
+
 # 1. LOAD MODEL YOLO (Visual Model)
-# Tự động tải yolov8n.pt nếu chưa có
-yolo_model = YOLO('models/best.pt') 
+# Cùng instance với VideoProcessor nếu cùng engine + model
+def detector_options():
+    return dict(engine=app.config['DETECTOR_ENGINE'],
+                model_path=app.config['DETECTOR_MODEL_PATH'],
+                imgsz=app.config['DETECTOR_IMGSZ'],
+                threads=app.config['DETECTOR_THREADS'],
+                precision=app.config['DETECTOR_PRECISION'])
+
+detector_name = register_detector(**detector_options())
+
+def inference_server_options():
+    if not app.config['INFERENCE_SERVER']:
+        return None
+    return dict(max_batch=app.config['INFERENCE_MAX_BATCH'],
+                max_wait={PRIORITY_LIVE: app.config['INFERENCE_LIVE_WAIT_MS'] / 1000,
+                          PRIORITY_OFFLINE: app.config['INFERENCE_OFFLINE_WAIT_MS'] / 1000},
+                latency_budget={PRIORITY_LIVE: app.config['INFERENCE_LIVE_BUDGET_MS'] / 1000})
+
+def get_yolo_detector(priority=PRIORITY_LIVE):
+    detector = get_detector(**detector_options())
+    options = inference_server_options()
+    if options is None:
+        return detector
+    return ServedDetector(serve(detector, **options), priority)
+
+def get_upload_detector():
+    # Detector cho ảnh / video upload: bọc thêm chế độ tile nếu bật
+    detector = get_yolo_detector(PRIORITY_OFFLINE)
+    if not app.config['TILED_INFERENCE']:
+        return detector
+    return TiledDetector(detector, tile_size=app.config['TILE_SIZE'],
+                         overlap=app.config['TILE_OVERLAP'], roi=app.config['TILE_ROI'])
+
+def make_tracker():
+    if not app.config['TRACKING']:
+        return None
+    return ByteTracker(det_thresh=app.config['DETECT_CONF'],
+                       low_thresh=app.config['TRACK_LOW_CONF'],
+                       class_labels=CLASS_LABELS, visual_weight=app.config['FUSION_ALPHA'])
+
+def detect_conf(tracker):
+    # Có tracker: YOLO chạy ở ngưỡng thấp của tracker, tracker lọc lại theo DETECT_CONF
+    return app.config['DETECT_CONF'] if tracker is None else tracker.detect_conf
+
+def make_motion_gate(name):
+    if not app.config['MOTION_GATE']:
+        return None
+    return MotionGate(threshold=app.config['MOTION_THRESHOLD'],
+                      keep_alive=app.config['MOTION_KEEP_ALIVE'], name=name)
+
+# Dùng cho /api/detect (chế độ chỉ trả về detections), chung detector với các route khác
+api_processor = VideoProcessor(**detector_options(), server=inference_server_options())
+
+if app.config['PRELOAD_MODELS']:
+    preload_names = {'audio': 'audio', 'detector': detector_name}
+    model_registry.preload([preload_names[kind] for kind in app.config['PRELOAD_MODELS']],
+                           warmup=True, background=True)
+
+# Cache kết quả xử lý upload
+result_cache = None
+if app.config['RESULT_CACHE_FOLDER']:
+    result_cache = ResultCache(app.config['RESULT_CACHE_FOLDER'],
+                               max_bytes=app.config['RESULT_CACHE_MAX_MB'] * 2 ** 20)
+    metrics.gauge('result_cache_bytes', 'Disk space used by the result cache').set_function(
+        lambda: result_cache.stats()['bytes'])
+
+def cache_params(media_type):
+    """
+    Mọi thứ ảnh hưởng tới kết quả ngoài nội dung file: model, phiên bản model, tham số infer
+    """
+    params = {'type': media_type}
+    if media_type in ('image', 'video'):
+        options = detector_options()
+        model_path = options['model_path'] or DEFAULT_MODEL_PATHS[options['engine']]
+        params.update(engine=options['engine'], precision=options['precision'],
+                      model=model_path, model_version=file_version(model_path),
+                      conf=app.config['DETECT_CONF'], iou=app.config['DETECT_IOU'],
+                      imgsz=options['imgsz'])
+        if app.config['TILED_INFERENCE']:
+            params['tiles'] = (app.config['TILE_SIZE'], app.config['TILE_OVERLAP'],
+                               app.config['TILE_ROI'])
+    if media_type in ('audio', 'video'):
+        params.update(audio_model=MODEL_PATH, audio_model_version=file_version(MODEL_PATH))
+    if media_type == 'video':
+        params.update(fusion_alpha=app.config['FUSION_ALPHA'],
+                      tracking=(app.config['TRACKING'] and
+                                {'det_thresh': app.config['DETECT_CONF'],
+                                 'low_thresh': app.config['TRACK_LOW_CONF']}),
+                      detect_every=app.config['VIDEO_DETECT_EVERY'],
+                      motion_gate=(app.config['MOTION_GATE'] and
+                                   (app.config['MOTION_THRESHOLD'],
+                                    app.config['MOTION_KEEP_ALIVE'])))
+    return params
+
+def restore_cached_result(cache_key, output_path, output_filename):
+    """
+    Kết quả đã có trong cache -> đặt lại file output, trả về dict kết quả; không có -> None
+    """
+    entry = result_cache.get(cache_key)
+    if entry is None:
+        return None
+    try:
+        link_or_copy(entry.files['output'], output_path)
+    except (OSError, KeyError) as e:
+        print(f"Không lấy được kết quả từ cache {cache_key}: {e}")
+        return None
+    return dict(entry.result, result=output_filename)
+
+# Hàng đợi job xử lý file upload chạy nền
+job_manager = JobManager(max_workers=app.config['MAX_CONCURRENT_JOBS'],
+                         max_pending=app.config['MAX_PENDING_JOBS'])
+# Số job đang chạy / đang chờ, đọc lúc truy cập /metrics
+jobs_gauge = metrics.gauge('jobs', 'Upload jobs by state', ('state',))
+jobs_gauge.set_function(job_manager.active_count, state='running')
+jobs_gauge.set_function(job_manager.pending_count, state='queued')
 # 1. Định nghĩa hàm trích xuất đặc trưng
 def extract_features(file_path, max_pad_len=174, n_mfcc=40):
     """
     Trích xuất đặc trưng MFCC từ file audio.
     """
     try:
+        import librosa
         # Load file audio
         audio, sample_rate = librosa.load(file_path, sr=None)
         
-        # Trích xuất MFCC features
-        mfccs = librosa.feature.mfcc(y=audio, sr=sample_rate, n_mfcc=n_mfcc)
-        
-        # Pad/Cắt để đồng nhất kích thước
-        if mfccs.shape[1] > max_pad_len:
-            mfccs = mfccs[:, :max_pad_len]
-        else:
-            pad_width = max_pad_len - mfccs.shape[1]
-            mfccs = np.pad(mfccs, pad_width=((0, 0), (0, pad_width)), mode='constant')
-        
-        return mfccs
+        # Trích xuất MFCC features, pad/cắt để đồng nhất kích thước
+        # (cùng hàm với phân loại theo cửa sổ trượt)
+        return clip_mfcc(audio, sample_rate, n_mfcc=n_mfcc, max_pad_len=max_pad_len)
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
         return None
@@ -47,56 +286,142 @@ def extract_features(file_path, max_pad_len=174, n_mfcc=40):
 # PHẦN MỚI THÊM CHO LIVE CAMERA
 # ==========================================
 
-# 1. Hàm tạo luồng frame (Generator Function)
-def generate_frames():
-    # Mở camera (số 0 thường là webcam mặc định của laptop)
-    camera = cv2.VideoCapture('V_AIRPLANE_007.mp4') 
-    
-    if not camera.isOpened():
-        print("Error: Could not open webcam.")
-        return
+# 1. Hàm chạy YOLO cho một frame live
+def detect_live_frame(frame, conf=None):
+    # --- XỬ LÝ YOLO TẠI ĐÂY ---
+    # (Giống hệt cách xử lý ảnh tĩnh)
+    conf = app.config['DETECT_CONF'] if conf is None else conf
+    return get_yolo_detector().predict([frame], conf=conf, iou=app.config['DETECT_IOU'])[0]
 
-    while True:
-        # Đọc frame từ camera
-        success, frame = camera.read()
-        if not success:
-            break
-        
-        # --- XỬ LÝ YOLO TẠI ĐÂY ---
-        # (Giống hệt cách xử lý ảnh tĩnh)
-        results = yolo_model(frame, conf = 0.35, iou = 0.5, stream=True)
-        
-         # 2. Vẽ kết quả lên frame
-        for result in results:
-            annotated_frame = result.plot()
-                
-            # 3. Mã hóa ảnh sang định dạng JPEG để gửi qua web
-            ret, buffer = cv2.imencode('.jpg', annotated_frame)
-            frame_bytes = buffer.tobytes()
-        
+# Mỗi nguồn live có bộ detect + tracker + fusion riêng (giới hạn độ trễ, bỏ frame cũ)
+class LiveRenderer:
+    def __init__(self, source):
+        self.source = source
 
-        # Yield (trả về liên tục) frame theo định dạng multipart/x-mixed-replace
-        # Đây là chuẩn để trình duyệt hiểu là luồng video MJPEG
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-    
-    camera.release()
+    def start(self):
+        # Gọi mỗi khi thread xử lý của nguồn (re)start -> trạng thái mới.
+        # Trả về stop_event của phiên này (FrameBroadcaster truyền lại cho stop)
+        self.tracker = make_tracker()
+        conf = detect_conf(self.tracker)
+        self.detector = LiveDetector(lambda frame: detect_live_frame(frame, conf),
+                                     detect_every=app.config['LIVE_DETECT_EVERY'],
+                                     max_latency=app.config['LIVE_MAX_LATENCY'],
+                                     gate=make_motion_gate('live'))
+        # Live không lấy segment (pop_segments) -> chỉ giữ vài đoạn gần nhất, không tăng mãi
+        self.fusion = FusionStream(CLASS_LABELS, alpha=app.config['FUSION_ALPHA'],
+                                   max_segments=16)
+        self.stop_event = threading.Event()
+        self.started_at = None
+        # Audio chỉ lấy được khi nguồn là file / URL (rtsp...), webcam thì chỉ dùng visual
+        if app.config['LIVE_AUDIO_FUSION'] and isinstance(self.source, str):
+            threading.Thread(target=feed_audio, args=(self.fusion, self.source),
+                             kwargs={'max_batch': 1, 'block_seconds': 1.0,
+                                     'stop_event': self.stop_event},
+                             daemon=True).start()
+        else:
+            self.fusion.finish_audio()
+        return self.stop_event
+
+    def stop(self, stop_event):
+        stop_event.set()
+
+    def __call__(self, frame, captured_at):
+        detections = self.detector.process(frame, captured_at)
+        if detections is None:
+            return None
+
+        if self.started_at is None:
+            self.started_at = captured_at
+        if self.tracker is not None:
+            # Chỉ kết quả thật của YOLO mới được đưa vào tracker (tính hit / phiếu class);
+            # frame dùng box optical flow / bị motion gate bỏ qua thì chỉ predict
+            timestamp = captured_at - self.started_at
+            detections = (self.tracker.update(detections, timestamp) if self.detector.detected
+                          else self.tracker.predict(timestamp))
+        visual = visual_class_scores(detections, CLASS_LABELS)
+        fused = self.fusion.fuse([captured_at - self.started_at], [visual])
+        if self.tracker is not None and fused.has_audio[0]:
+            self.tracker.add_audio(fused.audio[0])
+
+        # 2. Vẽ kết quả lên frame
+        with STAGE_SECONDS.time(pipeline='live', stage='plot'):
+            annotated_frame = detections.plot(frame, copy=False)
+            audio_label = CLASS_LABELS[int(fused.audio[0].argmax())] if fused.has_audio[0] else ""
+            draw_fusion_overlay(annotated_frame, audio_label, self.fusion.label(int(fused.ids[0])))
+
+        # 3. JPEG được encode theo profile của từng client, detections gửi cho client NDJSON
+        # (FrameBroadcaster)
+        return annotated_frame, detections
+
+# Mỗi nguồn chỉ có một thread đọc + YOLO, dùng chung cho mọi client
+live_broadcasters = BroadcasterRegistry(LiveRenderer)
+
+# Nhiều camera giám sát chạy liên tục, YOLO gom frame của mọi camera thành một batch
+camera_manager = CameraManager(get_yolo_detector, conf=app.config['DETECT_CONF'],
+                               iou=app.config['DETECT_IOU'],
+                               max_batch=app.config['CAMERA_BATCH_SIZE'],
+                               max_latency=app.config['LIVE_MAX_LATENCY'],
+                               make_gate=lambda: make_motion_gate('cameras'))
+
+def parse_source(source):
+    # '0', '1' -> webcam, còn lại là URL / đường dẫn file
+    source = str(source).strip()
+    return int(source) if source.isdigit() else source
+
+for camera_id, camera_source in app.config['CAMERAS'].items():
+    try:
+        camera_manager.add(str(camera_id), parse_source(camera_source))
+    except Exception as e:
+        print(f"Không thêm được camera {camera_id}: {e}")
+
+def stream_profile():
+    """
+    Profile MJPEG của client theo query: ?quality=60&width=960&adaptive=0
+    """
+    quality = request.args.get('quality', type=int) or app.config['STREAM_JPEG_QUALITY']
+    width = request.args.get('width', type=int) or app.config['STREAM_MAX_WIDTH']
+    adaptive = request.args.get('adaptive', '1' if app.config['STREAM_ADAPTIVE'] else '0')
+    # Client chọn cố định chất lượng / độ phân giải thì không tự điều chỉnh
+    fixed = 'quality' in request.args or 'width' in request.args
+    ladder = AdaptiveProfile.LADDER if not fixed else ((width, quality),)
+    return AdaptiveProfile(max_width=width, quality=quality, ladder=ladder,
+                           adaptive=adaptive not in ('0', 'false') and not fixed)
+
+# Hàm tạo luồng frame (Generator Function)
+def generate_frames(source=None, profile=None):
+    # Mở camera (số 0 thường là webcam mặc định của laptop)
+    if source is None:
+        source = app.config['LIVE_SOURCE']
+
+    # Yield (trả về liên tục) frame theo định dạng multipart/x-mixed-replace
+    # Đây là chuẩn để trình duyệt hiểu là luồng video MJPEG
+    yield from live_broadcasters.stream(source, profile)
 
 # 2. LOAD MODEL AUDIO (Audio Model)
+def predict_audio_timeline(audio_path, content_hash=None):
+    """
+    Phân loại audio theo cửa sổ trượt, trả về timeline xác suất từng cửa sổ
+    content_hash: SHA-256 của file nếu đã có (không phải hash lại khi tra cache MFCC)
+    """
+    if not audio_path:
+        return []
+    try:
+        return get_audio_classifier().classify_file(audio_path, content_hash=content_hash)
+    except Exception as e:
+        print(f"Error processing {audio_path}: {e}")
+        return []
+
 def predict_audio(audio_path):
     if not audio_path:
-        return None, None
-    # Ví dụ: Model audio của bạn xử lý file .mp3/.wav và trả về string
-    feature = extract_features(audio_path)
-    if feature is None:
-        return "Error: Can extract features"
-    feature_reshaped = feature.reshape(1, feature.shape[0], feature.shape[1], 1)
-    prediction = audio_model.predict(feature_reshaped, verbose=0)[0]
-    # 4. Lấy kết quả tốt nhất (Top 1)
-    best_idx = np.argmax(prediction) # Lấy vị trí có xác suất cao nhất
-    best_label = CLASS_LABELS[best_idx]    # Map sang tên
-    confidence = prediction[best_idx] # Lấy độ tin cậy (vd: 0.95)
-    return best_label, confidence
+        return None, None, None
+    # Chạy model trên toàn bộ file (theo cửa sổ), rồi gộp lại thành 1 nhãn
+    timeline = predict_audio_timeline(audio_path)
+    if not timeline:
+        return "Error: Can extract features", None, None
+    # 4. Lấy kết quả tốt nhất (Top 1) theo xác suất trung bình các cửa sổ,
+    # kèm xác suất của mọi class
+    best_label, confidence = summarize_timeline(timeline, CLASS_LABELS)
+    return best_label, confidence, mean_probs(timeline, CLASS_LABELS)
 
 @app.route('/', methods=['GET', 'POST'])
 
@@ -106,40 +431,233 @@ def index():
             return 'No file part'
         file = request.files['file']
         if file.filename == '':
+            request.discard_uploads()
             return 'No selected file'
 
-        # Lưu file input
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(filepath)
+        media_type = get_media_type(file.filename)
+        if media_type is None:
+            request.discard_uploads()
+            return "File format not supported"
+
+        # File input đã được ghi xong trong lúc nhận request (uploads/<upload_id>/<tên file>)
+        upload = file.stream
+        upload.close()
+        filepath = upload.path
 
-        # Xử lý dựa trên loại file
-        output_filename = 'processed_' + file.filename
+        # Xử lý dựa trên loại file, output cũng nằm trong thư mục riêng của lần upload
+        output_filename = f"{request.upload_id}/processed_{os.path.basename(filepath)}"
         output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        detected_label =""
-        if file_ext in ['.jpg', '.jpeg', '.png']:
-            process_image(filepath, output_path)
-            media_type = 'image'
-        elif file_ext in ['.mp4', '.avi', '.mov']:
-            process_video(filepath, output_path)
-            media_type = 'video'
-        elif file_ext in['.wav', '.mp3']:
-            detected_label = process_audio_only(filepath, output_path)
-            media_type = 'audio'
-        else:
-            return "File format not supported"
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        # File đã xử lý trước đó (cùng nội dung, cùng model + tham số) -> trả kết quả ngay
+        # (hash đã được tính trong lúc nhận file, không phải đọc lại)
+        cache_key = None
+        if result_cache is not None:
+            cache_key = result_cache.make_key(upload.hexdigest(), **cache_params(media_type))
+            cached = restore_cached_result(cache_key, output_path, output_filename)
+            if cached is not None:
+                if not app.config['KEEP_UPLOADS']:
+                    request.discard_uploads()
+                job = job_manager.add_finished(media_type, cached, meta={'cached': True})
+                if request.accept_mimetypes.best == 'application/json':
+                    return jsonify(job.to_dict()), 200
+                return job_result(job.id)
+
+        # Đưa vào hàng đợi và trả về ngay, trình duyệt sẽ hỏi tiến độ qua /jobs/<id>
+        try:
+            job = job_manager.submit(media_type, run_upload_job, media_type,
+                                     filepath, output_path, output_filename,
+                                     cache_key=cache_key, content_hash=upload.hexdigest())
+        except QueueFullError as e:
+            return str(e), 503
 
-        return render_template('index.html', result=output_filename, type=media_type, label = detected_label)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(job.to_dict()), 202
+        return render_template('index.html', result=None, job_id=job.id)
 
     return render_template('index.html', result=None)
 
 
+def get_media_type(filename):
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext in ['.jpg', '.jpeg', '.png']:
+        return 'image'
+    elif file_ext in ['.mp4', '.avi', '.mov']:
+        return 'video'
+    elif file_ext in['.wav', '.mp3']:
+        return 'audio'
+    return None
+
+
+# API chỉ trả về detections (class, confidence, xyxy, frame, timestamp), không vẽ / encode:
+# - POST ảnh -> JSON
+# - POST video -> NDJSON (mỗi dòng một frame, trả về dần trong lúc xử lý)
+# - GET -> NDJSON liên tục của nguồn live (LIVE_SOURCE), dùng chung thread đọc + YOLO với
+#   /video_feed (DETECT_CONF, DETECT_IOU): conf lớn hơn chỉ lọc bớt box, iou không áp dụng
+# Tham số query: conf, iou
+@app.route('/api/detect', methods=['GET', 'POST'])
+def api_detect():
+    conf = request.args.get('conf', app.config['DETECT_CONF'], type=float)
+    iou = request.args.get('iou', app.config['DETECT_IOU'], type=float)
+
+    if request.method == 'GET':
+        return ndjson_response(live_broadcasters.records(app.config['LIVE_SOURCE'],
+                                                         min_conf=conf))
+
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        request.discard_uploads()
+        return jsonify({'error': 'no file'}), 400
+    media_type = get_media_type(file.filename)
+    if media_type not in ('image', 'video'):
+        request.discard_uploads()
+        return jsonify({'error': 'only images and videos are supported'}), 400
+
+    file.stream.close()
+    filepath = file.stream.path
+    upload_dir = os.path.dirname(filepath)
+
+    if media_type == 'image':
+        try:
+            return jsonify(api_processor.detect_image(filepath, conf=conf, iou=iou))
+        finally:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def records():
+        try:
+            yield from api_processor.detect_video(filepath, conf=conf, iou=iou,
+                                                  batch_size=app.config['YOLO_BATCH_SIZE'])
+        finally:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+    return ndjson_response(records())
+
+
+def ndjson_response(records):
+    # Mỗi bản ghi một dòng JSON, gửi ngay khi có (client đọc dần)
+    def lines():
+        for record in records:
+            yield json.dumps(record) + '\n'
+    return Response(lines(), mimetype='application/x-ndjson')
+
+
+def run_upload_job(job, media_type, filepath, output_path, output_filename, cache_key=None,
+                   content_hash=None):
+    """
+    Chạy trong worker của JobManager
+    content_hash: SHA-256 của file upload (tính lúc nhận file), dùng làm khóa cache MFCC
+    """
+    detected_label = ""
+    probs = None
+    timeline = []
+    segments = []
+    tracks = []
+    detections = []
+    try:
+        if media_type == 'image':
+            job.set_progress(0, 1)
+            detections = process_image(filepath, output_path)
+            job.set_progress(1)
+        elif media_type == 'video':
+            segments, tracks = process_video(filepath, output_path, progress=job.set_progress)
+        else:
+            job.set_progress(0, 1)
+            detected_label, timeline, probs = process_audio_only(filepath, output_path,
+                                                                 content_hash)
+            job.set_progress(1)
+    finally:
+        # Xong thì bỏ file upload (thư mục riêng của lần upload)
+        if not app.config['KEEP_UPLOADS']:
+            shutil.rmtree(os.path.dirname(filepath), ignore_errors=True)
+
+    result = {'result': output_filename, 'type': media_type, 'label': detected_label,
+              'probs': probs, 'timeline': timeline, 'segments': segments, 'tracks': tracks,
+              'detections': detections}
+    if cache_key is not None:
+        try:
+            result_cache.put(cache_key, result, files={'output': output_path})
+        except OSError as e:
+            print(f"Không ghi được cache cho {filepath}: {e}")
+    return result
+
+
+# Danh sách camera (GET) / thêm camera (POST JSON {"id": ..., "source": ...})
+@app.route('/cameras', methods=['GET', 'POST'])
+def cameras():
+    if request.method == 'GET':
+        return jsonify(camera_manager.list())
+    data = request.get_json(silent=True) or {}
+    camera_id, source = data.get('id'), data.get('source')
+    if camera_id is None or source is None:
+        return jsonify({'error': 'id and source are required'}), 400
+    try:
+        camera = camera_manager.add(str(camera_id), parse_source(source))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except IOError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(camera.stats()), 201
+
+
+@app.route('/cameras/<camera_id>', methods=['DELETE'])
+def remove_camera(camera_id):
+    if not camera_manager.remove(camera_id):
+        return jsonify({'error': 'camera not found'}), 404
+    return jsonify({'removed': camera_id})
+
+
+# Luồng MJPEG đã vẽ box của một camera
+@app.route('/cameras/<camera_id>/video_feed')
+def camera_feed(camera_id):
+    camera = camera_manager.get(camera_id)
+    if camera is None:
+        return jsonify({'error': 'camera not found'}), 404
+    return Response(camera.mjpeg(stream_profile()),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+# Luồng NDJSON detections của một camera (không vẽ / encode)
+@app.route('/cameras/<camera_id>/detections')
+def camera_detections(camera_id):
+    camera = camera_manager.get(camera_id)
+    if camera is None:
+        return jsonify({'error': 'camera not found'}), 404
+    return ndjson_response(camera.records())
+
+
+# Route trả về trạng thái / tiến độ của job
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+# Route trả về kết quả khi job đã xong
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    if job.status == 'error':
+        return jsonify(job.to_dict()), 500
+    if job.status != 'done':
+        return jsonify(job.to_dict()), 202
+
+    result = job.result
+    return render_template('index.html', result=result['result'], type=result['type'],
+                           label=result['label'], probs=result.get('probs'),
+                           timeline=result['timeline'],
+                           segments=result['segments'], tracks=result.get('tracks', []))
+
+
 # 2. Route để phục vụ luồng video
 @app.route('/video_feed')
 def video_feed():
     # Trả về Response với mimetype đặc biệt này
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(generate_frames(profile=stream_profile()),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
 # 3. Route cho trang giao diện Live
 @app.route('/live')
@@ -149,71 +667,130 @@ def live_page():
 
 
 # --- THÊM HÀM XỬ LÝ RIÊNG CHO AUDIO ---
-def process_audio_only(input_path, output_path):
+def process_audio_only(input_path, output_path, content_hash=None):
     # 1. Chạy model dự đoán
-    label = predict_audio(input_path)
+    timeline = predict_audio_timeline(input_path, content_hash)
+    label, confidence = summarize_timeline(timeline, CLASS_LABELS)
     
     # 2. Copy file gốc sang thư mục static để web có thể phát được
     # (Vì ta không chỉnh sửa nội dung âm thanh, chỉ cần copy qua)
     shutil.copyfile(input_path, output_path)
     
-    return label
+    return label, timeline, mean_probs(timeline, CLASS_LABELS)
 
 def process_image(input_path, output_path):
     # Chạy YOLO
-    results = yolo_model.predict(source=input_path, conf = 0.35, iou = 0.5, imgsz = 640)
+    with STAGE_SECONDS.time(pipeline='image', stage='decode'):
+        img = cv2.imread(input_path)
+    with STAGE_SECONDS.time(pipeline='image', stage='infer'):
+        detections = get_upload_detector().predict([img], conf=app.config['DETECT_CONF'],
+                                                   iou=app.config['DETECT_IOU'])[0]
     # Vẽ box và lưu ảnh
-    res_plotted = results[0].plot()
-    cv2.imwrite(output_path, res_plotted)
-
-def process_video(input_path, output_path):
-    # Sử dụng MoviePy để xử lý video và audio dễ dàng hơn
-    clip = VideoFileClip(input_path)
-    audio_label = ""
+    with STAGE_SECONDS.time(pipeline='image', stage='plot'):
+        res_plotted = detections.plot(img)
+    with STAGE_SECONDS.time(pipeline='image', stage='encode'):
+        cv2.imwrite(output_path, res_plotted)
+    return detections.to_list()
 
+def process_video(input_path, output_path, progress=None):
     # --- BƯỚC 1: XỬ LÝ AUDIO (Nếu có) ---
-    if clip.audio is not None:
-        # Trích xuất audio ra file tạm để model audio xử lý
-        temp_audio = "temp_audio.wav"
-        clip.audio.write_audiofile(temp_audio, logger=None)
-        
-        # Chạy model Audio
-        audio_label, confidence = predict_audio(temp_audio)
-        # Xóa file tạm
-        if os.path.exists(temp_audio):
-            os.remove(temp_audio)   
+    # Audio được giải mã (ffmpeg pipe) và phân loại song song ở thread riêng,
+    # kết quả đổ dần vào bộ fusion theo timeline
+    fusion = FusionStream(CLASS_LABELS, alpha=app.config['FUSION_ALPHA'])
+    threading.Thread(target=feed_audio, args=(fusion, input_path), daemon=True).start()
 
-    # --- BƯỚC 2: XỬ LÝ HÌNH ẢNH + LATE FUSION ---
-    # Hàm xử lý từng frame
-    def process_frame(frame):
-        # Frame từ moviepy là RGB, YOLO nhận tốt
-        results = yolo_model(frame, conf = 0.35, iou = 0.5, imgsz=640)
-        annotated_frame = results[0].plot() # Vẽ Bounding Box (Visual Output)
+    # Track id cho từng vật thể, class của track = bỏ phiếu qua các frame + audio
+    tracker = make_tracker()
 
+    # --- BƯỚC 2: XỬ LÝ HÌNH ẢNH + LATE FUSION ---
+    # Hàm vẽ kết quả cho từng frame
+    def annotate_frame(frame, detections, timestamp):
         # === LATE FUSION TẠI ĐÂY ===
-        # Ghi kết quả Audio lên hình ảnh Video
-        if audio_label:
-            # Vẽ hình chữ nhật nền cho chữ
-            cv2.rectangle(annotated_frame, (10, 10), (400, 60), (0, 0, 255), -1)
-            # Viết text kết quả Audio
-            cv2.putText(annotated_frame, f"Audio: {audio_label}", (20, 45), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        
+        # Điểm visual của frame + xác suất audio tại cùng thời điểm
+        visual = visual_class_scores(detections, CLASS_LABELS)
+        fused = fusion.fuse([timestamp], [visual], wait=True)
+        if tracker is not None and fused.has_audio[0]:
+            tracker.add_audio(fused.audio[0])
+
+        annotated_frame = detections.plot(frame, copy=False) # Vẽ Bounding Box (Visual Output)
+        audio_label = CLASS_LABELS[int(fused.audio[0].argmax())] if fused.has_audio[0] else ""
+        draw_fusion_overlay(annotated_frame, audio_label, fusion.label(int(fused.ids[0])))
         return annotated_frame
 
-    # Áp dụng hàm xử lý cho toàn bộ video
-    new_clip = clip.fl_image(process_frame)
+    # Pipeline 3 tầng: decode -> YOLO theo batch -> vẽ + encode H.264 (libx264 để web xem được)
+    # Audio gốc được ghép thẳng vào file output trong cùng một lần encode
+    pipeline = VideoPipeline(get_upload_detector(),
+                             batch_size=app.config['YOLO_BATCH_SIZE'],
+                             conf=detect_conf(tracker), iou=app.config['DETECT_IOU'],
+                             verify=app.config['VERIFY_BATCHED_INFERENCE'],
+                             detect_every=app.config['VIDEO_DETECT_EVERY'],
+                             gate=make_motion_gate('video'))
+    pipeline.run(input_path, output_path, annotate=annotate_frame, keep_audio=True,
+                 progress=progress, tracker=tracker)
+
+    # Các đoạn (segment) theo nhãn đã fuse + tóm tắt từng track
+    tracks = tracker.summaries() if tracker is not None else []
+    return fusion.pop_segments(final=True), tracks
+
+
+def feed_audio(fusion, source, max_batch=None, block_seconds=5.0, stop_event=None):
+    """
+    Phân loại audio của nguồn theo cửa sổ và đẩy dần vào FusionStream
+    """
+    try:
+        blocks = iter_ffmpeg_blocks(source, sr=DEFAULT_SAMPLE_RATE, block_seconds=block_seconds)
+        for entries in get_audio_classifier().iter_timeline(blocks, DEFAULT_SAMPLE_RATE, max_batch):
+            fusion.add_audio(entries)
+            if stop_event is not None and stop_event.is_set():
+                break
+    except Exception as e:
+        print(f"Error processing audio of {source}: {e}")
+    finally:
+        fusion.finish_audio()
+
+
+def draw_fusion_overlay(annotated_frame, audio_label, fused_label):
+    # Ghi kết quả Audio + kết quả Fusion lên hình ảnh Video
+    if not audio_label and not fused_label:
+        return
+    # Vẽ hình chữ nhật nền cho chữ
+    cv2.rectangle(annotated_frame, (10, 10), (400, 100), (0, 0, 255), -1)
+    # Viết text kết quả Audio
+    cv2.putText(annotated_frame, f"Audio: {audio_label}", (20, 45), 
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+    cv2.putText(annotated_frame, f"Fusion: {fused_label}", (20, 85), 
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+
+
+# Thời gian load / warm-up và bộ nhớ của từng model
+@app.route('/models')
+def model_stats():
+    return jsonify(model_registry.stats())
+
+# Thống kê inference server (số batch, frame đang chờ, thời gian ước lượng mỗi frame)
+@app.route('/inference')
+def inference_stats():
+    return jsonify(server_stats())
 
-    # Giữ lại audio gốc của video (nếu có)
-    if clip.audio is not None:
-        new_clip = new_clip.set_audio(clip.audio)
+# Thống kê cache kết quả (số mục, dung lượng, hit / miss)
+@app.route('/cache')
+def cache_stats():
+    mfcc = mfcc_cache.stats() if mfcc_cache is not None else None
+    if result_cache is None:
+        return jsonify({'enabled': False, 'mfcc': mfcc})
+    return jsonify(dict(result_cache.stats(), enabled=True, mfcc=mfcc))
 
-    # Xuất file (dùng codec libx264 để web xem được)
-    new_clip.write_videofile(output_path, codec='libx264', audio_codec='aac', logger=None)
+# Metrics dạng text của Prometheus (thời gian từng bước, frame live, hàng đợi, job)
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
-@app.route('/static/<filename>')
+# conditional=True: hỗ trợ header Range (206) để thẻ <video> tua được mà không tải cả file,
+# cùng ETag / Last-Modified cho cache của trình duyệt.
+# Thay cho route static mặc định của Flask (tắt ở trên) nên url_for('static', ...) vẫn dùng được
+@app.route('/static/<path:filename>', endpoint='static')
 def serve_file(filename):
-    return send_from_directory(app.config['OUTPUT_FOLDER'], filename)
+    return send_from_directory(app.config['OUTPUT_FOLDER'], filename, conditional=True)
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,97 @@
+import glob
+import json
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+pytest.importorskip('soundfile')
+
+from utils.batch_runner import CHECKPOINT_NAME, BatchRunner, ShardWriter
+
+VIDEOS = {'a.mp4': 10, 'b.mp4': 5}
+
+
+class Stop(BaseException):
+    # Dừng cả lần chạy như Ctrl+C (BatchRunner chỉ bắt Exception của từng video)
+    pass
+
+
+class FakeProcessor:
+    """
+    detect_video trả về bản ghi từng frame; stop_after: dừng (Stop) sau ngần ấy frame
+    """
+
+    def __init__(self, stop_after=None):
+        self.stop_after = stop_after
+        self.frames = 0
+
+    def detect_video(self, path, conf=None, iou=None, batch_size=None):
+        for index in range(VIDEOS[os.path.basename(path)]):
+            if self.stop_after is not None and self.frames >= self.stop_after:
+                raise Stop
+            self.frames += 1
+            yield {'frame': index, 'timestamp': index / 25}
+
+
+def run(output_dir, processor, close_on_stop=True):
+    writer = ShardWriter(output_dir, shard_size=3)
+    runner = BatchRunner('videos', writer, processor)
+    try:
+        runner.run({'video': sorted(VIDEOS)})
+    except Stop:
+        if not close_on_stop:
+            return writer
+    writer.close()
+    return writer
+
+
+def read_records(output_dir):
+    records = []
+    for path in sorted(glob.glob(os.path.join(output_dir, 'shard-*.jsonl'))):
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f)
+    return records
+
+
+def assert_complete(output_dir):
+    records = read_records(output_dir)
+    frames = sorted((r['path'], r['frame']) for r in records if r['type'] == 'video_frame')
+    expected = sorted((path, i) for path, count in VIDEOS.items() for i in range(count))
+    assert frames == expected
+    videos = sorted((r['path'], r['frames']) for r in records if r['type'] == 'video')
+    assert videos == sorted(VIDEOS.items())
+
+
+def test_resume_after_stop_mid_video(tmp_path):
+    output_dir = str(tmp_path)
+    writer = run(output_dir, FakeProcessor(stop_after=7))
+    assert writer.progress == {'a.mp4': 7}
+    assert run(output_dir, FakeProcessor()).done == set(VIDEOS)
+    assert_complete(output_dir)
+
+
+def test_resume_after_crash_loses_only_unfinished_shard(tmp_path):
+    output_dir = str(tmp_path)
+    # Không close: shard đang ghi (.tmp) bị mất như khi tiến trình bị kill
+    run(output_dir, FakeProcessor(stop_after=12), close_on_stop=False)
+    writer = ShardWriter(output_dir, shard_size=3)
+    # 4 shard hoàn chỉnh: 10 frame + bản ghi 'video' của a, frame đầu của b;
+    # frame thứ 2 của b nằm trong shard .tmp bị mất
+    assert writer.done == {'a.mp4'}
+    assert writer.progress == {'b.mp4': 1}
+    run(output_dir, FakeProcessor())
+    assert_complete(output_dir)
+
+
+def test_torn_checkpoint_line_is_dropped(tmp_path):
+    output_dir = str(tmp_path)
+    run(output_dir, FakeProcessor(stop_after=7), close_on_stop=False)
+    checkpoint = os.path.join(output_dir, CHECKPOINT_NAME)
+    with open(checkpoint, 'a') as f:
+        f.write('{"file": "shard-000')
+    run(output_dir, FakeProcessor())
+    assert_complete(output_dir)
+    # Checkpoint đọc lại được đủ các dòng (dòng ghi dở không dính vào dòng sau)
+    assert ShardWriter(output_dir, shard_size=3).done == set(VIDEOS)
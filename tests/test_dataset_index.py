@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils import dataset_index
+from utils.dataset_index import DatasetIndex
+
+
+@pytest.fixture(autouse=True)
+def scan_in_name_order(monkeypatch):
+    # Thứ tự os.scandir tùy filesystem: cố định theo tên file để thứ tự scandir luôn khác
+    # thứ tự trong index sau khi cập nhật
+    scan_labels = dataset_index.scan_labels
+    monkeypatch.setattr(dataset_index, 'scan_labels',
+                        lambda *args: sorted(scan_labels(*args), key=lambda entry: entry[1]))
+
+
+def write_label(root, name, cls, count, mtime_ns):
+    path = os.path.join(root, 'train', 'labels', name)
+    with open(path, 'w') as f:
+        for _ in range(count):
+            f.write(f"{cls} 0.5 0.5 0.1 0.1\n")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def classes_by_file(index):
+    result = {}
+    for file_id, cls in zip(index.box_file, index.box_class):
+        result.setdefault(str(index.file_name[file_id]), []).append(int(cls))
+    return result
+
+
+def test_boxes_stay_with_their_files_across_incremental_updates(tmp_path):
+    root = str(tmp_path)
+    os.makedirs(os.path.join(root, 'train', 'labels'))
+    write_label(root, 'a.txt', 0, 1, 1_000_000_000)
+    write_label(root, 'b.txt', 1, 2, 1_000_000_000)
+    write_label(root, 'c.txt', 2, 3, 1_000_000_000)
+    index = DatasetIndex(root, splits=('train',))
+    assert index.update() == (3, 0)
+
+    # Lần 1: a đổi -> a bị đưa xuống cuối index
+    write_label(root, 'a.txt', 0, 4, 2_000_000_000)
+    assert index.update() == (1, 0)
+    # Lần 2: b đổi -> thứ tự trong index (c, a) khác thứ tự scandir
+    write_label(root, 'b.txt', 1, 5, 3_000_000_000)
+    assert index.update() == (1, 0)
+
+    expected = {'a.txt': [0] * 4, 'b.txt': [1] * 5, 'c.txt': [2] * 3}
+    assert classes_by_file(index) == expected
+    # Index đọc lại từ file .npz cũng phải giống
+    assert classes_by_file(DatasetIndex(root, splits=('train',))) == expected
+    boxes, images = index.class_counts(3)
+    assert boxes.tolist() == [4, 5, 3]
+    assert images.tolist() == [1, 1, 1]
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from utils.detections import Detections
+from utils.live_reader import LiveDetector
+
+
+class SlowDetect:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.calls = 0
+
+    def __call__(self, frame):
+        self.calls += 1
+        time.sleep(self.seconds)
+        return Detections([[10, 10, 30, 30]], [0.9], [0], {0: 'drone'})
+
+
+def run_frames(detector, count):
+    frame = np.zeros((64, 64, 3), np.uint8)
+    for _ in range(count):
+        assert detector.process(frame, time.monotonic()) is not None
+
+
+def test_over_budget_still_detects_every_force_every_frames():
+    detect = SlowDetect(0.06)
+    # YOLO (0.06s) luôn lâu hơn ngân sách độ trễ (0.05s)
+    detector = LiveDetector(detect, max_latency=0.05, force_every=5, force_interval=None,
+                            budget_decay=1.0)
+    run_frames(detector, 21)
+    # Frame đầu + mỗi 5 frame một lần bắt buộc
+    assert detect.calls == 5
+    assert detector.forced == 4
+
+
+def test_over_budget_forced_by_interval():
+    detect = SlowDetect(0.06)
+    detector = LiveDetector(detect, max_latency=0.05, force_every=None, force_interval=0.05,
+                            budget_decay=1.0)
+    run_frames(detector, 4)
+    assert detect.calls >= 3
+
+
+def test_detect_time_recovers_when_detector_gets_fast():
+    detect = SlowDetect(0.06)
+    detector = LiveDetector(detect, max_latency=0.05, force_every=3, force_interval=None)
+    run_frames(detector, 1)
+    assert detector.detect_time > 0.05
+    detect.seconds = 0.0
+    run_frames(detector, 20)
+    # Lần chạy bắt buộc đo lại thời gian -> hết vượt ngân sách, chạy YOLO mọi frame
+    assert detector.detect_time < 0.05
+    calls = detect.calls
+    run_frames(detector, 5)
+    assert detect.calls == calls + 5
@@ -0,0 +1,137 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('tqdm')
+pytest.importorskip('yaml')
+
+from utils import merge_data
+
+
+def write_pair(root, subset, name, cls):
+    for folder in ('images', 'labels'):
+        os.makedirs(os.path.join(root, subset, folder), exist_ok=True)
+    with open(os.path.join(root, subset, 'labels', f'{name}.txt'), 'w') as f:
+        f.write(f"{cls} 0.5 0.5 0.1 0.1\n")
+    with open(os.path.join(root, subset, 'images', f'{name}.jpg'), 'wb') as f:
+        f.write(b'jpg')
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    a = str(tmp_path / 'a')
+    b = str(tmp_path / 'b')
+    write_pair(a, 'train', 'a1', 0)
+    write_pair(a, 'train', 'a2', 1)
+    write_pair(b, 'train', 'b1', 0)
+    write_pair(b, 'valid', 'b2', 0)
+    config = {'output_dir': str(tmp_path / 'out'), 'subsets': ['train', 'valid'],
+              'names': merge_data.CLASS_NAMES,
+              'sources': {'A': {'path': a, 'map': {0: 0, 1: 1}},
+                          'B': {'path': b, 'map': {0: 2}}}}
+    return config
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    # Ghi lại các label thực sự được xử lý trong mỗi lần chạy
+    keys = []
+    process_item = merge_data.process_item
+
+    def recording(task, mapping, mode):
+        keys.append(task[0])
+        return process_item(task, mapping, mode)
+
+    monkeypatch.setattr(merge_data, 'process_item', recording)
+    return keys
+
+
+def output_label(config, subset, name):
+    path = os.path.join(config['output_dir'], subset, 'labels', name)
+    with open(path) as f:
+        return f.read().split()[0]
+
+
+def manifest(config):
+    with open(os.path.join(config['output_dir'], merge_data.MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def test_rerun_skips_unchanged_labels(dataset, processed):
+    merge_data.process_dataset(dataset)
+    assert len(processed) == 4
+    del processed[:]
+    merge_data.process_dataset(dataset)
+    assert processed == []
+
+
+def test_resume_after_interruption(dataset, processed, monkeypatch):
+    process_item = merge_data.process_item
+
+    def failing(task, mapping, mode):
+        if len(processed) >= 2:
+            raise KeyboardInterrupt
+        return process_item(task, mapping, mode)
+
+    monkeypatch.setattr(merge_data, 'process_item', failing)
+    with pytest.raises(KeyboardInterrupt):
+        merge_data.process_dataset(dataset, workers=1, save_every=1)
+    done = set(processed)
+    assert len(done) == 2
+
+    monkeypatch.setattr(merge_data, 'process_item', process_item)
+    del processed[:]
+    merge_data.process_dataset(dataset, workers=1)
+    assert len(processed) == 2
+    assert not done & set(processed)
+    assert len(manifest(dataset)['items']) == 4
+
+
+def test_changed_mapping_only_redoes_that_source(dataset, processed):
+    merge_data.process_dataset(dataset)
+    del processed[:]
+    dataset['sources']['B']['map'] = {0: 3}
+    merge_data.process_dataset(dataset)
+    assert sorted(processed) == ['B/train/b1.txt', 'B/valid/b2.txt']
+    assert output_label(dataset, 'train', 'B_b1.txt') == '3'
+    assert output_label(dataset, 'train', 'A_a1.txt') == '0'
+
+
+def test_unscanned_subset_is_redone_when_it_comes_back(dataset, processed, tmp_path):
+    merge_data.process_dataset(dataset)
+    b_valid = os.path.join(dataset['sources']['B']['path'], 'valid')
+    hidden = str(tmp_path / 'hidden')
+    os.rename(b_valid, hidden)
+
+    # Mapping đổi khi B/valid không quét được: giữ output + bản ghi cũ của B/valid
+    dataset['sources']['B']['map'] = {0: 3}
+    merge_data.process_dataset(dataset)
+    assert 'B/valid/b2.txt' in manifest(dataset)['items']
+    assert output_label(dataset, 'val', 'B_b2.txt') == '2'
+
+    # B/valid quay lại (b2 đã bị xóa, có b3 mới): làm lại theo mapping mới, xóa output của b2
+    os.rename(hidden, b_valid)
+    os.remove(os.path.join(b_valid, 'labels', 'b2.txt'))
+    write_pair(dataset['sources']['B']['path'], 'valid', 'b3', 0)
+    del processed[:]
+    merge_data.process_dataset(dataset)
+    assert processed == ['B/valid/b3.txt']
+    assert output_label(dataset, 'val', 'B_b3.txt') == '3'
+    assert not os.path.exists(os.path.join(dataset['output_dir'], 'val', 'labels', 'B_b2.txt'))
+    assert 'B/valid/b2.txt' not in manifest(dataset)['items']
+
+
+def test_removed_source_is_kept_unless_prune(dataset):
+    merge_data.process_dataset(dataset)
+    b_output = os.path.join(dataset['output_dir'], 'train', 'labels', 'B_b1.txt')
+    del dataset['sources']['B']
+
+    merge_data.process_dataset(dataset)
+    assert os.path.exists(b_output)
+    assert 'B/train/b1.txt' in manifest(dataset)['items']
+
+    merge_data.process_dataset(dataset, prune=True)
+    assert not os.path.exists(b_output)
+    assert all(not key.startswith('B/') for key in manifest(dataset)['items'])
+    assert all(not scope.startswith('B/') for scope in manifest(dataset)['sources'])
@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+from utils.inference_server import PRIORITY_LIVE, PRIORITY_OFFLINE, serve
+from utils.micro_batcher import MicroBatcher
+
+
+class Recorder:
+    """
+    run_batch ghi lại (key, mẫu) của từng batch; batch có key 'block' giữ worker lại
+    tới khi release() để các request sau xếp hàng cùng lúc
+    """
+
+    def __init__(self, seconds_per_item=0.0):
+        self.seconds_per_item = seconds_per_item
+        self.batches = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self, items, key):
+        if key == 'block':
+            self.started.set()
+            self.gate.wait(5)
+        else:
+            self.batches.append((key, list(items)))
+            time.sleep(self.seconds_per_item * len(items))
+        return items
+
+    def hold(self, batcher):
+        future = batcher.submit([None], priority=PRIORITY_LIVE, key='block')
+        assert self.started.wait(5)
+        return future
+
+    def release(self):
+        self.gate.set()
+
+
+def make_batcher(recorder, **kwargs):
+    kwargs.setdefault('max_wait', 0.001)
+    return MicroBatcher(recorder, name='test', **kwargs)
+
+
+def test_live_is_served_before_earlier_offline():
+    recorder = Recorder()
+    batcher = make_batcher(recorder, live_window=None)
+    recorder.hold(batcher)
+    offline = batcher.submit(['o1', 'o2'], priority=PRIORITY_OFFLINE, key='a')
+    live = batcher.submit(['l1'], priority=PRIORITY_LIVE, key='b')
+    recorder.release()
+
+    assert live.result(5) == ['l1']
+    assert offline.result(5) == ['o1', 'o2']
+    assert [key for key, _ in recorder.batches] == ['b', 'a']
+    batcher.stop()
+
+
+def test_waiting_offline_is_promoted_after_max_delay():
+    recorder = Recorder()
+    batcher = make_batcher(recorder, max_delay=0.05, live_window=None)
+    recorder.hold(batcher)
+    offline = batcher.submit(['o'], priority=PRIORITY_OFFLINE, key='a')
+    time.sleep(0.1)
+    live = batcher.submit(['l'], priority=PRIORITY_LIVE, key='b')
+    recorder.release()
+
+    offline.result(5), live.result(5)
+    assert [key for key, _ in recorder.batches] == ['a', 'b']
+    batcher.stop()
+
+
+def test_only_same_key_requests_share_a_batch():
+    recorder = Recorder()
+    batcher = make_batcher(recorder, live_window=None)
+    recorder.hold(batcher)
+    futures = [batcher.submit([i], priority=PRIORITY_OFFLINE, key=key)
+               for i, key in enumerate(['a', 'b', 'a', 'b'])]
+    recorder.release()
+
+    assert [f.result(5) for f in futures] == [[0], [1], [2], [3]]
+    assert sorted(recorder.batches) == [('a', [0, 2]), ('b', [1, 3])]
+    batcher.stop()
+
+
+def test_offline_batches_are_capped_while_live_is_active():
+    recorder = Recorder(seconds_per_item=0.005)
+    batcher = make_batcher(recorder, max_batch=16, latency_budget={PRIORITY_LIVE: 0.012},
+                           live_window=5.0)
+    assert batcher.submit(['l'], priority=PRIORITY_LIVE, key='a').result(5) == ['l']
+    items = list(range(10))
+    assert batcher.submit(items, priority=PRIORITY_OFFLINE, key='a').result(5) == items
+
+    offline_sizes = [len(batch) for _, batch in recorder.batches[1:]]
+    assert sum(offline_sizes) == 10
+    assert max(offline_sizes) <= 2
+    batcher.stop()
+
+
+def test_offline_batches_are_full_without_live():
+    recorder = Recorder(seconds_per_item=0.005)
+    batcher = make_batcher(recorder, max_batch=16, latency_budget={PRIORITY_LIVE: 0.012})
+    items = list(range(10))
+    assert batcher.submit(items, priority=PRIORITY_OFFLINE, key='a').result(5) == items
+    assert [len(batch) for _, batch in recorder.batches] == [10]
+    batcher.stop()
+
+
+class FakeDetector:
+    engine = 'fake'
+    model_path = 'fake.pt'
+    conf = 0.4
+    iou = 0.5
+    names = {0: 'cat'}
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, frames, conf=None, iou=None):
+        self.calls.append((len(frames), conf, iou))
+        return [(frame, conf, iou) for frame in frames]
+
+
+def test_served_detector_uses_detector_thresholds_by_default():
+    detector = FakeDetector()
+    server = serve(detector, max_batch=4)
+    try:
+        assert server.submit(['f'], priority=PRIORITY_LIVE).result(5) == [('f', 0.4, 0.5)]
+        assert server.submit(['g'], conf=0.2).result(5) == [('g', 0.2, 0.5)]
+    finally:
+        server.stop()
+
+
+def test_serve_rejects_different_options_for_the_same_detector():
+    detector = FakeDetector()
+    server = serve(detector, max_batch=4)
+    try:
+        assert serve(detector, max_batch=4) is server
+        with pytest.raises(ValueError):
+            serve(detector, max_batch=8)
+    finally:
+        server.stop()
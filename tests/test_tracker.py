@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from utils.detections import Detections
+from utils.tracker import ByteTracker
+
+NAMES = {0: 'drone', 1: 'bird'}
+
+
+def detections(conf, cls=0, box=(100, 100, 140, 130)):
+    return Detections([box], [conf], [cls], NAMES)
+
+
+def test_thresholds_follow_detector_conf():
+    tracker = ByteTracker(det_thresh=0.35)
+    assert tracker.high_thresh == 0.35
+    assert tracker.new_track_thresh == 0.35
+    # Box 0.4 (detector chạy conf=0.35) phải được track ngay frame đầu
+    out = tracker.update(detections(0.4), 0.0)
+    assert len(out) == 1
+    assert out.track_ids.tolist() == [1]
+    summaries = tracker.summaries()
+    assert len(summaries) == 1
+    assert summaries[0]['class'] == 'drone'
+
+
+def test_fixed_high_threshold_drops_low_confidence_boxes():
+    tracker = ByteTracker(det_thresh=0.5)
+    assert len(tracker.update(detections(0.4), 0.0)) == 0
+    assert tracker.summaries() == []
+
+
+def test_track_keeps_id_across_updates():
+    tracker = ByteTracker(det_thresh=0.35)
+    first = tracker.update(detections(0.6), 0.0)
+    second = tracker.update(detections(0.6, box=(103, 101, 143, 131)), 0.04)
+    assert first.track_ids.tolist() == second.track_ids.tolist()
+    assert tracker.tracks[0].hits == 2
+
+
+def test_predict_does_not_add_hits_or_votes():
+    tracker = ByteTracker(det_thresh=0.35)
+    tracker.update(detections(0.6), 0.0)
+    for i in range(5):
+        out = tracker.predict(0.04 * (i + 1))
+        assert len(out) == 1
+    track = tracker.tracks[0]
+    assert track.hits == 1
+    assert track.votes == {0: pytest.approx(0.6)}
+
+
+def test_low_confidence_detection_keeps_existing_track():
+    tracker = ByteTracker(det_thresh=0.35, low_thresh=0.1)
+    assert tracker.detect_conf == 0.1
+    first = tracker.update(detections(0.6), 0.0)
+    # Box mờ đi (conf dưới det_thresh) vẫn được ghép ở lượt 2, giữ nguyên track id
+    second = tracker.update(detections(0.2, box=(102, 100, 142, 130)), 0.04)
+    assert second.track_ids.tolist() == first.track_ids.tolist()
+    assert tracker.tracks[0].misses == 0
+
+
+def test_low_confidence_detection_does_not_start_a_track():
+    tracker = ByteTracker(det_thresh=0.35, low_thresh=0.1)
+    assert len(tracker.update(detections(0.2), 0.0)) == 0
+    assert tracker.tracks == []
@@ -1,10 +1,13 @@
 import os
-import glob
+import sys
+import time
 import matplotlib.pyplot as plt
 import seaborn as sns
-from collections import defaultdict
+import numpy as np
 import pandas as pd
 
+from utils.dataset_index import DatasetIndex
+
 # --- CẤU HÌNH ---
 # Đường dẫn đến folder dataset vừa tạo (New_Merged_Dataset)
 DATASET_PATH = r"D:\data_train_drone\dataset_after_handle" 
@@ -17,50 +20,23 @@ CLASS_NAMES = {
     3: 'Helicopter'
 }
 
-def analyze_yolo_dataset(root_path):
-    # Dictionary để lưu thống kê
-    # Cấu trúc: stats[class_id] = {'bbox_count': 0, 'image_count': 0}
-    class_stats = defaultdict(lambda: {'bbox_count': 0, 'image_count': 0})
-    
-    split_counts = {'train': 0, 'val': 0, 'test': 0}
-    total_images = 0
-    
-    # Duyệt qua các tập train, val, test
-    for split in ['train', 'val', 'test']:
-        labels_path = os.path.join(root_path, split, 'labels')
-        
-        if not os.path.exists(labels_path):
-            print(f"⚠️ Cảnh báo: Không tìm thấy folder {split} tại {labels_path}")
-            continue
-            
-        # Lấy tất cả file .txt
-        txt_files = glob.glob(os.path.join(labels_path, "*.txt"))
-        num_files = len(txt_files)
-        split_counts[split] = num_files
-        total_images += num_files
-        
-        # Đọc từng file label
-        for txt_file in txt_files:
-            with open(txt_file, 'r') as f:
-                lines = f.readlines()
-            
-            # Set để theo dõi xem ảnh này ĐÃ tính cho class đó chưa 
-            # (Một ảnh có 2 con Drone thì chỉ tính là 1 ảnh chứa Drone)
-            classes_in_this_image = set()
-            
-            for line in lines:
-                parts = line.strip().split()
-                if not parts: continue
-                
-                class_id = int(parts[0])
-                
-                # Tăng số lượng BBox
-                class_stats[class_id]['bbox_count'] += 1
-                classes_in_this_image.add(class_id)
-            
-            # Tăng số lượng ảnh chứa class tương ứng
-            for cid in classes_in_this_image:
-                class_stats[cid]['image_count'] += 1
+def analyze_yolo_dataset(root_path, small_threshold=32 / 640):
+    # Index dạng cột lưu trong dataset, chỉ parse lại các file label mới / đã sửa
+    index = DatasetIndex(root_path)
+    started = time.perf_counter()
+    changed, removed = index.update()
+    print(f"Cập nhật index: {changed} file parse lại, {removed} file đã xóa "
+          f"({time.perf_counter() - started:.2f}s)")
+
+    for split in index.splits:
+        if not os.path.exists(os.path.join(root_path, split, 'labels')):
+            print(f"⚠️ Cảnh báo: Không tìm thấy folder {split} tại "
+                  f"{os.path.join(root_path, split, 'labels')}")
+
+    num_classes = max(CLASS_NAMES) + 1
+    bbox_counts, image_counts = index.class_counts(num_classes)
+    split_counts = index.split_counts()
+    total_images = len(index)
 
     # --- HIỂN THỊ KẾT QUẢ ---
     print("="*40)
@@ -70,16 +46,20 @@ def analyze_yolo_dataset(root_path):
     print(f" - Val:   {split_counts['val']}")
     print(f" - Test:  {split_counts['test']}")
     print("="*40)
-    print(f"{'Class Name':<15} | {'ID':<3} | {'Số lượng BBox':<15} | {'Số ảnh chứa class':<15}")
-    print("-" * 60)
+    print(f"{'Class Name':<15} | {'ID':<3} | {'Số lượng BBox':<15} | {'Số ảnh chứa class':<15} | "
+          f"{'Tỉ lệ box nhỏ':<13}")
+    print("-" * 78)
+
+    small_ratio = index.small_object_ratio(num_classes, small_threshold)
     
     data_for_plot = []
     
     for class_id in sorted(CLASS_NAMES.keys()):
         name = CLASS_NAMES[class_id]
-        bboxes = class_stats[class_id]['bbox_count']
-        imgs = class_stats[class_id]['image_count']
-        print(f"{name:<15} | {class_id:<3} | {bboxes:<15} | {imgs:<15}")
+        bboxes = int(bbox_counts[class_id])
+        imgs = int(image_counts[class_id])
+        print(f"{name:<15} | {class_id:<3} | {bboxes:<15} | {imgs:<15} | "
+              f"{small_ratio[class_id]:<13.1%}")
         
         data_for_plot.append({
             'Class': name,
@@ -88,14 +68,22 @@ def analyze_yolo_dataset(root_path):
         })
     print("="*40)
 
+    # Cân bằng class giữa các split (tỉ lệ box của mỗi class trong từng split)
+    balance = index.split_balance(num_classes)
+    print(f"{'Split':<8}" + "".join(f" | {CLASS_NAMES[c]:<10}" for c in sorted(CLASS_NAMES)))
+    for i, split in enumerate(index.splits):
+        total = max(int(balance[i].sum()), 1)
+        print(f"{split:<8}" + "".join(f" | {balance[i, c] / total:<10.1%}" for c in sorted(CLASS_NAMES)))
+    print("="*40)
+
     # --- VẼ BIỂU ĐỒ ---
     if total_images > 0:
         df = pd.DataFrame(data_for_plot)
         
-        plt.figure(figsize=(12, 5))
+        plt.figure(figsize=(12, 10))
         
         # Biểu đồ 1: Số lượng BBox
-        plt.subplot(1, 2, 1)
+        plt.subplot(2, 2, 1)
         sns.barplot(data=df, x='Class', y='BBoxes', hue='Class', palette='viridis', legend=False)
         plt.title('Số lượng Bounding Boxes (Objects) mỗi Class')
         plt.ylabel('Số lượng Box')
@@ -103,18 +91,33 @@ def analyze_yolo_dataset(root_path):
             plt.text(i, v, str(v), ha='center', va='bottom')
             
         # Biểu đồ 2: Số lượng ảnh
-        plt.subplot(1, 2, 2)
+        plt.subplot(2, 2, 2)
         sns.barplot(data=df, x='Class', y='Images', hue='Class', palette='magma', legend=False)
         plt.title('Số lượng Ảnh chứa mỗi Class')
         plt.ylabel('Số lượng Ảnh')
         for i, v in enumerate(df['Images']):
             plt.text(i, v, str(v), ha='center', va='bottom')
-            
+
+        # Biểu đồ 3: Kích thước box (căn bậc hai diện tích, chuẩn hóa theo ảnh)
+        plt.subplot(2, 2, 3)
+        counts, edges = index.size_histogram(bins=40)
+        plt.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
+        plt.axvline(small_threshold, color='red', linestyle='--')
+        plt.title('Phân bố kích thước Box (sqrt(w*h))')
+        plt.ylabel('Số lượng Box')
+
+        # Biểu đồ 4: Tỉ lệ khung w/h (log2)
+        plt.subplot(2, 2, 4)
+        counts, edges = index.aspect_histogram(bins=40)
+        plt.bar(edges[:-1], counts, width=np.diff(edges), align='edge', color='orange')
+        plt.title('Phân bố tỉ lệ w/h (log2)')
+        plt.ylabel('Số lượng Box')
+
         plt.tight_layout()
         plt.show()
     else:
         print("Không có dữ liệu để vẽ biểu đồ.")
 
 if __name__ == "__main__":
-    # Nhớ sửa đường dẫn này trước khi chạy
-    analyze_yolo_dataset(DATASET_PATH)
\ No newline at end of file
+    # Chạy: python -m utils.analysis_data [đường dẫn dataset]
+    analyze_yolo_dataset(sys.argv[1] if len(sys.argv) > 1 else DATASET_PATH)
\ No newline at end of file
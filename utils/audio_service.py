@@ -0,0 +1,122 @@
+import os
+import tempfile
+
+import numpy as np
+
+from utils.metrics import STAGE_SECONDS
+from utils.micro_batcher import MicroBatcher
+from utils.result_cache import ResultCache, hash_file
+
+
+class AudioBatchService:
+    """
+    Model audio dùng chung cho mọi request: MFCC từ nhiều request / thread được gom thành
+    micro-batch (tối đa max_batch cửa sổ, chờ tối đa max_wait giây), mỗi batch một lần predict.
+    Có cùng giao diện predict(batch, verbose=0) với model Keras nên StreamingAudioClassifier
+    dùng trực tiếp được.
+    """
+
+    def __init__(self, get_model, max_batch=64, max_wait=0.01):
+        # get_model() -> model Keras (gọi lười, lấy từ model_registry)
+        self.get_model = get_model
+        self.batcher = MicroBatcher(self._run_batch, max_batch=max_batch, max_wait=max_wait,
+                                    name='audio')
+
+    def _run_batch(self, features, key=None):
+        batch = np.stack(features)
+        with STAGE_SECONDS.time(pipeline='audio', stage='infer_batch'):
+            return list(self.get_model().predict(batch, verbose=0))
+
+    def predict(self, batch, verbose=0):
+        """
+        batch: (N, n_mfcc, frames, 1) -> xác suất (N, số class), chặn tới khi có kết quả
+        """
+        return np.stack(self.batcher(list(np.asarray(batch, np.float32))))
+
+    def stop(self):
+        self.batcher.stop()
+
+
+class MfccCache:
+    """
+    Cache MFCC theo cửa sổ của từng file audio, khóa = hash nội dung + tham số đặc trưng
+    (không gồm model): đổi model audio thì chỉ chạy lại predict, không tính lại MFCC.
+    Lưu trên đĩa qua ResultCache (giới hạn dung lượng, LRU). MFCC được ghi dần từng cửa sổ
+    (writer) và đọc lại qua memmap nên không cần giữ cả file trong bộ nhớ
+    """
+
+    def __init__(self, root='cache_mfcc', max_bytes=512 * 2 ** 20):
+        self.cache = ResultCache(root, max_bytes=max_bytes)
+
+    def make_key(self, path, content_hash=None, **params):
+        # content_hash: SHA-256 đã có sẵn (vd: tính trong lúc nhận upload) -> không đọc lại file
+        return ResultCache.make_key(content_hash or hash_file(path), kind='mfcc', **params)
+
+    def load(self, key):
+        """
+        (danh sách (frame bắt đầu, MFCC), sample rate) hoặc None
+        """
+        entry = self.cache.get(key)
+        if entry is None or 'shape' not in entry.result:
+            return None
+        result = entry.result
+        try:
+            features = np.memmap(entry.files['mfcc'], dtype=np.float32, mode='r',
+                                 shape=(len(result['starts']),) + tuple(result['shape']))
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Không đọc được MFCC trong cache {key}: {e}")
+            return None
+        return list(zip(result['starts'], features)), result['sample_rate']
+
+    def writer(self, key, sample_rate):
+        return MfccWriter(self, key, sample_rate)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class MfccWriter:
+    """
+    Ghi MFCC của một file vào cache trong lúc các cửa sổ được tính:
+    commit() khi đã hết file, discard() nếu lỗi giữa chừng
+    """
+
+    def __init__(self, cache, key, sample_rate):
+        self.cache = cache
+        self.key = key
+        self.sample_rate = sample_rate
+        self.starts = []
+        self.shape = None
+        fd, self.tmp_path = tempfile.mkstemp(suffix='.f32')
+        self._file = os.fdopen(fd, 'wb')
+
+    def add(self, start, features):
+        features = np.ascontiguousarray(features, np.float32)
+        self.shape = features.shape
+        self._file.write(features.tobytes())
+        self.starts.append(int(start))
+
+    def record(self, windows):
+        """
+        Generator: trả lại từng (frame bắt đầu, MFCC) của windows, đồng thời ghi vào cache
+        """
+        for start, features in windows:
+            self.add(start, features)
+            yield start, features
+
+    def commit(self):
+        try:
+            self._file.close()
+            if self.starts:
+                self.cache.cache.put(self.key, {'sample_rate': self.sample_rate,
+                                                'starts': self.starts,
+                                                'shape': list(self.shape)},
+                                     files={'mfcc': self.tmp_path})
+        except (OSError, ValueError) as e:
+            print(f"Không ghi được MFCC vào cache {self.key}: {e}")
+        finally:
+            os.remove(self.tmp_path)
+
+    def discard(self):
+        self._file.close()
+        os.remove(self.tmp_path)
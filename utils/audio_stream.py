@@ -0,0 +1,229 @@
+import subprocess
+
+import numpy as np
+import soundfile as sf
+
+from utils.metrics import STAGE_SECONDS
+from utils.video_pipeline import get_ffmpeg_exe
+
+# Sample rate khi phải giải mã qua ffmpeg (trước đây moviepy write_audiofile cũng ghi 44100 Hz)
+DEFAULT_SAMPLE_RATE = 44100
+
+
+def iter_ffmpeg_blocks(path, sr=DEFAULT_SAMPLE_RATE, block_seconds=5.0):
+    """
+    Giải mã track audio của file bất kỳ (mp4, mov, mp3...) qua pipe ffmpeg,
+    trả về từng khối mono float32 ở sample rate sr. Không ghi file tạm ra đĩa.
+    File không có audio -> không có khối nào.
+    """
+    cmd = [get_ffmpeg_exe(), '-nostdin', '-loglevel', 'error', '-i', path,
+           '-map', '0:a:0', '-vn', '-ac', '1', '-ar', str(sr), '-f', 'f32le', '-']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    block_bytes = int(block_seconds * sr) * 4
+    try:
+        while True:
+            with STAGE_SECONDS.time(pipeline='audio', stage='decode'):
+                data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            # Bỏ byte lẻ nếu có (f32le = 4 byte / sample)
+            data = data[:len(data) - len(data) % 4]
+            yield np.frombuffer(data, dtype=np.float32)
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+def iter_file_blocks(path, block_seconds=5.0):
+    """
+    Đọc file audio theo từng khối (mono, float32), trả về (sample_rate, generator).
+    Bộ nhớ chỉ phụ thuộc kích thước khối, không phụ thuộc độ dài file.
+    """
+    try:
+        sr = sf.info(path).samplerate
+    except RuntimeError:
+        # Định dạng soundfile không đọc được (vd: mp3 với libsndfile cũ) -> giải mã qua ffmpeg
+        return DEFAULT_SAMPLE_RATE, iter_ffmpeg_blocks(path, DEFAULT_SAMPLE_RATE, block_seconds)
+
+    def blocks():
+        for block in sf.blocks(path, blocksize=int(block_seconds * sr),
+                               dtype='float32', always_2d=True):
+            yield block.mean(axis=1)
+
+    return sr, blocks()
+
+
+def clip_mfcc(audio, sr, n_mfcc=40, max_pad_len=174, n_fft=2048, hop_length=512):
+    """
+    MFCC của một đoạn audio, giống hệt lúc train model (extract_features):
+    librosa.feature.mfcc (center=True, dB tham chiếu theo cả đoạn), pad 0 / cắt về
+    max_pad_len frame. Đoạn ngắn hơn n_fft vẫn có kết quả (được pad)
+    """
+    import librosa
+    with STAGE_SECONDS.time(pipeline='audio', stage='mfcc'):
+        mfccs = librosa.feature.mfcc(y=np.asarray(audio, np.float32), sr=sr, n_mfcc=n_mfcc,
+                                     n_fft=n_fft, hop_length=hop_length)
+    if mfccs.shape[1] > max_pad_len:
+        return mfccs[:, :max_pad_len]
+    pad_width = max_pad_len - mfccs.shape[1]
+    return np.pad(mfccs, pad_width=((0, 0), (0, pad_width)), mode='constant')
+
+
+class StreamingAudioClassifier:
+    """
+    Phân loại audio theo cửa sổ trượt:
+    - audio được đọc dần theo từng khối, chỉ giữ lại số sample của một cửa sổ
+    - mỗi cửa sổ (window_frames frame = kích thước đầu vào model) được tính MFCC như
+      một clip riêng, đúng cách trích đặc trưng lúc train (clip_mfcc)
+    - các cửa sổ được gom lại, gọi audio_model.predict theo batch
+    Kết quả là timeline xác suất các class theo từng cửa sổ.
+    """
+
+    def __init__(self, model, class_labels, window_frames=174, hop_frames=87,
+                 n_mfcc=40, n_fft=2048, hop_length=512, max_batch=64, feature_cache=None):
+        # model: model Keras hoặc AudioBatchService (gom batch giữa nhiều request)
+        self.model = model
+        self.class_labels = class_labels
+        self.window_frames = window_frames
+        self.hop_frames = hop_frames
+        self.n_mfcc = n_mfcc
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.max_batch = max_batch
+        # MfccCache: file đã tính MFCC (kể cả với model cũ) thì chỉ chạy lại predict
+        self.feature_cache = feature_cache
+
+    def feature_params(self):
+        # features: cách tính MFCC, đổi thì MFCC cũ trong cache không được dùng lại
+        return dict(window_frames=self.window_frames, hop_frames=self.hop_frames,
+                    n_mfcc=self.n_mfcc, n_fft=self.n_fft, hop_length=self.hop_length,
+                    features='clip_mfcc')
+
+    def classify_file(self, path, block_seconds=5.0, content_hash=None):
+        """
+        content_hash: SHA-256 của file nếu đã có (vd: tính trong lúc nhận upload),
+        để khóa cache MFCC không phải đọc lại cả file
+        """
+        if self.feature_cache is None:
+            sr, blocks = iter_file_blocks(path, block_seconds)
+            return self.classify_blocks(blocks, sr)
+
+        key = self.feature_cache.make_key(path, content_hash, **self.feature_params())
+        cached = self.feature_cache.load(key)
+        if cached is not None:
+            windows, sr = cached
+            return self._collect(self._timeline(windows, sr))
+
+        # Tính MFCC theo luồng như khi không có cache, mỗi cửa sổ được ghi dần vào cache
+        sr, blocks = iter_file_blocks(path, block_seconds)
+        writer = self.feature_cache.writer(key, sr)
+        try:
+            timeline = self._collect(
+                self._timeline(writer.record(self.iter_windows(blocks, sr)), sr))
+        except Exception:
+            writer.discard()
+            raise
+        writer.commit()
+        return timeline
+
+    def classify_blocks(self, blocks, sr):
+        """
+        blocks: iterator các mảng sample (mono). Trả về list timeline theo thứ tự thời gian
+        """
+        return self._collect(self.iter_timeline(blocks, sr))
+
+    @staticmethod
+    def _collect(groups):
+        timeline = []
+        for entries in groups:
+            timeline.extend(entries)
+        return timeline
+
+    def iter_timeline(self, blocks, sr, max_batch=None):
+        """
+        Generator: trả về dần từng nhóm cửa sổ đã phân loại (mỗi lần gọi predict một nhóm)
+        """
+        return self._timeline(self.iter_windows(blocks, sr), sr, max_batch)
+
+    def _timeline(self, windows, sr, max_batch=None):
+        max_batch = max_batch or self.max_batch
+        pending = []
+        for start, features in windows:
+            pending.append((start, features))
+            if len(pending) >= max_batch:
+                yield self._predict(pending, sr)
+                pending = []
+        if pending:
+            yield self._predict(pending, sr)
+
+    @property
+    def window_samples(self):
+        # Đủ sample cho frame cuối của cửa sổ (center=True: frame t nằm giữa t * hop_length)
+        return (self.window_frames - 1) * self.hop_length + self.n_fft // 2
+
+    def iter_windows(self, blocks, sr):
+        """
+        Generator: (frame bắt đầu, MFCC (n_mfcc, window_frames)) cho từng cửa sổ
+        """
+        window_samples = self.window_samples
+        hop_samples = self.hop_frames * self.hop_length
+        buffer = np.zeros(0, np.float32)
+        buffer_start = 0       # chỉ số sample đầu tiên trong buffer
+        covered = 0            # sample cuối (không tính) mà các cửa sổ đã phủ
+
+        for block in blocks:
+            buffer = np.concatenate([buffer, np.asarray(block, np.float32)])
+            while len(buffer) >= window_samples:
+                yield buffer_start // self.hop_length, self._mfcc(buffer[:window_samples], sr)
+                covered = buffer_start + window_samples
+                # Bỏ các sample không còn cửa sổ nào dùng tới -> bộ nhớ có giới hạn
+                buffer = buffer[hop_samples:]
+                buffer_start += hop_samples
+
+        # Phần cuối chưa đủ một cửa sổ (hoặc cả file ngắn hơn n_fft): pad 0 như extract_features
+        if len(buffer) and buffer_start + len(buffer) > covered:
+            yield buffer_start // self.hop_length, self._mfcc(buffer, sr)
+
+    def _mfcc(self, samples, sr):
+        return clip_mfcc(samples, sr, n_mfcc=self.n_mfcc, max_pad_len=self.window_frames,
+                         n_fft=self.n_fft, hop_length=self.hop_length)
+
+    def _predict(self, windows, sr):
+        batch = np.stack([features for _, features in windows])[..., np.newaxis]
+        with STAGE_SECONDS.time(pipeline='audio', stage='infer'):
+            probs = self.model.predict(batch, verbose=0)
+
+        entries = []
+        for (start, _), p in zip(windows, probs):
+            best_idx = int(np.argmax(p))
+            entries.append({
+                'start': start * self.hop_length / sr,
+                'end': (start * self.hop_length + self.window_samples) / sr,
+                'label': self.class_labels[best_idx],
+                'confidence': float(p[best_idx]),
+                'probs': [float(v) for v in p],
+            })
+        return entries
+
+
+def mean_probs(timeline, class_labels):
+    """
+    Xác suất trung bình các cửa sổ của từng class: {label: xác suất}, timeline rỗng -> None
+    """
+    if not timeline:
+        return None
+    probs = np.mean([entry['probs'] for entry in timeline], axis=0)
+    return {label: float(p) for label, p in zip(class_labels, probs)}
+
+
+def summarize_timeline(timeline, class_labels):
+    """
+    Gộp timeline thành một nhãn cho cả file (trung bình xác suất các cửa sổ)
+    """
+    probs = mean_probs(timeline, class_labels)
+    if probs is None:
+        return None, None
+    best_label = max(probs, key=probs.get)
+    return best_label, probs[best_label]
@@ -0,0 +1,129 @@
+import queue
+import threading
+
+import numpy as np
+
+# Đánh dấu hết luồng frame
+END_OF_STREAM = object()
+
+
+class BatchedFrameInference:
+    """
+    Chạy YOLO theo lô (batch) nhiều frame thay vì từng frame một.
+    Frame được giải mã ở thread riêng vào một hàng đợi có giới hạn,
+    kết quả trả về đúng thứ tự frame đầu vào.
+    """
+
+    def __init__(self, detector, batch_size=8, conf=0.35, iou=0.5,
+                 queue_size=32, verify=False):
+        # detector: DetectorBackend (utils/detector_backends.py)
+        self.detector = detector
+        self.batch_size = max(1, int(batch_size))
+        self.conf = conf
+        self.iou = iou
+        self.queue_size = max(queue_size, self.batch_size)
+        # verify=True: chạy lại từng frame để so sánh với kết quả batch
+        self.verify = verify
+        self.mismatches = 0
+
+    def predict(self, frames):
+        """
+        Chạy YOLO một lần cho cả danh sách frame
+        """
+        return self.detector.predict(list(frames), conf=self.conf, iou=self.iou)
+
+    def infer_batch(self, batch):
+        """
+        Chạy một batch, kiểm tra với từng frame nếu bật verify
+        """
+        results = self.predict(batch)
+        if self.verify:
+            self._verify_batch(batch, results)
+        return results
+
+    def run(self, frames):
+        """
+        Generator: nhận iterator frame, trả về từng cặp (frame, Detections) theo thứ tự
+        """
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        stop_event = threading.Event()
+        errors = []
+
+        decoder = threading.Thread(target=_decode_worker,
+                                   args=(frames, frame_queue, stop_event, errors),
+                                   daemon=True)
+        decoder.start()
+
+        try:
+            finished = False
+            while not finished:
+                # Gom đủ một batch (hoặc đến khi hết frame)
+                batch = []
+                while len(batch) < self.batch_size:
+                    item = frame_queue.get()
+                    if item is END_OF_STREAM:
+                        finished = True
+                        break
+                    batch.append(item)
+
+                if batch:
+                    results = self.infer_batch(batch)
+                    for frame, result in zip(batch, results):
+                        yield frame, result
+
+            if errors:
+                raise errors[0]
+        finally:
+            stop_event.set()
+            decoder.join(timeout=1.0)
+
+    def _verify_batch(self, batch, results):
+        """
+        So sánh kết quả batch với kết quả chạy từng frame
+        """
+        for i, frame in enumerate(batch):
+            single = self.detector.predict([frame], conf=self.conf, iou=self.iou)[0]
+            if not same_detections(results[i], single):
+                self.mismatches += 1
+                print(f"Cảnh báo: kết quả batch khác kết quả từng frame "
+                      f"(frame {i} trong batch)")
+
+
+def _decode_worker(frames, frame_queue, stop_event, errors):
+    """
+    Thread giải mã: đẩy frame vào hàng đợi, bị chặn khi hàng đợi đầy (backpressure)
+    """
+    try:
+        for frame in frames:
+            if not put_until_stopped(frame_queue, frame, stop_event):
+                return
+    except Exception as e:
+        errors.append(e)
+    put_until_stopped(frame_queue, END_OF_STREAM, stop_event)
+
+
+def put_until_stopped(frame_queue, item, stop_event):
+    """
+    Đưa item vào hàng đợi, chờ khi đầy; trả về False nếu pipeline đã dừng
+    """
+    while not stop_event.is_set():
+        try:
+            frame_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def same_detections(dets_a, dets_b, box_atol=1.0, conf_atol=1e-3):
+    """
+    Hai kết quả Detections có cùng box / class / confidence (trong sai số) hay không
+    """
+    if len(dets_a) != len(dets_b):
+        return False
+    if len(dets_a) == 0:
+        return True
+    if not np.array_equal(dets_a.cls, dets_b.cls):
+        return False
+    return (np.allclose(dets_a.xyxy, dets_b.xyxy, atol=box_atol)
+            and np.allclose(dets_a.conf, dets_b.conf, atol=conf_atol))
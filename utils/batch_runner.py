@@ -0,0 +1,410 @@
+"""
+Chạy model trên cả thư mục (ảnh / audio / video), không qua HTTP.
+
+Ví dụ:
+    python -m utils.batch_runner /data/archive --output results/archive
+    python -m utils.batch_runner /data/archive --output results/archive --format parquet
+    python -m utils.batch_runner /data/archive --output results/archive --types image --engine onnxruntime
+
+Kết quả ghi thành nhiều shard (shard-00000.jsonl, ...). Mỗi shard xong được nối vào
+checkpoint.jsonl; chạy lại cùng lệnh sẽ bỏ qua các file đã có trong shard hoàn chỉnh
+(video đang làm dở được chạy tiếp từ frame chưa ghi).
+Video: mỗi frame một bản ghi type='video_frame', cuối cùng một bản ghi type='video'.
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from utils.audio_stream import StreamingAudioClassifier, iter_file_blocks
+from utils.video_processor import VideoProcessor
+
+CLASS_LABELS = ['airplane', 'bird', 'drone', 'helicopter']
+AUDIO_MODEL_PATH = 'models/sound_classification_model.h5'
+
+MEDIA_EXTS = {
+    'image': ('.jpg', '.jpeg', '.png', '.bmp', '.webp'),
+    'audio': ('.wav', '.mp3', '.flac', '.ogg'),
+    'video': ('.mp4', '.avi', '.mov', '.mkv'),
+}
+
+CHECKPOINT_NAME = 'checkpoint.jsonl'
+
+
+def media_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    for kind, exts in MEDIA_EXTS.items():
+        if ext in exts:
+            return kind
+    return None
+
+
+def walk_media(root, types):
+    """
+    Duyệt thư mục (đệ quy, thứ tự cố định) -> {loại: [đường dẫn tương đối]}
+    """
+    found = {kind: [] for kind in types}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            kind = media_type(name)
+            if kind in found:
+                found[kind].append(os.path.relpath(os.path.join(dirpath, name), root))
+    return found
+
+
+def prefetch(items, load, workers=4, window=64):
+    """
+    Generator: load(item) chạy song song trong thread pool, kết quả trả về đúng thứ tự,
+    tối đa window item được đọc trước (giới hạn bộ nhớ).
+    Trả về (item, kết quả, lỗi)
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        items = iter(items)
+        for item in items:
+            pending.append((item, pool.submit(load, item)))
+            if len(pending) >= window:
+                break
+        while pending:
+            item, future = pending.popleft()
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
+            for next_item in items:
+                pending.append((next_item, pool.submit(load, next_item)))
+                break
+
+
+class ShardWriter:
+    """
+    Ghi bản ghi thành các shard JSONL / Parquet. Shard đang ghi mang đuôi .tmp,
+    chỉ đổi tên khi đủ shard_size bản ghi (hoặc khi đóng), rồi NỐI thêm một dòng vào
+    checkpoint.jsonl: tên shard, các file đã xong trong shard và số bản ghi đã ghi của
+    file đang làm dở (vd: video dài trải qua nhiều shard) để chạy tiếp đúng chỗ
+    """
+
+    def __init__(self, output_dir, shard_size=5000, fmt='jsonl'):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.format = fmt
+        self.checkpoint_path = os.path.join(output_dir, CHECKPOINT_NAME)
+        os.makedirs(output_dir, exist_ok=True)
+        self.shards = 0
+        self.done = set()
+        # Số bản ghi đã nằm trong shard hoàn chỉnh của các file chưa xong
+        self.progress = {}
+        self._load_checkpoint()
+        self._records = []
+        self._count = 0
+        self._done_in_shard = []
+        self._file = None
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return
+        valid_size = 0
+        with open(self.checkpoint_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError
+                    entry = json.loads(line)
+                except ValueError:
+                    # Dòng cuối ghi dở (bị dừng giữa chừng)
+                    break
+                valid_size += len(line)
+                self.shards += 1
+                self.done.update(entry['done'])
+                self.progress = entry.get('partial', {})
+        if valid_size < os.path.getsize(self.checkpoint_path):
+            # Cắt bỏ dòng ghi dở, nếu không dòng nối thêm sau sẽ dính vào nó
+            with open(self.checkpoint_path, 'r+b') as f:
+                f.truncate(valid_size)
+        for path in self.done:
+            self.progress.pop(path, None)
+
+    def _shard_name(self):
+        return f"shard-{self.shards:05d}.{self.format}"
+
+    def write(self, record, done=True):
+        """
+        done=False: bản ghi một phần của file (vd: một frame video), file chỉ được tính là
+        xong khi có bản ghi done=True
+        """
+        path = record['path']
+        if self.format == 'jsonl':
+            if self._file is None:
+                self._file = open(os.path.join(self.output_dir, self._shard_name() + '.tmp'), 'w')
+            self._file.write(json.dumps(record) + '\n')
+        else:
+            self._records.append(record)
+        self._count += 1
+        if done:
+            self._done_in_shard.append(path)
+            self.progress.pop(path, None)
+        else:
+            self.progress[path] = self.progress.get(path, 0) + 1
+        if self._count >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Hoàn tất shard hiện tại và nối thêm một dòng checkpoint
+        """
+        if not self._count:
+            return
+        name = self._shard_name()
+        path = os.path.join(self.output_dir, name)
+        if self.format == 'jsonl':
+            self._file.close()
+            self._file = None
+        else:
+            import pandas as pd
+            frame = pd.DataFrame(self._records)
+            frame.to_parquet(path + '.tmp', engine='pyarrow', index=False)
+        os.replace(path + '.tmp', path)
+
+        entry = {'file': name, 'records': self._count, 'done': self._done_in_shard,
+                 'partial': self.progress}
+        with open(self.checkpoint_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.shards += 1
+        self.done.update(self._done_in_shard)
+        self._records = []
+        self._count = 0
+        self._done_in_shard = []
+
+    def close(self):
+        self.flush()
+
+
+class Throughput:
+    """
+    Đếm số file đã xử lý theo loại, in tốc độ định kỳ
+    """
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.counts = {}
+        self.errors = 0
+        self._last_report = self.started
+
+    def add(self, kind, count=1):
+        self.counts[kind] = self.counts.get(kind, 0) + count
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            print(self.line())
+
+    def line(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-6)
+        parts = [f"{kind}: {count} ({count / elapsed:.1f}/s)" for kind, count in self.counts.items()]
+        return f"[{elapsed:.0f}s] " + ", ".join(parts) + f", lỗi: {self.errors}"
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {'seconds': elapsed, 'errors': self.errors,
+                'counts': self.counts,
+                'per_second': {k: v / max(elapsed, 1e-6) for k, v in self.counts.items()}}
+
+
+class BatchRunner:
+    """
+    Chạy model theo lô trên danh sách file:
+    - ảnh: đọc + decode song song, gom batch_size ảnh cho một lần chạy YOLO
+    - audio: đọc + tính MFCC theo cửa sổ song song, gom cửa sổ của nhiều file
+      thành một batch cho model Keras, gộp lại theo file như predict_audio
+    - video: VideoProcessor.detect_video (đã có pipeline decode / YOLO theo batch riêng),
+      bản ghi từng frame được ghi ngay vào shard, không giữ cả video trong bộ nhớ
+    """
+
+    def __init__(self, root, writer, processor=None, audio_model=None, conf=0.35, iou=0.5,
+                 batch_size=16, audio_batch=64, workers=8, prefetch=64):
+        self.root = root
+        self.writer = writer
+        self.processor = processor
+        self.audio_classifier = (StreamingAudioClassifier(audio_model, CLASS_LABELS)
+                                 if audio_model is not None else None)
+        self.conf = conf
+        self.iou = iou
+        self.batch_size = batch_size
+        self.audio_batch = audio_batch
+        self.workers = workers
+        self.prefetch = prefetch
+        self.throughput = Throughput()
+
+    def _error(self, path, kind, error):
+        print(f"Lỗi xử lý {path}: {error}")
+        self.throughput.errors += 1
+        self.writer.write({'path': path, 'type': kind, 'error': str(error)})
+
+    # --- ẢNH ---
+
+    def _load_image(self, path):
+        img = cv2.imread(os.path.join(self.root, path))
+        if img is None:
+            raise IOError("Không đọc được ảnh")
+        return img
+
+    def run_images(self, paths):
+        batch = []
+        for path, img, error in prefetch(paths, self._load_image, self.workers, self.prefetch):
+            if error is not None:
+                self._error(path, 'image', error)
+                continue
+            batch.append((path, img))
+            if len(batch) >= self.batch_size:
+                self._infer_images(batch)
+                batch = []
+        if batch:
+            self._infer_images(batch)
+
+    def _infer_images(self, batch):
+        records = self.processor.detect_images([img for _, img in batch],
+                                               conf=self.conf, iou=self.iou)
+        for (path, _), record in zip(batch, records):
+            record.pop('frame', None)
+            record.pop('timestamp', None)
+            self.writer.write(dict(record, path=path, type='image'))
+        self.throughput.add('image', len(batch))
+
+    # --- AUDIO ---
+
+    def _load_audio(self, path):
+        sr, blocks = iter_file_blocks(os.path.join(self.root, path))
+        windows = [mfcc for _, mfcc in self.audio_classifier.iter_windows(blocks, sr)]
+        return windows
+
+    def run_audio(self, paths):
+        pending, window_count = [], 0
+        for path, windows, error in prefetch(paths, self._load_audio, self.workers,
+                                             self.prefetch):
+            if error is None and not windows:
+                error = "Error: Can extract features"
+            if error is not None:
+                self._error(path, 'audio', error)
+                continue
+            pending.append((path, windows))
+            window_count += len(windows)
+            if window_count >= self.audio_batch:
+                self._infer_audio(pending)
+                pending, window_count = [], 0
+        if pending:
+            self._infer_audio(pending)
+
+    def _infer_audio(self, files):
+        features = np.stack([w for _, windows in files for w in windows])[..., np.newaxis]
+        model = self.audio_classifier.model
+        probs = np.concatenate([model.predict(features[i:i + self.audio_batch], verbose=0)
+                                for i in range(0, len(features), self.audio_batch)])
+        start = 0
+        for path, windows in files:
+            # Gộp các cửa sổ thành một nhãn cho cả file (như summarize_timeline)
+            mean_probs = probs[start:start + len(windows)].mean(axis=0)
+            start += len(windows)
+            best_idx = int(np.argmax(mean_probs))
+            self.writer.write({'path': path, 'type': 'audio', 'label': CLASS_LABELS[best_idx],
+                               'confidence': float(mean_probs[best_idx]),
+                               'probs': {label: float(p)
+                                         for label, p in zip(CLASS_LABELS, mean_probs)},
+                               'windows': len(windows)})
+        self.throughput.add('audio', len(files))
+
+    # --- VIDEO ---
+
+    def run_videos(self, paths):
+        for path in paths:
+            # Lần chạy trước đã ghi xong skip frame đầu (trong shard hoàn chỉnh)
+            skip = self.writer.progress.get(path, 0)
+            frames = 0
+            try:
+                for record in self.processor.detect_video(os.path.join(self.root, path),
+                                                          conf=self.conf, iou=self.iou,
+                                                          batch_size=self.batch_size):
+                    frames += 1
+                    if frames <= skip:
+                        continue
+                    self.writer.write(dict(record, path=path, type='video_frame'), done=False)
+                    self.throughput.add('video_frame')
+            except Exception as e:
+                self._error(path, 'video', e)
+                continue
+            self.writer.write({'path': path, 'type': 'video', 'frames': frames})
+            self.throughput.add('video')
+
+    def run(self, media):
+        for kind, run in (('image', self.run_images), ('audio', self.run_audio),
+                          ('video', self.run_videos)):
+            paths = [p for p in media.get(kind, []) if p not in self.writer.done]
+            if not paths:
+                continue
+            print(f"{kind}: {len(paths)} file cần xử lý")
+            run(paths)
+        return self.throughput.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy model theo lô trên cả thư mục")
+    parser.add_argument('input', help="Thư mục chứa ảnh / audio / video (duyệt đệ quy)")
+    parser.add_argument('--output', required=True, help="Thư mục ghi shard kết quả + checkpoint")
+    parser.add_argument('--types', nargs='+', default=['image', 'audio', 'video'],
+                        choices=['image', 'audio', 'video'])
+    parser.add_argument('--format', default='jsonl', choices=['jsonl', 'parquet'])
+    parser.add_argument('--shard-size', type=int, default=5000,
+                        help="Số bản ghi mỗi shard (cũng là tần suất lưu checkpoint)")
+    parser.add_argument('--engine', default='torch', choices=['torch', 'onnxruntime', 'openvino'])
+    parser.add_argument('--model', default=None, help="Đường dẫn model YOLO (mặc định theo engine)")
+    parser.add_argument('--audio-model', default=AUDIO_MODEL_PATH)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--precision', default='fp32', choices=['fp32', 'fp16', 'int8'])
+    parser.add_argument('--tiled', action='store_true', help="Chia ảnh lớn thành tile (vật nhỏ)")
+    parser.add_argument('--conf', type=float, default=0.35)
+    parser.add_argument('--iou', type=float, default=0.5)
+    parser.add_argument('--batch-size', type=int, default=16, help="Số ảnh mỗi lần chạy YOLO")
+    parser.add_argument('--audio-batch', type=int, default=64,
+                        help="Số cửa sổ MFCC mỗi lần chạy model audio")
+    parser.add_argument('--workers', type=int, default=8, help="Số thread đọc / decode file")
+    parser.add_argument('--prefetch', type=int, default=64, help="Số file được đọc trước tối đa")
+    args = parser.parse_args()
+
+    media = walk_media(args.input, args.types)
+    writer = ShardWriter(args.output, args.shard_size, args.format)
+    print(f"Tìm thấy {', '.join(f'{len(v)} {k}' for k, v in media.items())}; "
+          f"đã xong {len(writer.done)} file từ lần chạy trước")
+
+    processor = None
+    if 'image' in args.types or 'video' in args.types:
+        processor = VideoProcessor(args.model, engine=args.engine, threads=args.threads,
+                                   precision=args.precision, imgsz=args.imgsz, tiled=args.tiled)
+    audio_model = None
+    if 'audio' in args.types and media.get('audio'):
+        from utils.model_registry import load_keras
+        audio_model = load_keras(args.audio_model)
+
+    runner = BatchRunner(args.input, writer, processor, audio_model, conf=args.conf,
+                         iou=args.iou, batch_size=args.batch_size, audio_batch=args.audio_batch,
+                         workers=args.workers, prefetch=args.prefetch)
+    try:
+        summary = runner.run(media)
+    finally:
+        # Dừng giữa chừng (Ctrl+C) vẫn lưu phần đã xử lý
+        writer.close()
+    print(runner.throughput.line())
+    with open(os.path.join(args.output, 'summary.json'), 'w') as f:
+        json.dump(dict(summary, args=vars(args)), f, indent=2)
+    print(f"Đã ghi kết quả vào {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,529 @@
+"""
+Đo hiệu năng các pipeline ảnh / video / audio / live.
+Ảnh / audio / live chạy đúng hàm của app.py (process_image, predict_audio, generate_frames),
+thời gian từng bước lấy từ STAGE_SECONDS mà các hàm đó ghi.
+
+Ví dụ:
+    python -m utils.benchmark --engine stub --pipelines image video audio live
+    python -m utils.benchmark --engine torch --video V_AIRPLANE_007.mp4 --output bench.json
+    python -m utils.benchmark --pipelines jpeg
+
+--engine stub dùng model giả (không cần file weights) để đo phần còn lại của pipeline.
+Kết quả ghi ra JSON để so sánh giữa các lần chạy.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from utils.audio_stream import iter_ffmpeg_blocks, DEFAULT_SAMPLE_RATE
+from utils.detections import Detections
+from utils.detector_backends import (BACKENDS, DEFAULT_MODEL_PATHS, DetectorBackend,
+                                     create_detector, letterbox, to_blob)
+from utils.metrics import LIVE_DROPPED, STAGE_SECONDS
+from utils.mjpeg_output import JpegEncoder, MjpegOutput, StreamProfile
+from utils.video_pipeline import FFmpegVideoWriter, VideoPipeline
+
+CLASS_LABELS = ['airplane', 'bird', 'drone', 'helicopter']
+
+
+class StubDetector(DetectorBackend):
+    """
+    Detector giả: làm đủ bước letterbox + tạo tensor như model thật,
+    phần "infer" chỉ là phép tính NumPy nhẹ, luôn trả về một box cố định.
+    """
+
+    engine = 'stub'
+
+    def __init__(self, model_path=None, **kwargs):
+        super().__init__(model_path, **kwargs)
+        self.names = {i: name.capitalize() for i, name in enumerate(CLASS_LABELS)}
+
+    def predict(self, frames, conf=None, iou=None):
+        t0 = time.perf_counter()
+        boxed = [letterbox(frame, self.imgsz) for frame in frames]
+        blob = to_blob([b[0] for b in boxed])
+        t1 = time.perf_counter()
+        # Giả lập chi phí infer: pooling 8x8 trên toàn tensor
+        n, c, h, w = blob.shape
+        blob.reshape(n, c, h // 8, 8, w // 8, 8).mean(axis=(3, 5))
+        t2 = time.perf_counter()
+        detections = []
+        for frame in frames:
+            h, w = frame.shape[:2]
+            detections.append(Detections([[w * 0.4, h * 0.4, w * 0.6, h * 0.6]], [0.9], [2],
+                                         self.names))
+        self.last_timings = {'preprocess': t1 - t0, 'infer': t2 - t1,
+                             'postprocess': time.perf_counter() - t2}
+        return detections
+
+
+# --engine stub đi qua registry như engine thật (app.py / VideoProcessor dùng được)
+BACKENDS['stub'] = StubDetector
+DEFAULT_MODEL_PATHS.setdefault('stub', 'stub')
+
+
+class StubAudioModel:
+    """
+    Model audio giả có cùng giao diện predict với Keras
+    """
+
+    input_shape = (None, 40, 174, 1)
+
+    def __init__(self, num_classes=len(CLASS_LABELS)):
+        self.weights = np.random.default_rng(0).normal(size=(40, num_classes)).astype(np.float32)
+
+    def predict(self, batch, verbose=0):
+        logits = batch.mean(axis=(2, 3)) @ self.weights
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+
+class StageTimer:
+    """
+    Gom thời gian từng bước để tính p50 / p95 / p99
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.samples[name].append(time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    @contextmanager
+    def collect(self, *pipelines, histogram=STAGE_SECONDS):
+        """
+        Trong khối with: lấy thời gian code thật ghi vào histogram cho các pipeline.
+        Bước của pipeline đầu giữ nguyên tên, pipeline khác thêm tiền tố (vd: server_infer)
+        """
+        def record(seconds, labels):
+            pipeline = labels.get('pipeline')
+            if pipeline not in pipelines:
+                return
+            stage = labels['stage']
+            self.add(stage if pipeline == pipelines[0] else f'{pipeline}_{stage}', seconds)
+
+        with histogram.listen(record):
+            yield self
+
+    def summary(self):
+        result = {}
+        for name, values in self.samples.items():
+            ms = np.asarray(values) * 1000
+            result[name] = {
+                'count': len(values),
+                'mean_ms': round(float(ms.mean()), 3),
+                'p50_ms': round(float(np.percentile(ms, 50)), 3),
+                'p95_ms': round(float(np.percentile(ms, 95)), 3),
+                'p99_ms': round(float(np.percentile(ms, 99)), 3),
+            }
+        return result
+
+
+class ResourceMonitor:
+    """
+    Đo CPU (tổng user + sys của tiến trình / thời gian thực) và RSS đỉnh.
+    Linux: đỉnh RSS được đặt lại khi bắt đầu nên là đỉnh của riêng pipeline đang đo;
+    nơi khác chỉ có đỉnh của cả tiến trình (gồm các pipeline chạy trước), ghi rõ trong
+    peak_rss_scope
+    """
+
+    def __enter__(self):
+        self.rss_scope = 'pipeline' if _reset_peak_rss() else 'process'
+        self.wall_start = time.perf_counter()
+        self.cpu_start = _cpu_seconds()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.wall_start
+        self.cpu = _cpu_seconds() - self.cpu_start
+        # Đọc ngay khi kết thúc: lần đo sau sẽ đặt lại đỉnh RSS
+        self.peak_rss = _peak_rss_mb(self.rss_scope)
+        return False
+
+    def report(self):
+        cores = self.cpu / self.wall if self.wall > 0 else 0.0
+        return {
+            'wall_seconds': round(self.wall, 3),
+            'cpu_seconds': round(self.cpu, 3),
+            'cpu_cores_used': round(cores, 2),
+            'cpu_percent_of_machine': round(100 * cores / (os.cpu_count() or 1), 1),
+            'peak_rss_mb': round(self.peak_rss, 1),
+            'peak_rss_scope': self.rss_scope,
+        }
+
+
+def _cpu_seconds():
+    t = os.times()
+    return t.user + t.system
+
+
+def _reset_peak_rss():
+    """
+    Đặt lại đỉnh RSS (VmHWM) của tiến trình về RSS hiện tại, True nếu làm được (Linux)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb(scope='process'):
+    if scope == 'pipeline':
+        # ru_maxrss không được đặt lại, đọc VmHWM (KB) từ /proc
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    # Linux: KB, macOS: byte
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if platform.system() == 'Darwin' else peak / 1024
+
+
+def synthetic_frames(count, width=1280, height=720, seed=0):
+    """
+    Frame giả: nền nhiễu + một hình vuông di chuyển (giả lập vật thể bay)
+    """
+    rng = np.random.default_rng(seed)
+    background = rng.integers(90, 140, size=(height, width, 3), dtype=np.uint8)
+    for i in range(count):
+        frame = background.copy()
+        x = int((i * 7) % (width - 40))
+        y = int(height / 3 + 40 * np.sin(i / 10))
+        cv2.rectangle(frame, (x, y), (x + 30, y + 12), (40, 40, 40), -1)
+        yield frame
+
+
+def synthetic_video(path, count=120, fps=25, width=1280, height=720):
+    writer = FFmpegVideoWriter(path, width, height, fps)
+    for frame in synthetic_frames(count, width, height):
+        writer.write(frame)
+    writer.close()
+    return path
+
+
+def synthetic_audio_blocks(seconds=60.0, sr=DEFAULT_SAMPLE_RATE, block_seconds=5.0):
+    rng = np.random.default_rng(0)
+    block = int(block_seconds * sr)
+    total = int(seconds * sr)
+    for start in range(0, total, block):
+        t = np.arange(start, min(start + block, total)) / sr
+        yield (0.3 * np.sin(2 * np.pi * 180 * t)
+               + 0.05 * rng.normal(size=len(t))).astype(np.float32)
+
+
+def _record_detector(timer, detector, per_frames=1):
+    for name, seconds in detector.last_timings.items():
+        timer.add(name, seconds / per_frames)
+
+
+def bench_image(app_module, frames, repeat=1):
+    """
+    app.process_image: đọc JPEG -> YOLO -> vẽ -> ghi JPEG
+    """
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+    inputs = []
+    for i, frame in enumerate(frames):
+        path = os.path.join(work_dir, f'{i}.jpg')
+        cv2.imwrite(path, frame)
+        inputs.append(path)
+    output_path = os.path.join(work_dir, 'out.jpg')
+    timer = StageTimer()
+    count = 0
+    with timer.collect('image', 'server'), ResourceMonitor() as monitor:
+        for _ in range(repeat):
+            for path in inputs:
+                app_module.process_image(path, output_path)
+                count += 1
+    return {'frames': count, 'fps': round(count / monitor.wall, 2),
+            'stages': timer.summary(), 'resources': monitor.report()}
+
+
+def bench_video(detector, video_path, batch_size=8, max_frames=300):
+    """
+    Đo từng bước bằng một lượt tuần tự, sau đó đo throughput thật của VideoPipeline (đa luồng)
+    """
+    timer = StageTimer()
+    out_dir = tempfile.mkdtemp(prefix='bench_')
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    writer = FFmpegVideoWriter(os.path.join(out_dir, 'stages.mp4'), width, height, fps)
+
+    count = 0
+    with ResourceMonitor() as stage_monitor:
+        while count < max_frames:
+            batch = []
+            while len(batch) < batch_size and count + len(batch) < max_frames:
+                with timer.stage('decode'):
+                    ok, frame = cap.read()
+                if not ok:
+                    break
+                batch.append(frame)
+            if not batch:
+                break
+            start = time.perf_counter()
+            results = detector.predict(batch)
+            timer.add('total_infer', (time.perf_counter() - start) / len(batch))
+            _record_detector(timer, detector, per_frames=len(batch))
+            for frame, detections in zip(batch, results):
+                with timer.stage('plot'):
+                    plotted = detections.plot(frame, copy=False)
+                with timer.stage('encode'):
+                    writer.write(plotted)
+            count += len(batch)
+    cap.release()
+    writer.close()
+
+    pipeline = VideoPipeline(detector, batch_size=batch_size)
+    with ResourceMonitor() as pipeline_monitor:
+        pipeline_frames = pipeline.run(video_path, os.path.join(out_dir, 'pipeline.mp4'))
+
+    return {
+        'frames': count,
+        'sequential_fps': round(count / stage_monitor.wall, 2),
+        'stages': timer.summary(),
+        'sequential_resources': stage_monitor.report(),
+        'pipeline_frames': pipeline_frames,
+        'pipeline_fps': round(pipeline_frames / pipeline_monitor.wall, 2),
+        'pipeline_resources': pipeline_monitor.report(),
+        'source_fps': fps,
+    }
+
+
+def bench_audio(app_module, audio_path):
+    """
+    app.predict_audio: đọc khối audio -> MFCC theo cửa sổ -> predict theo batch
+    """
+    timer = StageTimer()
+    with timer.collect('audio'), ResourceMonitor() as monitor:
+        label, confidence, _ = app_module.predict_audio(audio_path)
+    # Mỗi cửa sổ tính MFCC một lần
+    windows = len(timer.samples.get('mfcc', ()))
+    return {'windows': windows, 'windows_per_sec': round(windows / monitor.wall, 2),
+            'label': label, 'confidence': confidence,
+            'stages': timer.summary(), 'resources': monitor.report()}
+
+
+def bench_live(app_module, source, duration=10.0):
+    """
+    app.generate_frames với profile mặc định của /video_feed: đọc frame mới nhất ->
+    detect / track -> vẽ -> JPEG. end_to_end = từ lúc đọc frame đến lúc chunk MJPEG sẵn sàng
+    """
+    with app_module.app.test_request_context('/video_feed'):
+        profile = app_module.stream_profile()
+
+    def dropped(reason):
+        return LIVE_DROPPED.value(source=source, reason=reason)
+
+    dropped_before = {reason: dropped(reason) for reason in ('reader', 'stale')}
+    timer = StageTimer()
+    produced = 0
+    with timer.collect('live', 'server'), ResourceMonitor() as monitor:
+        stream = app_module.generate_frames(source, profile)
+        deadline = time.monotonic() + duration
+        try:
+            for _ in stream:
+                produced += 1
+                if time.monotonic() >= deadline:
+                    break
+        finally:
+            # Client cuối rời đi -> thread đọc + YOLO của nguồn dừng
+            stream.close()
+    return {'frames_out': produced, 'fps': round(produced / monitor.wall, 2),
+            'dropped_by_reader': dropped('reader') - dropped_before['reader'],
+            'dropped_stale': dropped('stale') - dropped_before['stale'],
+            'stages': timer.summary(), 'resources': monitor.report()}
+
+
+def _legacy_mjpeg_chunk(frame, quality=None):
+    # Đường cũ: imencode (mặc định chất lượng 95 của OpenCV) + tobytes() + nối chuỗi
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality is not None else []
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n'
+            + cv2.imencode('.jpg', frame, params)[1].tobytes() + b'\r\n')
+
+
+def bench_jpeg(frames, repeat=3, quality=80, viewers=4):
+    """
+    So sánh đường encode MJPEG cũ với MjpegOutput (OpenCV / libjpeg-turbo, các profile thu nhỏ).
+    viewers: số client cùng profile (đường cũ trước đây cũng encode một lần mỗi frame).
+    Đường cũ được đo ở chất lượng mặc định (như trước đây) và ở cùng chất lượng với đường mới:
+    speedup_same_quality chỉ tính phần nhanh hơn của encoder, không gồm việc hạ chất lượng
+    """
+    def run(make_chunk):
+        timer = StageTimer()
+        sizes = []
+        with ResourceMonitor() as monitor:
+            for _ in range(repeat):
+                for seq, frame in enumerate(frames):
+                    with timer.stage('chunk'):
+                        chunk = make_chunk(seq, frame)
+                    sizes.append(len(chunk))
+        count = len(sizes)
+        return {'frames': count, 'fps': round(count / monitor.wall, 2),
+                'mean_kb': round(float(np.mean(sizes)) / 1024, 1),
+                'stages': timer.summary(), 'resources': monitor.report()}
+
+    same_quality = f'legacy_q{quality}'
+    results = {'legacy': run(lambda seq, frame: _legacy_mjpeg_chunk(frame)),
+               same_quality: run(lambda seq, frame: _legacy_mjpeg_chunk(frame, quality))}
+    backends = ['opencv']
+    try:
+        JpegEncoder(backend='turbojpeg')
+        backends.append('turbojpeg')
+    except (ImportError, OSError, RuntimeError):
+        pass
+    for backend in backends:
+        encoder = JpegEncoder(quality, backend=backend)
+        for width in (None, 1280, 960, 640):
+            output = MjpegOutput(encoder, pipeline='bench')
+            profile = StreamProfile(width, quality)
+
+            def make_chunk(seq, frame):
+                # Nhiều client cùng profile: chỉ client đầu tiên encode
+                for _ in range(viewers):
+                    chunk = output.chunk(seq, frame, profile)
+                return chunk
+
+            results[f'{backend}_q{quality}_w{width or "full"}'] = run(make_chunk)
+    base = results['legacy']['fps']
+    base_same_quality = results[same_quality]['fps']
+    for result in results.values():
+        result['speedup_vs_legacy'] = round(result['fps'] / base, 2) if base else None
+        result['speedup_same_quality'] = (round(result['fps'] / base_same_quality, 2)
+                                          if base_same_quality else None)
+    return results
+
+
+def build_detector(engine, model_path=None, imgsz=640, threads=None, precision='fp32'):
+    return create_detector(engine, model_path, imgsz=imgsz, threads=threads, precision=precision)
+
+
+def load_app(args):
+    """
+    Import app.py, cấu hình detector / model audio theo tham số benchmark
+    """
+    import app as app_module
+    from utils.model_registry import load_keras
+
+    app_module.app.config.update(DETECTOR_ENGINE=args.engine, DETECTOR_MODEL_PATH=args.model,
+                                 DETECTOR_IMGSZ=args.imgsz, DETECTOR_THREADS=args.threads,
+                                 DETECTOR_PRECISION=args.precision,
+                                 INFERENCE_SERVER=not args.no_inference_server,
+                                 LIVE_DETECT_EVERY=args.detect_every)
+    if args.audio_model:
+        app_module.model_registry.register('audio', lambda: load_keras(args.audio_model))
+    else:
+        app_module.model_registry.register('audio', StubAudioModel)
+    # Đo tính MFCC thật, không đo đọc cache
+    app_module.mfcc_cache = None
+    return app_module
+
+
+def write_synthetic_audio(path, seconds=60.0, sr=DEFAULT_SAMPLE_RATE):
+    import soundfile as sf
+    sf.write(path, np.concatenate(list(synthetic_audio_blocks(seconds, sr))), sr)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các pipeline nhận diện")
+    parser.add_argument('--pipelines', nargs='+', default=['image', 'video', 'audio', 'live'],
+                        choices=['image', 'video', 'audio', 'live', 'jpeg'])
+    parser.add_argument('--engine', default='stub',
+                        choices=['stub', 'torch', 'onnxruntime', 'openvino'])
+    parser.add_argument('--model', default=None, help="Đường dẫn model YOLO (mặc định theo engine)")
+    parser.add_argument('--audio-model', default=None,
+                        help="Model Keras .h5 (bỏ trống: dùng model audio giả)")
+    parser.add_argument('--video', default='V_AIRPLANE_007.mp4',
+                        help="Video đầu vào; không tồn tại thì tạo video giả")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--precision', default='fp32', choices=['fp32', 'fp16', 'int8'])
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--frames', type=int, default=300, help="Số frame tối đa cho ảnh / video")
+    parser.add_argument('--audio-seconds', type=float, default=60.0,
+                        help="Độ dài audio giả nếu video không có audio")
+    parser.add_argument('--live-seconds', type=float, default=10.0)
+    parser.add_argument('--detect-every', type=int, default=1)
+    parser.add_argument('--no-inference-server', action='store_true',
+                        help="Gọi detector trực tiếp, không qua InferenceServer")
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    app_module = None
+    if {'image', 'audio', 'live'} & set(args.pipelines):
+        app_module = load_app(args)
+    video_path = args.video
+    if not os.path.exists(video_path):
+        video_path = synthetic_video(os.path.join(tempfile.mkdtemp(prefix='bench_'), 'synthetic.mp4'))
+
+    results = {}
+    if 'image' in args.pipelines:
+        frames = list(synthetic_frames(min(args.frames, 50)))
+        results['image'] = bench_image(app_module, frames, repeat=max(1, args.frames // 50))
+    if 'video' in args.pipelines:
+        detector = build_detector(args.engine, args.model, args.imgsz, args.threads,
+                                  args.precision)
+        results['video'] = bench_video(detector, video_path, args.batch_size, args.frames)
+    if 'audio' in args.pipelines:
+        # Chỉ thử khối đầu để biết video có audio không
+        probe = iter_ffmpeg_blocks(video_path, DEFAULT_SAMPLE_RATE)
+        has_audio = next(probe, None) is not None
+        probe.close()
+        if has_audio:
+            audio_path, source = video_path, 'video'
+        else:
+            audio_path = write_synthetic_audio(
+                os.path.join(tempfile.mkdtemp(prefix='bench_'), 'synthetic.wav'),
+                args.audio_seconds)
+            source = 'synthetic'
+        results['audio'] = bench_audio(app_module, audio_path)
+        results['audio']['source'] = source
+    if 'jpeg' in args.pipelines:
+        # Frame 1080p (kích thước gây tốn CPU nhất cho luồng MJPEG)
+        frames = list(synthetic_frames(30, width=1920, height=1080))
+        results['jpeg'] = bench_jpeg(frames, repeat=max(1, args.frames // 30))
+    if 'live' in args.pipelines:
+        results['live'] = bench_live(app_module, video_path, args.live_seconds)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'engine': args.engine,
+            'args': vars(args),
+            'video': video_path,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report['results'], indent=2))
+    print(f"Đã ghi kết quả vào {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+import threading
+import time
+
+from utils.live_reader import LatestFrameReader
+from utils.metrics import STAGE_SECONDS, LIVE_FRAMES, LIVE_DROPPED, metrics
+from utils.mjpeg_output import AdaptiveProfile, MjpegOutput
+
+BATCH_SIZE = metrics.histogram('camera_batch_size', 'Frames per cross-camera detector batch',
+                               buckets=(1, 2, 4, 8, 16, 32, 64))
+
+
+class Camera:
+    """
+    Một nguồn trong CameraManager: thread đọc riêng (LatestFrameReader),
+    giữ kết quả mới nhất để các client (MJPEG / NDJSON) tự lấy theo tốc độ của mình
+    """
+
+    def __init__(self, camera_id, source, on_frame, gate=None):
+        self.id = camera_id
+        self.source = source
+        # MotionGate riêng của camera (None: frame nào cũng chạy YOLO)
+        self.gate = gate
+        self.reader = LatestFrameReader(source, on_frame=on_frame)
+        self.added_at = time.time()
+        self.processed = 0
+        self.dropped = 0
+        self.removed = False
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._latest = None     # (frame, captured_at, index, detections)
+        self._annotated = None  # (seq, frame đã vẽ) của _latest
+        self._render_lock = threading.Lock()
+        self.output = MjpegOutput(pipeline='cameras')
+        self._viewers = 0
+
+    def start(self):
+        if not self.reader.isOpened():
+            raise IOError(f"Không mở được nguồn {self.source}")
+        self.reader.start()
+
+    def stop(self):
+        self.reader.release()
+        with self._cond:
+            self.removed = True
+            self._cond.notify_all()
+
+    @property
+    def finished(self):
+        return self.removed or self.reader.finished
+
+    @property
+    def last_detections(self):
+        latest = self._latest
+        return latest[3] if latest is not None else None
+
+    def publish(self, frame, captured_at, index, detections):
+        with self._cond:
+            self._latest = (frame, captured_at, index, detections)
+            self._seq += 1
+            self.processed += 1
+            self._cond.notify_all()
+        LIVE_FRAMES.inc(source=self.id)
+
+    def _wait_next(self, last_seq):
+        """
+        Chờ kết quả mới hơn last_seq -> (seq, latest); None nếu camera đã dừng
+        """
+        with self._cond:
+            while True:
+                self._cond.wait_for(lambda: self._seq != last_seq or self.finished, timeout=1.0)
+                if self._seq != last_seq:
+                    return self._seq, self._latest
+                if self.finished:
+                    return None
+
+    def records(self):
+        """
+        Generator: detections mới nhất dạng dict (bỏ qua kết quả client chưa kịp lấy)
+        """
+        last_seq = self._seq
+        started_at = None
+        while True:
+            item = self._wait_next(last_seq)
+            if item is None:
+                return
+            last_seq, (_, captured_at, index, detections) = item
+            if started_at is None:
+                started_at = captured_at
+            record = detections.to_record(index, captured_at - started_at)
+            record['camera'] = self.id
+            yield record
+
+    def mjpeg(self, profile=None):
+        """
+        Generator MJPEG: chỉ vẽ + encode khi có người xem; mỗi frame vẽ một lần và
+        encode một lần cho mỗi profile (độ phân giải / chất lượng) dù có nhiều client
+        """
+        profile = profile or AdaptiveProfile()
+        with self._cond:
+            self._viewers += 1
+        try:
+            last_seq = self._seq
+            while True:
+                item = self._wait_next(last_seq)
+                if item is None:
+                    return
+                seq, latest = item
+                profile.feedback(seq - last_seq - 1)
+                last_seq = seq
+                yield self.output.chunk(seq, self._render(seq, latest), profile.current)
+        finally:
+            with self._cond:
+                self._viewers -= 1
+
+    def _render(self, seq, latest):
+        with self._render_lock:
+            annotated = self._annotated
+            if annotated is not None and annotated[0] == seq:
+                return annotated[1]
+            frame, _, _, detections = latest
+            with STAGE_SECONDS.time(pipeline='cameras', stage='plot'):
+                annotated = detections.plot(frame)
+            self._annotated = (seq, annotated)
+            return annotated
+
+    def stats(self):
+        return {'id': self.id, 'source': self.source, 'processed': self.processed,
+                'dropped': self.dropped + self.reader.dropped, 'viewers': self._viewers,
+                'finished': self.finished, 'added_at': self.added_at,
+                'motion_skipped': self.gate.skipped if self.gate is not None else 0}
+
+
+class CameraManager:
+    """
+    Nhiều camera dùng chung MỘT detector:
+    - mỗi camera có thread đọc riêng, chỉ giữ frame mới nhất
+    - một worker gom frame mới nhất của mọi camera thành một batch, chạy YOLO một lần,
+      rồi trả kết quả về đúng camera
+    - thêm / bớt camera lúc đang chạy
+    """
+
+    def __init__(self, get_detector, conf=0.35, iou=0.5, max_batch=16, max_latency=0.5,
+                 make_gate=None):
+        # get_detector() -> DetectorBackend (gọi lười để không load model khi chưa có camera)
+        self.get_detector = get_detector
+        # make_gate() -> MotionGate cho mỗi camera mới (None: không lọc chuyển động)
+        self.make_gate = make_gate
+        self.conf = conf
+        self.iou = iou
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._cameras = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._new_frames = False
+        self._worker = None
+        self._running = False
+        # Vị trí bắt đầu gom batch, xoay vòng để camera nào cũng được chạy khi có hơn max_batch camera
+        self._offset = 0
+        metrics.gauge('cameras', 'Registered cameras').set_function(lambda: len(self._cameras))
+
+    def add(self, camera_id, source):
+        gate = self.make_gate() if self.make_gate is not None else None
+        camera = Camera(camera_id, source, self._notify, gate)
+        with self._lock:
+            if camera_id in self._cameras:
+                raise ValueError(f"Camera {camera_id} đã tồn tại")
+            self._cameras[camera_id] = camera
+        try:
+            camera.start()
+        except Exception:
+            with self._lock:
+                self._cameras.pop(camera_id, None)
+            raise
+        self._ensure_worker()
+        return camera
+
+    def remove(self, camera_id):
+        with self._lock:
+            camera = self._cameras.pop(camera_id, None)
+        if camera is None:
+            return False
+        camera.stop()
+        return True
+
+    def get(self, camera_id):
+        with self._lock:
+            return self._cameras.get(camera_id)
+
+    def list(self):
+        with self._lock:
+            cameras = list(self._cameras.values())
+        return [camera.stats() for camera in cameras]
+
+    def stop(self):
+        with self._lock:
+            cameras = list(self._cameras.values())
+            self._cameras.clear()
+        for camera in cameras:
+            camera.stop()
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def _notify(self):
+        with self._cond:
+            self._new_frames = True
+            self._cond.notify_all()
+
+    def _ensure_worker(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _collect(self):
+        """
+        Lấy frame mới nhất chưa xử lý của từng camera (không chờ), bỏ frame quá cũ
+        """
+        with self._lock:
+            cameras = list(self._cameras.values())
+        if not cameras:
+            return []
+        start = self._offset % len(cameras)
+        cameras = cameras[start:] + cameras[:start]
+
+        batch = []
+        now = time.monotonic()
+        for camera in cameras:
+            item = camera.reader.read(timeout=0)
+            if item is None:
+                continue
+            frame, captured_at, index = item
+            if self.max_latency and now - captured_at > self.max_latency:
+                camera.dropped += 1
+                LIVE_DROPPED.inc(source=camera.id, reason='stale')
+                continue
+            # Cảnh không đổi: giữ kết quả cũ cho frame mới, không đưa vào batch
+            previous = camera.last_detections
+            if (camera.gate is not None and previous is not None
+                    and not camera.gate.should_detect(frame, captured_at)):
+                camera.publish(frame, captured_at, index, previous)
+                continue
+            batch.append((camera, frame, captured_at, index))
+            if len(batch) >= self.max_batch:
+                break
+        self._offset = start + len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._new_frames or not self._running, timeout=0.5)
+                if not self._running:
+                    return
+                self._new_frames = False
+
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                detector = self.get_detector()
+                with STAGE_SECONDS.time(pipeline='cameras', stage='infer'):
+                    results = detector.predict([item[1] for item in batch],
+                                               conf=self.conf, iou=self.iou)
+            except Exception as e:
+                print(f"Lỗi detector khi xử lý camera: {e}")
+                time.sleep(0.5)
+                continue
+            BATCH_SIZE.observe(len(batch))
+            for (camera, frame, captured_at, index), detections in zip(batch, results):
+                camera.publish(frame, captured_at, index, detections)
+
+            # Còn camera chưa được xử lý trong lượt này -> chạy tiếp ngay
+            if len(batch) >= self.max_batch:
+                self._notify()
@@ -1,12 +1,12 @@
-from moviepy.editor import VideoFileClip
+import subprocess
+
+from utils.video_pipeline import get_ffmpeg_exe
 
 def convert_mp4_to_wav(mp4_file, wav_file):
     try:
-        # Tải tệp video
-        video = VideoFileClip(mp4_file)
-            # Trích xuất và lưu âm thanh
-        video.audio.write_audiofile(wav_file)
-        video.close()
+        # Trích xuất thẳng track audio bằng ffmpeg (không giải mã cả video qua moviepy)
+        subprocess.run([get_ffmpeg_exe(), '-y', '-loglevel', 'error', '-i', mp4_file,
+                        '-vn', '-acodec', 'pcm_s16le', wav_file], check=True)
         return wav_file
     except Exception as e:
         print(f"Có lỗi xảy ra: {e}")
@@ -0,0 +1,223 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SPLITS = ('train', 'val', 'test')
+INDEX_NAME = '.label_index.npz'
+
+# Cột của bảng box (mỗi dòng label YOLO là một box)
+BOX_COLUMNS = ('cls', 'cx', 'cy', 'w', 'h')
+
+
+def parse_label_file(path):
+    """
+    Một file label YOLO -> mảng (N, 5) float32 [class, cx, cy, w, h].
+    Dòng polygon (segmentation) chỉ lấy 5 cột đầu; dòng lỗi bị bỏ qua
+    """
+    with open(path, 'r') as f:
+        rows = [parts[:5] for parts in (line.split() for line in f) if len(parts) >= 5]
+    try:
+        # numpy tự đổi chuỗi -> float cho cả file một lần
+        return np.array(rows, np.float32).reshape(-1, 5)
+    except ValueError:
+        pass
+    valid = []
+    for row in rows:
+        try:
+            valid.append([float(v) for v in row])
+        except ValueError:
+            continue
+    return np.array(valid, np.float32).reshape(-1, 5)
+
+
+def parse_label_files(paths):
+    return [parse_label_file(path) for path in paths]
+
+
+def scan_labels(root_path, splits=SPLITS):
+    """
+    Liệt kê file label bằng os.scandir -> [(split, tên file, path, size, mtime_ns)]
+    """
+    files = []
+    for split in splits:
+        labels_path = os.path.join(root_path, split, 'labels')
+        if not os.path.isdir(labels_path):
+            continue
+        with os.scandir(labels_path) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.txt'):
+                    continue
+                stat = entry.stat()
+                files.append((split, entry.name, entry.path, stat.st_size, stat.st_mtime_ns))
+    return files
+
+
+class DatasetIndex:
+    """
+    Chỉ mục dạng cột của toàn bộ label trong dataset YOLO, lưu tại <root>/.label_index.npz:
+    - bảng file: split, tên, size, mtime_ns, số box (box của file nằm liên tiếp trong bảng box)
+    - bảng box: file_id, cls, cx, cy, w, h (tọa độ chuẩn hóa 0..1)
+    update() chỉ parse lại các file mới / đổi size hoặc mtime (song song bằng process pool)
+    """
+
+    def __init__(self, root_path, splits=SPLITS, index_path=None):
+        self.root_path = root_path
+        self.splits = tuple(splits)
+        self.index_path = index_path or os.path.join(root_path, INDEX_NAME)
+        self._empty()
+        self.load()
+
+    def _empty(self):
+        self.file_split = np.zeros(0, np.int8)
+        self.file_name = np.zeros(0, dtype=object)
+        self.file_size = np.zeros(0, np.int64)
+        self.file_mtime = np.zeros(0, np.int64)
+        self.file_count = np.zeros(0, np.int64)
+        self.boxes = np.zeros((0, 5), np.float32)
+
+    def __len__(self):
+        return len(self.file_name)
+
+    @property
+    def box_file(self):
+        # file_id của từng box
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.file_count)
+
+    @property
+    def box_class(self):
+        return self.boxes[:, 0].astype(np.int64)
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                if tuple(data['splits']) != self.splits:
+                    return False
+                self.file_split = data['file_split']
+                self.file_name = data['file_name'].astype(object)
+                self.file_size = data['file_size']
+                self.file_mtime = data['file_mtime']
+                self.file_count = data['file_count']
+                self.boxes = data['boxes']
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Không đọc được index {self.index_path}, tạo lại: {e}")
+            self._empty()
+            return False
+        return True
+
+    def save(self):
+        tmp_path = self.index_path + '.tmp.npz'
+        np.savez(tmp_path, splits=np.array(self.splits), file_split=self.file_split,
+                 file_name=self.file_name.astype(str), file_size=self.file_size,
+                 file_mtime=self.file_mtime, file_count=self.file_count, boxes=self.boxes)
+        os.replace(tmp_path, self.index_path)
+
+    def update(self, workers=None, chunk_size=512):
+        """
+        Đồng bộ index với thư mục: giữ nguyên box của file không đổi, parse lại file mới / đã sửa,
+        bỏ file đã xóa. Trả về (số file parse lại, số file bị xóa)
+        """
+        files = scan_labels(self.root_path, self.splits)
+        split_ids = {split: i for i, split in enumerate(self.splits)}
+        old = {(int(s), n): i for i, (s, n) in enumerate(zip(self.file_split, self.file_name))}
+
+        keep, changed = [], []
+        for split, name, path, size, mtime in files:
+            i = old.pop((split_ids[split], name), None)
+            if i is not None and self.file_size[i] == size and self.file_mtime[i] == mtime:
+                keep.append(i)
+            else:
+                changed.append((split_ids[split], name, path, size, mtime))
+        removed = len(old)
+
+        if not changed and not removed:
+            return 0, 0
+
+        # Box của các file giữ lại: một lần lọc mảng theo mask. keep phải theo thứ tự trong index
+        # (không phải thứ tự scandir) để khớp với thứ tự box đã lọc
+        keep = np.sort(np.asarray(keep, np.int64))
+        box_mask = np.zeros(len(self), bool)
+        box_mask[keep] = True
+        kept_boxes = self.boxes[np.repeat(box_mask, self.file_count)]
+
+        parsed = []
+        if changed:
+            paths = [item[2] for item in changed]
+            chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+            if len(chunks) == 1:
+                parsed = parse_label_files(paths)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    for result in pool.map(parse_label_files, chunks):
+                        parsed.extend(result)
+
+        self.file_split = np.concatenate([self.file_split[keep],
+                                          np.array([c[0] for c in changed], np.int8)])
+        self.file_name = np.concatenate([self.file_name[keep],
+                                         np.array([c[1] for c in changed], dtype=object)])
+        self.file_size = np.concatenate([self.file_size[keep],
+                                         np.array([c[3] for c in changed], np.int64)])
+        self.file_mtime = np.concatenate([self.file_mtime[keep],
+                                          np.array([c[4] for c in changed], np.int64)])
+        self.file_count = np.concatenate([self.file_count[keep],
+                                          np.array([len(b) for b in parsed], np.int64)])
+        self.boxes = np.concatenate([kept_boxes] + parsed).astype(np.float32).reshape(-1, 5)
+        self.save()
+        return len(changed), removed
+
+    # --- THỐNG KÊ (vector hóa trên bảng box) ---
+
+    def class_counts(self, num_classes):
+        """
+        (số box, số ảnh chứa class) cho từng class
+        """
+        cls = self.box_class
+        valid = (cls >= 0) & (cls < num_classes)
+        boxes = np.bincount(cls[valid], minlength=num_classes)
+        # Một ảnh có 2 con Drone thì chỉ tính là 1 ảnh chứa Drone
+        pairs = np.unique(self.box_file[valid] * num_classes + cls[valid])
+        images = np.bincount(pairs % num_classes, minlength=num_classes)
+        return boxes, images
+
+    def split_counts(self):
+        return {split: int(np.count_nonzero(self.file_split == i))
+                for i, split in enumerate(self.splits)}
+
+    def split_balance(self, num_classes):
+        """
+        Ma trận (số split, số class): số box mỗi class trong từng split
+        """
+        cls = self.box_class
+        valid = (cls >= 0) & (cls < num_classes)
+        split = self.file_split[self.box_file[valid]].astype(np.int64)
+        flat = np.bincount(split * num_classes + cls[valid],
+                           minlength=len(self.splits) * num_classes)
+        return flat.reshape(len(self.splits), num_classes)
+
+    def box_sizes(self):
+        # Kích thước box chuẩn hóa: căn bậc hai diện tích (0..1)
+        return np.sqrt(np.clip(self.boxes[:, 3] * self.boxes[:, 4], 0, None))
+
+    def aspect_ratios(self):
+        return self.boxes[:, 3] / np.maximum(self.boxes[:, 4], 1e-6)
+
+    def size_histogram(self, bins=20):
+        return np.histogram(self.box_sizes(), bins=bins, range=(0.0, 1.0))
+
+    def aspect_histogram(self, bins=20):
+        # Chia bin theo log2 để tỉ lệ 1:4 và 4:1 đối xứng
+        return np.histogram(np.log2(np.maximum(self.aspect_ratios(), 1e-6)), bins=bins,
+                            range=(-4.0, 4.0))
+
+    def small_object_ratio(self, num_classes, threshold=32 / 640):
+        """
+        Tỉ lệ box nhỏ (sqrt(w*h) < threshold, mặc định ~32px ở ảnh 640) theo từng class
+        """
+        cls = self.box_class
+        valid = (cls >= 0) & (cls < num_classes)
+        small = self.box_sizes()[valid] < threshold
+        total = np.bincount(cls[valid], minlength=num_classes)
+        small_count = np.bincount(cls[valid][small], minlength=num_classes)
+        return small_count / np.maximum(total, 1)
@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+
+# Bảng màu cố định cho từng class (BGR)
+COLORS = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255),
+          (49, 210, 207), (10, 249, 72), (23, 204, 146), (134, 219, 61)]
+
+
+class Detections:
+    """
+    Kết quả phát hiện của một frame: box xyxy (pixel), confidence, class id
+    (và track id nếu đã qua bộ tracking, xem utils/tracker.py)
+    """
+
+    def __init__(self, xyxy=None, conf=None, cls=None, names=None, track_ids=None):
+        self.xyxy = (np.zeros((0, 4), np.float32) if xyxy is None
+                     else np.asarray(xyxy, np.float32).reshape(-1, 4))
+        self.conf = (np.zeros(len(self.xyxy), np.float32) if conf is None
+                     else np.asarray(conf, np.float32).reshape(-1))
+        self.cls = (np.zeros(len(self.xyxy), np.int64) if cls is None
+                    else np.asarray(cls).astype(np.int64).reshape(-1))
+        self.names = names or {}
+        self.track_ids = (None if track_ids is None
+                          else np.asarray(track_ids).astype(np.int64).reshape(-1))
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    @classmethod
+    def from_yolo(cls, result):
+        """
+        Chuyển kết quả ultralytics (Results) sang Detections
+        """
+        boxes = result.boxes
+        return cls(boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(),
+                   boxes.cls.cpu().numpy(), result.names)
+
+    def label(self, i):
+        return self.names.get(int(self.cls[i]), str(int(self.cls[i])))
+
+    def plot(self, img, copy=True):
+        """
+        Vẽ box + nhãn lên ảnh (BGR)
+        """
+        if copy:
+            img = img.copy()
+        line_width = max(round(sum(img.shape[:2]) / 2 * 0.003), 2)
+        for i in range(len(self)):
+            x1, y1, x2, y2 = (int(v) for v in self.xyxy[i])
+            color = COLORS[int(self.cls[i]) % len(COLORS)]
+            cv2.rectangle(img, (x1, y1), (x2, y2), color, line_width)
+
+            text = f"{self.label(i)} {self.conf[i]:.2f}"
+            if self.track_ids is not None:
+                text = f"#{self.track_ids[i]} {text}"
+            (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, line_width / 3, 1)
+            y_text = y1 - 4 if y1 - th - 4 > 0 else y1 + th + 4
+            cv2.rectangle(img, (x1, y_text - th - 4), (x1 + tw, y_text + 2), color, -1)
+            cv2.putText(img, text, (x1, y_text), cv2.FONT_HERSHEY_SIMPLEX,
+                        line_width / 3, (255, 255, 255), 1, cv2.LINE_AA)
+        return img
+
+    def select(self, mask):
+        """
+        Detections chỉ gồm các box theo mask / chỉ số
+        """
+        track_ids = None if self.track_ids is None else self.track_ids[mask]
+        return Detections(self.xyxy[mask], self.conf[mask], self.cls[mask], self.names,
+                          track_ids)
+
+    def to_list(self):
+        items = [{'class': self.label(i),
+                  'class_id': int(self.cls[i]),
+                  'confidence': float(self.conf[i]),
+                  'xyxy': [float(v) for v in self.xyxy[i]]}
+                 for i in range(len(self))]
+        if self.track_ids is not None:
+            for item, track_id in zip(items, self.track_ids):
+                item['track_id'] = int(track_id)
+        return items
+
+    def to_record(self, frame_index=None, timestamp=None):
+        """
+        Bản ghi JSON của một frame: số thứ tự frame, thời điểm (giây) và các box
+        """
+        return {'frame': frame_index, 'timestamp': timestamp, 'detections': self.to_list()}
@@ -0,0 +1,308 @@
+import ast
+import glob
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+import yaml
+
+from utils.detections import Detections
+from utils.model_registry import registry
+
+# Đường dẫn model mặc định cho từng engine
+DEFAULT_MODEL_PATHS = {
+    'torch': 'models/best.pt',
+    'onnxruntime': 'models/best.onnx',
+    'openvino': 'models/best_openvino_model',
+}
+
+
+def resolve_model_variant(model_path, precision='fp32'):
+    """
+    Chọn bản model theo độ chính xác: best.onnx -> best_fp16.onnx / best_int8.onnx
+    (nếu file tồn tại), ngược lại dùng bản gốc
+    """
+    if precision in (None, 'fp32'):
+        return model_path
+    base, ext = os.path.splitext(model_path.rstrip('/\\'))
+    if base.endswith('_openvino_model'):
+        candidate = f"{base[:-len('_openvino_model')]}_{precision}_openvino_model"
+    else:
+        candidate = f"{base}_{precision}{ext}"
+    if os.path.exists(candidate):
+        return candidate
+    print(f"Không thấy model {precision} ({candidate}), dùng {model_path}")
+    return model_path
+
+
+class DetectorBackend:
+    """
+    Giao diện chung cho các engine chạy YOLO.
+    predict(frames) nhận list ảnh BGR, trả về list Detections (cùng cấu trúc cho mọi engine)
+    """
+
+    engine = None
+
+    def __init__(self, model_path, imgsz=640, conf=0.35, iou=0.5, threads=None,
+                 precision='fp32', max_det=300):
+        self.model_path = model_path
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.threads = threads
+        self.precision = precision
+        self.max_det = max_det
+        self.names = {}
+        # Thời gian (giây) từng bước của lần predict gần nhất: preprocess / infer / postprocess
+        self.last_timings = {}
+
+    def predict(self, frames, conf=None, iou=None):
+        raise NotImplementedError
+
+    def warmup(self):
+        self.predict([np.zeros((self.imgsz, self.imgsz, 3), np.uint8)])
+
+
+class TorchBackend(DetectorBackend):
+    """
+    PyTorch qua ultralytics (model .pt)
+    """
+
+    engine = 'torch'
+
+    def __init__(self, model_path, **kwargs):
+        super().__init__(model_path, **kwargs)
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+        # Dùng chung model YOLO trong registry (đã có khóa đa luồng)
+        self.model = registry.yolo(model_path, self.imgsz)
+        self.names = self.model.names
+        # FP16 chỉ có lợi trên GPU
+        self.half = self.precision == 'fp16' and _cuda_available()
+
+    def predict(self, frames, conf=None, iou=None):
+        results = self.model(list(frames), conf=self.conf if conf is None else conf,
+                             iou=self.iou if iou is None else iou,
+                             imgsz=self.imgsz, half=self.half, verbose=False)
+        # ultralytics đo sẵn thời gian (ms / ảnh) cho từng bước
+        if results:
+            speed = results[0].speed
+            self.last_timings = {
+                'preprocess': speed.get('preprocess', 0) * len(results) / 1000,
+                'infer': speed.get('inference', 0) * len(results) / 1000,
+                'postprocess': speed.get('postprocess', 0) * len(results) / 1000,
+            }
+        return [Detections.from_yolo(result) for result in results]
+
+
+class _ExportedBackend(DetectorBackend):
+    """
+    Phần chung cho model đã export (ONNX / OpenVINO): letterbox + NMS tự làm bằng NumPy/OpenCV
+    """
+
+    # Batch tối đa model nhận một lần (1 nếu model export với batch cố định)
+    max_batch = 1
+    input_dtype = np.float32
+
+    def predict(self, frames, conf=None, iou=None):
+        conf = self.conf if conf is None else conf
+        iou = self.iou if iou is None else iou
+        frames = list(frames)
+        detections = []
+        timings = {'preprocess': 0.0, 'infer': 0.0, 'postprocess': 0.0}
+        for start in range(0, len(frames), self.max_batch):
+            chunk = frames[start:start + self.max_batch]
+            t0 = time.perf_counter()
+            boxed = [letterbox(frame, self.imgsz) for frame in chunk]
+            blob = to_blob([b[0] for b in boxed], self.input_dtype)
+            t1 = time.perf_counter()
+            output = self._infer(blob)
+            t2 = time.perf_counter()
+            for i, frame in enumerate(chunk):
+                _, ratio, pad = boxed[i]
+                detections.append(decode_yolov8(output[i], conf, iou, ratio, pad,
+                                                frame.shape[:2], self.names, self.max_det))
+            timings['preprocess'] += t1 - t0
+            timings['infer'] += t2 - t1
+            timings['postprocess'] += time.perf_counter() - t2
+        self.last_timings = timings
+        return detections
+
+    def _infer(self, blob):
+        raise NotImplementedError
+
+
+class OnnxRuntimeBackend(_ExportedBackend):
+    """
+    ONNX Runtime trên CPU (model .onnx export từ ultralytics)
+    """
+
+    engine = 'onnxruntime'
+
+    def __init__(self, model_path, **kwargs):
+        super().__init__(model_path, **kwargs)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        path = resolve_model_variant(model_path, self.precision)
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_dtype = np.float16 if model_input.type == 'tensor(float16)' else np.float32
+        # Kích thước input cố định lúc export
+        if isinstance(model_input.shape[2], int):
+            self.imgsz = model_input.shape[2]
+        self.max_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else 64
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if 'names' in metadata:
+            self.names = ast.literal_eval(metadata['names'])
+
+    def _infer(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVINOBackend(_ExportedBackend):
+    """
+    OpenVINO trên CPU (thư mục *_openvino_model export từ ultralytics)
+    """
+
+    engine = 'openvino'
+
+    def __init__(self, model_path, **kwargs):
+        super().__init__(model_path, **kwargs)
+        from openvino.runtime import Core
+
+        path = resolve_model_variant(model_path, self.precision)
+        xml_path = path
+        if os.path.isdir(path):
+            xml_path = glob.glob(os.path.join(path, '*.xml'))[0]
+            metadata_path = os.path.join(path, 'metadata.yaml')
+            if os.path.exists(metadata_path):
+                with open(metadata_path) as f:
+                    self.names = yaml.safe_load(f).get('names', {})
+
+        core = Core()
+        config = {}
+        if self.threads:
+            config['INFERENCE_NUM_THREADS'] = str(self.threads)
+        model = core.read_model(xml_path)
+        self.compiled = core.compile_model(model, 'CPU', config)
+        self.output = self.compiled.output(0)
+        shape = model.input(0).get_partial_shape()
+        if shape[2].is_static:
+            self.imgsz = shape[2].get_length()
+        self.max_batch = shape[0].get_length() if shape[0].is_static else 64
+        # compiled model dùng chung một infer request -> khóa khi gọi từ nhiều thread
+        self._lock = threading.Lock()
+
+    def _infer(self, blob):
+        with self._lock:
+            return self.compiled([blob])[self.output]
+
+
+BACKENDS = {
+    'torch': TorchBackend,
+    'onnxruntime': OnnxRuntimeBackend,
+    'openvino': OpenVINOBackend,
+}
+
+
+def create_detector(engine='torch', model_path=None, **kwargs):
+    if engine not in BACKENDS:
+        raise ValueError(f"Engine không hỗ trợ: {engine} (chọn một trong {list(BACKENDS)})")
+    return BACKENDS[engine](model_path or DEFAULT_MODEL_PATHS[engine], **kwargs)
+
+
+def register_detector(engine='torch', model_path=None, imgsz=640, threads=None, precision='fp32'):
+    """
+    Đăng ký detector vào registry (load lười), trả về tên trong registry
+    """
+    model_path = model_path or DEFAULT_MODEL_PATHS[engine]
+    name = f'detector:{engine}:{model_path}:{precision}:{imgsz}:{threads}'
+    if not registry.is_registered(name):
+        registry.register(name,
+                          lambda: create_detector(engine, model_path, imgsz=imgsz,
+                                                  threads=threads, precision=precision),
+                          warmup=lambda detector: detector.warmup())
+    return name
+
+
+def get_detector(engine='torch', model_path=None, imgsz=640, threads=None, precision='fp32'):
+    """
+    Detector dùng chung: cùng engine + model + precision + imgsz + threads -> cùng một instance
+    """
+    return registry.get(register_detector(engine, model_path, imgsz, threads, precision))
+
+
+def letterbox(img, size):
+    """
+    Resize giữ tỉ lệ và pad về size x size (giống ultralytics), trả về (ảnh, tỉ lệ, (pad_x, pad_y))
+    """
+    h, w = img.shape[:2]
+    ratio = min(size / h, size / w)
+    new_h, new_w = round(h * ratio), round(w * ratio)
+    if (new_h, new_w) != (h, w):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, left = (size - new_h) // 2, (size - new_w) // 2
+    out = np.full((size, size, 3), 114, np.uint8)
+    out[top:top + new_h, left:left + new_w] = img
+    return out, ratio, (left, top)
+
+
+def to_blob(images, dtype=np.float32):
+    """
+    List ảnh BGR -> tensor NCHW RGB chuẩn hóa 0..1
+    """
+    batch = np.stack(images)[..., ::-1].transpose(0, 3, 1, 2)
+    blob = np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+    return blob.astype(dtype, copy=False)
+
+
+def decode_yolov8(pred, conf, iou, ratio, pad, orig_shape, names, max_det=300):
+    """
+    Output YOLOv8 (4 + nc, N) của một ảnh -> Detections theo toạ độ ảnh gốc
+    """
+    pred = pred.T
+    class_scores = pred[:, 4:]
+    cls = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(cls)), cls]
+    keep = scores > conf
+    if not keep.any():
+        return Detections(names=names)
+    boxes, scores, cls = pred[keep, :4], scores[keep], cls[keep]
+
+    xyxy = np.empty_like(boxes)
+    xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:4] / 2
+    xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:4] / 2
+
+    # NMS theo từng class: dời box mỗi class ra xa nhau rồi chạy NMS một lần
+    offset = cls[:, None].astype(np.float32) * 7680
+    shifted = xyxy + offset
+    xywh = np.concatenate([shifted[:, :2], shifted[:, 2:] - shifted[:, :2]], axis=1)
+    index = np.asarray(cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), conf, iou)).reshape(-1)
+    index = index[:max_det]
+    xyxy, scores, cls = xyxy[index], scores[index], cls[index]
+
+    # Bỏ phần pad của letterbox, đưa về kích thước ảnh gốc
+    xyxy -= (pad[0], pad[1], pad[0], pad[1])
+    xyxy /= ratio
+    h, w = orig_shape
+    xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+    xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+    return Detections(xyxy, scores, cls, names)
+
+
+def _cuda_available():
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
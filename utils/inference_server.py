@@ -0,0 +1,102 @@
+import threading
+
+from utils.metrics import STAGE_SECONDS
+from utils.micro_batcher import MicroBatcher
+
+# Priority nhỏ được phục vụ trước
+PRIORITY_LIVE = 0
+PRIORITY_OFFLINE = 1
+
+
+class InferenceServer:
+    """
+    Một worker duy nhất trước mỗi detector: frame từ mọi route / nguồn live / camera được gom
+    thành batch động (theo conf + iou), live được chạy trước upload, batch chứa frame live
+    bị giới hạn theo latency_budget (batch upload cũng vậy khi có nguồn live đang chạy).
+    Kết quả trả về qua Future.
+    """
+
+    def __init__(self, detector, max_batch=16, max_wait=None, latency_budget=None,
+                 max_delay=1.0, live_window=1.0, name=None):
+        self.detector = detector
+        if max_wait is None:
+            # Live chờ rất ngắn để gom, upload chờ lâu hơn để batch đầy
+            max_wait = {PRIORITY_LIVE: 0.002, PRIORITY_OFFLINE: 0.03}
+        self.batcher = MicroBatcher(self._run_batch, max_batch=max_batch, max_wait=max_wait,
+                                    name=name or f'detector:{detector.engine}',
+                                    latency_budget=latency_budget,
+                                    max_delay=max_delay, live_window=live_window)
+
+    def _run_batch(self, frames, key):
+        conf, iou = key
+        with STAGE_SECONDS.time(pipeline='server', stage='infer'):
+            return self.detector.predict(frames, conf=conf, iou=iou)
+
+    def submit(self, frames, conf=None, iou=None, priority=PRIORITY_OFFLINE):
+        """
+        Future -> list Detections theo thứ tự frames
+        """
+        conf = self.detector.conf if conf is None else conf
+        iou = self.detector.iou if iou is None else iou
+        return self.batcher.submit(frames, priority=priority, key=(conf, iou))
+
+    def stats(self):
+        return {'batches': self.batcher.batches, 'pending': self.batcher.pending_count(),
+                'seconds_per_frame': self.batcher.seconds_per_item}
+
+    def stop(self):
+        self.batcher.stop()
+
+
+class ServedDetector:
+    """
+    Detector đi qua InferenceServer với một priority cố định. Cùng giao diện
+    predict(frames, conf, iou) / names / warmup với DetectorBackend nên dùng thay thế được
+    (VideoPipeline, TiledDetector, LiveDetector, CameraManager)
+    """
+
+    def __init__(self, server, priority=PRIORITY_OFFLINE):
+        self.server = server
+        self.priority = priority
+
+    @property
+    def names(self):
+        return self.server.detector.names
+
+    @property
+    def last_timings(self):
+        return self.server.detector.last_timings
+
+    def warmup(self):
+        self.server.detector.warmup()
+
+    def predict(self, frames, conf=None, iou=None):
+        return self.server.submit(list(frames), conf, iou, self.priority).result()
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def serve(detector, **options):
+    """
+    InferenceServer dùng chung cho một instance detector (tạo khi gọi lần đầu).
+    Gọi lại với options khác lần đầu -> ValueError (server đã tạo không đổi cấu hình được)
+    """
+    with _servers_lock:
+        entry = _servers.get(id(detector))
+        if entry is None or entry[0].detector is not detector:
+            entry = (InferenceServer(detector, **options), options)
+            _servers[id(detector)] = entry
+        server, created_with = entry
+        if options != created_with:
+            raise ValueError(f"{server.batcher.name}: server đã được tạo với {created_with}, "
+                             f"không dùng được với {options}")
+        return server
+
+
+def server_stats():
+    with _servers_lock:
+        servers = [server for server, _ in _servers.values()]
+    return [dict(server.stats(), engine=server.detector.engine,
+                 model=server.detector.model_path) for server in servers]
@@ -0,0 +1,129 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Hàng đợi job đã đầy"""
+
+
+class Job:
+    """
+    Một tác vụ xử lý file chạy nền
+    status: 'queued' -> 'running' -> 'done' | 'error'
+    """
+
+    def __init__(self, kind, meta=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = 'queued'
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def set_progress(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'error')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': {'done': self.done, 'total': self.total},
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Hàng đợi job trong tiến trình với số worker giới hạn.
+    submit() trả về ngay, job chạy nền; request HTTP không bị giữ lại.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, max_history=200):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='job-worker')
+        self._jobs = OrderedDict()
+        self._lock = threading.RLock()
+
+    def submit(self, kind, func, *args, meta=None, **kwargs):
+        """
+        Đưa job vào hàng đợi. func(job, *args, **kwargs) trả về kết quả (dict)
+        """
+        job = Job(kind, meta)
+        with self._lock:
+            if self.pending_count() >= self.max_pending:
+                raise QueueFullError("Hàng đợi xử lý đang đầy, vui lòng thử lại sau")
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def add_finished(self, kind, result, meta=None):
+        """
+        Ghi nhận một job đã có kết quả sẵn (vd: lấy từ cache), không cần chạy
+        """
+        job = Job(kind, meta)
+        job.result = result
+        job.status = 'done'
+        job.set_progress(1, 1)
+        job.started_at = job.finished_at = time.time()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pending_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == 'queued')
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == 'running')
+
+    def _run(self, job, func, args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.status = 'done'
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = 'error'
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        # Chỉ giữ lại max_history job gần nhất đã chạy xong
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
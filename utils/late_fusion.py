@@ -1,3 +1,9 @@
+import threading
+from collections import deque, namedtuple
+
+import numpy as np
+
+
 def late_fusion_visual_audio(visual_probs, audio_probs, alpha=0.5):
     final_probs = {}
     for cls in visual_probs:
@@ -7,3 +13,187 @@ def late_fusion_visual_audio(visual_probs, audio_probs, alpha=0.5):
 
     final_class = max(final_probs, key=final_probs.get)
     return final_class, final_probs
+
+
+def late_fusion_arrays(visual_probs, audio_probs, alpha=0.5):
+    """
+    Bản vector hóa của late_fusion_visual_audio cho mảng (N, C).
+    Trả về (chỉ số class tốt nhất (N,), xác suất đã fuse (N, C))
+    """
+    fused = (alpha * np.asarray(visual_probs, np.float32)
+             + (1 - alpha) * np.asarray(audio_probs, np.float32))
+    return fused.argmax(axis=-1), fused
+
+
+def class_index_map(names, class_labels):
+    """
+    Mảng ánh xạ class id của YOLO -> chỉ số trong class_labels (so theo tên, -1 nếu không có)
+    """
+    labels = [label.lower() for label in class_labels]
+    if not names:
+        return np.arange(len(class_labels))
+    index = np.full(max(names) + 1, -1, np.int64)
+    for class_id, name in names.items():
+        if name.lower() in labels:
+            index[class_id] = labels.index(name.lower())
+    return index
+
+
+def visual_class_scores(detections, class_labels):
+    """
+    Điểm visual từng class của một frame = confidence cao nhất của class đó
+    """
+    scores = np.zeros(len(class_labels), np.float32)
+    if len(detections):
+        index = class_index_map(detections.names, class_labels)
+        cls = detections.cls
+        valid = cls < len(index)
+        ids = np.full(len(cls), -1, np.int64)
+        ids[valid] = index[cls[valid]]
+        valid = ids >= 0
+        np.maximum.at(scores, ids[valid], detections.conf[valid])
+    return scores
+
+
+# Kết quả fuse của một nhóm frame
+FusedFrames = namedtuple('FusedFrames', ['ids', 'scores', 'fused', 'audio', 'has_audio'])
+
+
+class FusionStream:
+    """
+    Late fusion theo thời gian thực giữa timeline audio (các cửa sổ start/end/probs)
+    và điểm visual của từng frame. Audio được thêm dần (add_audio), frame được fuse
+    dần (fuse) nên không cần giữ cả clip; cửa sổ audio đã qua được bỏ đi.
+    Frame không có audio tương ứng thì chỉ dùng visual.
+    max_segments: số đoạn đã kết thúc giữ lại chờ pop_segments (None: không giới hạn),
+    luồng live không lấy segment nên chỉ giữ vài đoạn gần nhất
+    """
+
+    def __init__(self, class_labels, alpha=0.5, hold=2.0, min_score=0.0, max_segments=None):
+        self.class_labels = class_labels
+        self.alpha = alpha
+        # Dùng lại cửa sổ audio gần nhất trong khoảng hold giây nếu không có cửa sổ nào phủ frame
+        self.hold = hold
+        self.min_score = min_score
+        num_classes = len(class_labels)
+        self._starts = np.zeros(0)
+        self._ends = np.zeros(0)
+        self._probs = np.zeros((0, num_classes), np.float32)
+        self._audio_until = 0.0
+        self._audio_done = False
+        self._cond = threading.Condition()
+        self._segment = None
+        self._segments = deque(maxlen=max_segments)
+
+    def add_audio(self, entries):
+        """
+        Thêm các cửa sổ audio (dạng timeline của StreamingAudioClassifier)
+        """
+        if not entries:
+            return
+        with self._cond:
+            self._starts = np.concatenate([self._starts, [e['start'] for e in entries]])
+            self._ends = np.concatenate([self._ends, [e['end'] for e in entries]])
+            self._probs = np.concatenate([self._probs,
+                                          np.asarray([e['probs'] for e in entries], np.float32)])
+            self._audio_until = max(self._audio_until, float(self._ends.max()))
+            self._cond.notify_all()
+
+    def finish_audio(self):
+        with self._cond:
+            self._audio_done = True
+            self._cond.notify_all()
+
+    def fuse(self, timestamps, visual_scores, wait=False, timeout=None):
+        """
+        timestamps (N,) giây, visual_scores (N, C) -> FusedFrames
+        wait=True: chờ audio xử lý tới thời điểm của frame (dùng cho video file)
+        """
+        times = np.asarray(timestamps, np.float64).reshape(-1)
+        visual = np.asarray(visual_scores, np.float32).reshape(len(times), -1)
+
+        with self._cond:
+            if wait and len(times):
+                self._cond.wait_for(lambda: self._audio_done or self._audio_until >= times.max(),
+                                    timeout=timeout)
+            # Bỏ các cửa sổ audio đã cũ
+            if len(self._ends) and len(times):
+                keep = self._ends >= times.min() - self.hold
+                self._starts, self._ends, self._probs = (self._starts[keep], self._ends[keep],
+                                                         self._probs[keep])
+            starts, ends, probs = self._starts, self._ends, self._probs
+
+        audio, has_audio = self._lookup(times, starts, ends, probs)
+        _, mixed = late_fusion_arrays(visual, audio, self.alpha)
+        fused = np.where(has_audio[:, None], mixed, visual)
+        ids = fused.argmax(axis=1)
+        scores = fused[np.arange(len(ids)), ids]
+        ids[scores <= self.min_score] = -1
+
+        self._update_segments(times, ids, scores)
+        return FusedFrames(ids, scores, fused, audio, has_audio)
+
+    def _lookup(self, times, starts, ends, probs):
+        num_classes = len(self.class_labels)
+        audio = np.zeros((len(times), num_classes), np.float32)
+        if len(starts) == 0 or len(times) == 0:
+            return audio, np.zeros(len(times), bool)
+
+        # Trung bình các cửa sổ audio phủ thời điểm của frame
+        cover = (starts[None, :] <= times[:, None]) & (times[:, None] < ends[None, :])
+        count = cover.sum(axis=1)
+        audio = cover.astype(np.float32) @ probs / np.maximum(count, 1)[:, None]
+
+        # Không có cửa sổ nào phủ -> giữ cửa sổ vừa kết thúc gần nhất (trong hold giây)
+        missing = count == 0
+        if missing.any():
+            recent = (ends[None, :] <= times[:, None]) & (ends[None, :] >= times[:, None] - self.hold)
+            last = np.where(recent, ends[None, :], -np.inf).argmax(axis=1)
+            rows = missing & recent.any(axis=1)
+            audio[rows] = probs[last[rows]]
+            count[rows] = 1
+        return audio, count > 0
+
+    def _update_segments(self, times, ids, scores):
+        """
+        Gộp các frame liên tiếp cùng nhãn thành đoạn (segment)
+        """
+        if len(ids) == 0:
+            return
+        boundaries = np.flatnonzero(np.diff(ids)) + 1
+        for chunk in np.split(np.arange(len(ids)), boundaries):
+            class_id = int(ids[chunk[0]])
+            if self._segment is not None and self._segment['class_id'] != class_id:
+                self._close_segment()
+            if self._segment is None:
+                self._segment = {'class_id': class_id, 'start': float(times[chunk[0]]),
+                                 'end': float(times[chunk[-1]]), 'frames': 0, 'score_sum': 0.0}
+            self._segment['end'] = float(times[chunk[-1]])
+            self._segment['frames'] += len(chunk)
+            self._segment['score_sum'] += float(scores[chunk].sum())
+
+    def _close_segment(self):
+        seg = self._segment
+        self._segment = None
+        if seg['class_id'] < 0:
+            return
+        self._segments.append({
+            'label': self.class_labels[seg['class_id']],
+            'start': seg['start'],
+            'end': seg['end'],
+            'frames': seg['frames'],
+            'confidence': seg['score_sum'] / seg['frames'],
+        })
+
+    def pop_segments(self, final=False):
+        """
+        Lấy các đoạn đã kết thúc (final=True: đóng luôn đoạn đang mở)
+        """
+        if final and self._segment is not None:
+            self._close_segment()
+        segments = list(self._segments)
+        self._segments.clear()
+        return segments
+
+    def label(self, class_id):
+        return self.class_labels[class_id] if class_id >= 0 else ""
@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils.detections import Detections
+from utils.metrics import STAGE_SECONDS
+
+
+class LatestFrameReader:
+    """
+    Thread đọc camera liên tục và chỉ giữ frame MỚI NHẤT.
+    Khi xử lý chậm hơn tốc độ camera, frame cũ bị bỏ thay vì dồn lại
+    trong bộ đệm của OpenCV (nguyên nhân làm hình live bị trễ vài giây).
+    """
+
+    def __init__(self, source, realtime=None, on_frame=None):
+        # on_frame(): gọi mỗi khi có frame mới (vd: báo cho worker dùng chung nhiều camera)
+        self.on_frame = on_frame
+        self.source = source
+        self.cap = cv2.VideoCapture(source)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # File video: đọc theo đúng FPS của file để giả lập camera
+        if realtime is None:
+            realtime = isinstance(source, str) and os.path.isfile(source)
+        self.realtime = realtime
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._captured_at = 0.0
+        self._index = -1
+        self._last_read = -1
+        self._stopped = False
+        self.finished = False
+        self.dropped = 0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        next_time = time.monotonic()
+        try:
+            while not self._stopped:
+                success, frame = self.cap.read()
+                if not success:
+                    break
+                with self._cond:
+                    # Frame trước chưa được lấy -> bị bỏ
+                    if self._index > self._last_read:
+                        self.dropped += 1
+                    self._frame = frame
+                    self._captured_at = time.monotonic()
+                    self._index += 1
+                    self._cond.notify_all()
+                if self.on_frame is not None:
+                    self.on_frame()
+
+                if self.realtime:
+                    next_time += 1.0 / self.fps
+                    delay = next_time - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            self.cap.release()
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+            if self.on_frame is not None:
+                self.on_frame()
+
+    def read(self, timeout=1.0):
+        """
+        Trả về (frame, captured_at, index) của frame mới nhất chưa đọc,
+        hoặc None nếu hết nguồn / quá thời gian chờ
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._index > self._last_read or self.finished,
+                                timeout=timeout)
+            if self._index <= self._last_read:
+                return None
+            self._last_read = self._index
+            return self._frame, self._captured_at, self._index
+
+    def release(self):
+        self._stopped = True
+
+
+class OpticalFlowCarrier:
+    """
+    Tracker rẻ: dời các box của lần detect gần nhất theo optical flow
+    (Lucas-Kanade) trên ảnh xám thu nhỏ, dùng giữa hai lần chạy YOLO.
+    """
+
+    def __init__(self, scale=0.5, max_corners=10):
+        self.scale = scale
+        self.max_corners = max_corners
+        self.prev_gray = None
+        self.detections = Detections()
+
+    def to_gray(self, frame):
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale,
+                           interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def reset(self, gray, detections):
+        self.prev_gray = gray
+        self.detections = detections
+
+    def update(self, gray):
+        dets = self.detections
+        if self.prev_gray is None or len(dets) == 0:
+            self.prev_gray = gray
+            return dets
+
+        # Lấy điểm đặc trưng trong từng box, gộp lại để chạy LK một lần
+        h, w = gray.shape[:2]
+        points, owners = [], []
+        for i, box in enumerate(dets.xyxy * self.scale):
+            x1, y1 = max(int(box[0]), 0), max(int(box[1]), 0)
+            x2, y2 = min(int(box[2]), w), min(int(box[3]), h)
+            if x2 - x1 < 3 or y2 - y1 < 3:
+                continue
+            corners = cv2.goodFeaturesToTrack(self.prev_gray[y1:y2, x1:x2],
+                                              maxCorners=self.max_corners,
+                                              qualityLevel=0.01, minDistance=2)
+            if corners is None:
+                continue
+            corners = corners.reshape(-1, 2) + (x1, y1)
+            points.append(corners)
+            owners.append(np.full(len(corners), i))
+
+        xyxy = dets.xyxy.copy()
+        if points:
+            points = np.concatenate(points).astype(np.float32)
+            owners = np.concatenate(owners)
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray,
+                                                        points.reshape(-1, 1, 2), None)
+            ok = status.reshape(-1) == 1
+            shift = (moved.reshape(-1, 2) - points) / self.scale
+            for i in np.unique(owners[ok]):
+                dx, dy = np.median(shift[ok & (owners == i)], axis=0)
+                xyxy[i] += (dx, dy, dx, dy)
+
+        self.detections = Detections(xyxy, dets.conf, dets.cls, dets.names, dets.track_ids)
+        self.prev_gray = gray
+        return self.detections
+
+
+class LiveDetector:
+    """
+    Chế độ live giới hạn độ trễ:
+    - frame đã cũ hơn max_latency (giây) thì bỏ
+    - chỉ chạy YOLO mỗi detect_every frame, ở giữa dùng optical flow dời box
+    - nếu chạy YOLO sẽ vượt quá max_latency thì dùng tracker cho frame này
+    - dù vượt ngân sách, quá force_every frame hoặc force_interval giây chưa chạy YOLO
+      thì vẫn chạy (box optical flow không bị giữ mãi)
+    - có gate (MotionGate): cảnh đứng yên thì không chạy YOLO, giữ box cũ
+    """
+
+    def __init__(self, detect, detect_every=1, max_latency=0.5, flow_scale=0.5, gate=None,
+                 force_every=30, force_interval=1.0, budget_decay=0.95):
+        # detect(frame) -> Detections
+        self.detect = detect
+        self.gate = gate
+        self.detect_every = max(1, int(detect_every))
+        self.max_latency = max_latency
+        self.force_every = force_every
+        self.force_interval = force_interval
+        # Mỗi frame bỏ qua vì vượt ngân sách, thời gian YOLO ước lượng giảm theo hệ số này
+        # để lần đo sau (nhanh hơn, vd: hàng đợi upload đã hết) có cơ hội được chạy
+        self.budget_decay = budget_decay
+        self.carrier = OpticalFlowCarrier(scale=flow_scale)
+        self.frame_index = 0
+        self.dropped = 0
+        self.detect_time = 0.0
+        # True nếu lần process gần nhất thật sự chạy detector (False: box dời bằng optical flow)
+        self.detected = False
+        self.forced = 0
+        self._last_detect_index = None
+        self._last_detect_at = None
+
+    def _detect_overdue(self, now):
+        if self._last_detect_index is None:
+            return True
+        if self.force_every and self.frame_index - self._last_detect_index >= self.force_every:
+            return True
+        return bool(self.force_interval) and now - self._last_detect_at >= self.force_interval
+
+    def process(self, frame, captured_at):
+        """
+        Trả về Detections cho frame, hoặc None nếu frame đã quá cũ và bị bỏ
+        """
+        now = time.monotonic()
+        age = now - captured_at
+        if self.max_latency and age > self.max_latency:
+            self.dropped += 1
+            return None
+
+        gray = self.carrier.to_gray(frame)
+        has_track = self.carrier.prev_gray is not None
+        due = self.frame_index % self.detect_every == 0
+        over_budget = self.max_latency and age + self.detect_time > self.max_latency
+        overdue = has_track and over_budget and self._detect_overdue(now)
+        if overdue:
+            over_budget = False
+            due = True
+            self.forced += 1
+
+        if due and has_track and not over_budget and not overdue and self.gate is not None:
+            # Không có chuyển động -> bỏ qua lần detect này
+            due = self.gate.should_detect(frame, captured_at)
+
+        if not has_track or (due and not over_budget):
+            start = time.monotonic()
+            detections = self.detect(frame)
+            # Trung bình trượt thời gian chạy YOLO để ước lượng độ trễ
+            elapsed = time.monotonic() - start
+            self.detect_time = elapsed if self.detect_time == 0 else 0.8 * self.detect_time + 0.2 * elapsed
+            STAGE_SECONDS.observe(elapsed, pipeline='live', stage='infer')
+            self.carrier.reset(gray, detections)
+            self._last_detect_index = self.frame_index
+            self._last_detect_at = start
+            self.detected = True
+        else:
+            self.detected = False
+            if due and over_budget:
+                self.detect_time *= self.budget_decay
+            with STAGE_SECONDS.time(pipeline='live', stage='track'):
+                detections = self.carrier.update(gray)
+
+        self.frame_index += 1
+        return detections
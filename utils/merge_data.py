@@ -1,23 +1,39 @@
+import argparse
+import hashlib
+import json
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from tqdm import tqdm
 import yaml
 
-# --- PHẦN 1: CẤU HÌNH ĐƯỜNG DẪN (BẠN SỬA Ở ĐÂY) ---
+try:
+    import fcntl
+except ImportError:  # Windows: không có reflink, dùng copy
+    fcntl = None
 
-# Đường dẫn đến folder gốc của bạn
-PATH_FOLDER_A = r"D:\data_train_drone\airplane_bird_helicopter" 
-PATH_FOLDER_B = r"D:\data_train_drone\drone" 
+# --- PHẦN 1: CẤU HÌNH ---
+# Đường dẫn không còn viết cứng trong code: đọc từ file YAML (--config), ví dụ:
+#
+#   output_dir: /data/data_train_drone/dataset_after_handle
+#   subsets: [train, test, valid]
+#   names: [Airplane, Bird, Drone, Helicopter]
+#   sources:
+#     Folder_A:
+#       path: /data/data_train_drone/airplane_bird_helicopter
+#       map: {0: 0, 1: 1, 2: 1, 3: 3}
+#     Folder_B:
+#       path: /data/data_train_drone/drone
+#       map: {0: 2}
+#
+# Có thể ghi đè nhanh bằng tham số: --source Folder_A=/path --output /path
 
-# Đường dẫn nơi bạn muốn lưu dataset mới đã gộp
-OUTPUT_DIR = r"D:\data_train_drone\dataset_after_handle"
-
-# --- PHẦN 2: ĐỊNH NGHĨA MAPPING (ĐÃ CẬP NHẬT THEO YÊU CẦU CỦA BẠN) ---
+# --- PHẦN 2: ĐỊNH NGHĨA MAPPING MẶC ĐỊNH ---
 # Target IDs MỚI: 0: Airplane, 1: Bird, 2: Drone, 3: Helicopter
 
 MAPPING_CONFIG = {
     'Folder_A': {
-        'path': PATH_FOLDER_A,
+        'path': None,
         # Map: ID cũ -> ID mới
         'map': {
             0: 0,  # Airplane -> Airplane (0)
@@ -27,7 +43,7 @@ MAPPING_CONFIG = {
         }
     },
     'Folder_B': {
-        'path': PATH_FOLDER_B,
+        'path': None,
         'map': {
             0: 2   # drones -> Drone (2)
         }
@@ -36,116 +52,354 @@ MAPPING_CONFIG = {
 
 # Các tập con cần xử lý (Lưu ý: Folder của bạn tên là 'valid')
 SUBSETS = ['train', 'test', 'valid']
+CLASS_NAMES = ['Airplane', 'Bird', 'Drone', 'Helicopter']
+
+# Thứ tự ưu tiên đuôi ảnh khi cùng tên (giống thứ tự tìm trước đây)
+IMAGE_EXTS = ['.jpg', '.jpeg', '.png', '.bmp', '.tiif', '.webp']
+
+MANIFEST_NAME = '.merge_manifest.json'
+
+# ioctl FICLONE của Linux (reflink trên btrfs / xfs)
+FICLONE = 0x40049409
 
 # ---------------------------------------------------------
 
-def create_dir_structure(base_path):
+
+def load_config(path=None, sources=None, output_dir=None):
+    """
+    Đọc cấu hình từ YAML (nếu có) rồi ghi đè bằng tham số dòng lệnh
+    """
+    config = {'output_dir': None, 'subsets': SUBSETS, 'names': CLASS_NAMES,
+              'sources': {name: dict(cfg) for name, cfg in MAPPING_CONFIG.items()}}
+    if path:
+        with open(path, 'r') as f:
+            loaded = yaml.safe_load(f) or {}
+        for key in ('output_dir', 'subsets', 'names'):
+            if key in loaded:
+                config[key] = loaded[key]
+        if 'sources' in loaded:
+            config['sources'] = loaded['sources']
+    for item in sources or []:
+        name, _, src_path = item.partition('=')
+        config['sources'].setdefault(name, {'map': {}})['path'] = src_path
+    if output_dir:
+        config['output_dir'] = output_dir
+
+    if not config['output_dir']:
+        raise ValueError("Chưa cấu hình output_dir (--output hoặc output_dir trong file config)")
+    for name, cfg in config['sources'].items():
+        if not cfg.get('path'):
+            raise ValueError(f"Chưa cấu hình đường dẫn cho nguồn {name}")
+        cfg['map'] = {int(k): int(v) for k, v in cfg.get('map', {}).items()}
+    return config
+
+
+def target_subset(subset):
+    # Chuẩn hóa tên folder đích: YOLO dùng 'val' thay vì 'valid'
+    return 'val' if subset == 'valid' else subset
+
+
+def create_dir_structure(base_path, subsets=SUBSETS):
     """Tạo cấu trúc thư mục YOLO chuẩn tại đích."""
-    if not os.path.exists(base_path):
-        os.makedirs(base_path)
-    
-    for subset in SUBSETS:
-        # Chuẩn hóa tên folder đích: YOLO dùng 'val' thay vì 'valid'
-        target_subset = 'val' if subset == 'valid' else subset 
-        
-        os.makedirs(os.path.join(base_path, target_subset, 'images'), exist_ok=True)
-        os.makedirs(os.path.join(base_path, target_subset, 'labels'), exist_ok=True)
-
-def process_dataset():
-    create_dir_structure(OUTPUT_DIR)
-    
-    total_files_copied = 0
-    
-    for source_name, config in MAPPING_CONFIG.items():
-        src_root = config['path']
-        mapping = config['map']
-        
-        print(f"--- Đang xử lý: {source_name} ---")
-        
-        for subset in SUBSETS:
-            # Đường dẫn ảnh và label nguồn
+    os.makedirs(base_path, exist_ok=True)
+    for subset in subsets:
+        os.makedirs(os.path.join(base_path, target_subset(subset), 'images'), exist_ok=True)
+        os.makedirs(os.path.join(base_path, target_subset(subset), 'labels'), exist_ok=True)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def index_images(img_dir):
+    """
+    Quét thư mục ảnh MỘT lần: tên (không đuôi) -> tên file, theo thứ tự ưu tiên đuôi
+    (thay cho việc thử os.path.exists với từng đuôi của từng label)
+    """
+    index = {}
+    if not os.path.isdir(img_dir):
+        return index
+    rank = {ext: i for i, ext in enumerate(IMAGE_EXTS)}
+    with os.scandir(img_dir) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() not in rank or not entry.is_file():
+                continue
+            current = index.get(stem)
+            if current is None or rank[ext.lower()] < rank[os.path.splitext(current)[1].lower()]:
+                index[stem] = entry.name
+    return index
+
+
+def remap_label(src_lbl_path, mapping):
+    """
+    Đọc label YOLO, đổi class id theo mapping; bỏ các dòng có class không nằm trong mapping
+    """
+    new_lines = []
+    with open(src_lbl_path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            class_id = int(parts[0])
+            if class_id in mapping:
+                new_lines.append(f"{mapping[class_id]} {' '.join(parts[1:])}\n")
+    return new_lines
+
+
+def place_file(src, dst, mode='copy'):
+    """
+    Đưa ảnh sang thư mục đích: 'copy', 'hardlink' (không tốn thêm dung lượng, cùng ổ đĩa)
+    hoặc 'reflink' (copy-on-write trên btrfs / xfs); không được thì copy
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif mode == 'reflink' and fcntl is not None:
+        try:
+            with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+                fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+    shutil.copy2(src, dst)
+
+
+def process_item(task, mapping, mode):
+    """
+    Xử lý một cặp label + ảnh (chạy trong thread / process pool).
+    Trả về (key, bản ghi manifest)
+    """
+    key, src_lbl_path, src_img_path, dst_lbl_path, dst_img_path, signature = task
+    record = {'signature': signature, 'outputs': []}
+    if src_img_path is None:
+        return key, dict(record, status='missing_image')
+
+    new_lines = remap_label(src_lbl_path, mapping)
+    # CHỈ LƯU nếu file có chứa object hợp lệ
+    if not new_lines:
+        return key, dict(record, status='empty')
+
+    with open(dst_lbl_path, 'w') as f_out:
+        f_out.writelines(new_lines)
+    place_file(src_img_path, dst_img_path, mode)
+    return key, dict(record, status='copied', outputs=[dst_lbl_path, dst_img_path])
+
+
+def source_hash(source, mode):
+    # Mapping / cách copy của một nguồn đổi -> chỉ làm lại nguồn đó
+    return hashlib.sha1(json.dumps({'map': source['map'], 'mode': mode},
+                                   sort_keys=True).encode()).hexdigest()
+
+
+def load_manifest(output_dir):
+    """
+    (hash cấu hình từng nguồn / tập con, bản ghi từng label) của lần chạy trước
+    """
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}, {}
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}, {}
+    if 'sources' not in manifest:
+        print("Manifest định dạng cũ, xử lý lại toàn bộ")
+        return {}, {}
+    return manifest['sources'], manifest.get('items', {})
+
+
+def save_manifest(output_dir, source_hashes, items):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'sources': source_hashes, 'items': items}, f)
+    os.replace(tmp_path, path)
+
+
+def item_scope(key):
+    # 'Folder_A/train/x.txt' -> ('Folder_A', 'train')
+    source_name, subset, _ = key.split('/', 2)
+    return source_name, subset
+
+
+def scope_name(scope):
+    # ('Folder_A', 'train') -> 'Folder_A/train' (khóa hash cấu hình trong manifest)
+    return '/'.join(scope)
+
+
+def collect_tasks(config, manifest):
+    """
+    Liệt kê các cặp label + ảnh, chia thành việc cần làm và việc đã xong (không đổi từ lần trước).
+    Trả về thêm tập (nguồn, tập con) đã quét được trong lần chạy này
+    """
+    output_dir = config['output_dir']
+    tasks, unchanged, scanned = {}, {}, set()
+    for source_name, source in config['sources'].items():
+        src_root = source['path']
+        for subset in config['subsets']:
             src_img_dir = os.path.join(src_root, subset, 'images')
             src_lbl_dir = os.path.join(src_root, subset, 'labels')
-            
-            # Đường dẫn đích (chuyển valid -> val)
-            target_subset_name = 'val' if subset == 'valid' else subset
-            dst_img_dir = os.path.join(OUTPUT_DIR, target_subset_name, 'images')
-            dst_lbl_dir = os.path.join(OUTPUT_DIR, target_subset_name, 'labels')
-            
-            if not os.path.exists(src_lbl_dir):
+            if not os.path.isdir(src_lbl_dir):
                 print(f"Bỏ qua {subset} trong {source_name} (Không tìm thấy thư mục labels)")
                 continue
 
-            # Lấy danh sách file labels
-            label_files = [f for f in os.listdir(src_lbl_dir) if f.endswith('.txt')]
-            
-            for lbl_file in tqdm(label_files, desc=f"{source_name} - {subset}"):
-                src_lbl_path = os.path.join(src_lbl_dir, lbl_file)
-                
-                # Đọc và xử lý nội dung label
-                new_lines = []
-                with open(src_lbl_path, 'r') as f:
-                    lines = f.readlines()
-                    
-                for line in lines:
-                    parts = line.strip().split()
-                    if len(parts) < 5: continue
-                    
-                    class_id = int(parts[0])
-                    coords = parts[1:]
-                    
-                    # Kiểm tra và map ID
-                    if class_id in mapping:
-                        new_id = mapping[class_id]
-                        new_line = f"{new_id} {' '.join(coords)}\n"
-                        new_lines.append(new_line)
-                
-                # CHỈ LƯU nếu file có chứa object hợp lệ
-                if new_lines:
-                    # 1. Ghi file label mới (thêm tiền tố tên nguồn để tránh trùng)
-                    new_filename = f"{source_name}_{lbl_file}"
-                    dst_lbl_path = os.path.join(dst_lbl_dir, new_filename)
-                    
-                    with open(dst_lbl_path, 'w') as f_out:
-                        f_out.writelines(new_lines)
-                    
-                    # 2. Copy file ảnh tương ứng
-                    image_found = False
-                    base_name = os.path.splitext(lbl_file)[0]
-                    # Tìm ảnh với các đuôi phổ biến
-                    for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiif', '.webp']:
-                        src_img_name = base_name + ext
-                        src_img_path = os.path.join(src_img_dir, src_img_name)
-                        if os.path.exists(src_img_path):
-                            dst_img_name = f"{source_name}_{src_img_name}"
-                            shutil.copy2(src_img_path, os.path.join(dst_img_dir, dst_img_name))
-                            image_found = True
-                            break
-                    
-                    if image_found:
-                        total_files_copied += 1
-
-    print(f"\n✅ Hoàn tất! Đã gộp và xử lý {total_files_copied} ảnh.")
-    print(f"Dữ liệu mới nằm tại: {OUTPUT_DIR}")
+            scanned.add((source_name, subset))
+            images = index_images(src_img_dir)
+            dst_img_dir = os.path.join(output_dir, target_subset(subset), 'images')
+            dst_lbl_dir = os.path.join(output_dir, target_subset(subset), 'labels')
+            tasks.setdefault(source_name, [])
+
+            with os.scandir(src_lbl_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.txt'):
+                        continue
+                    key = f"{source_name}/{subset}/{entry.name}"
+                    img_name = images.get(os.path.splitext(entry.name)[0])
+                    src_img_path = os.path.join(src_img_dir, img_name) if img_name else None
+                    stat = entry.stat()
+                    signature = [[stat.st_size, stat.st_mtime_ns],
+                                 file_signature(src_img_path) if src_img_path else None]
+
+                    previous = manifest.get(key)
+                    if (previous is not None and previous['signature'] == signature
+                            and all(os.path.exists(p) for p in previous['outputs'])):
+                        unchanged[key] = previous
+                        continue
+
+                    # Thêm tiền tố tên nguồn để tránh trùng
+                    dst_lbl_path = os.path.join(dst_lbl_dir, f"{source_name}_{entry.name}")
+                    dst_img_path = (os.path.join(dst_img_dir, f"{source_name}_{img_name}")
+                                    if img_name else None)
+                    tasks[source_name].append((key, entry.path, src_img_path, dst_lbl_path,
+                                               dst_img_path, signature))
+    return tasks, unchanged, scanned
+
+
+def process_dataset(config, mode='copy', workers=None, executor='thread', prune=False,
+                    save_every=1000):
+    """
+    prune: xóa cả output của các nguồn / tập con không có trong lần chạy này
+    (mặc định giữ nguyên, chỉ xóa output của file nguồn đã bị xóa / đổi)
+    save_every: ghi manifest sau mỗi nguồn và mỗi save_every label, bị dừng giữa chừng thì
+    lần chạy sau chỉ làm tiếp phần còn lại
+    """
+    output_dir = config['output_dir']
+    create_dir_structure(output_dir, config['subsets'])
+
+    # Hash cấu hình theo từng (nguồn, tập con): tập con chưa quét lần này giữ hash cũ,
+    # nên khi được quét lại mà mapping đã đổi thì vẫn được làm lại
+    scope_hashes = {scope_name((name, subset)): source_hash(source, mode)
+                    for name, source in config['sources'].items()
+                    for subset in config['subsets']}
+    previous_hashes, manifest = load_manifest(output_dir)
+    changed_scopes = {scope for scope, value in scope_hashes.items()
+                      if previous_hashes.get(scope) != value}
+    for name in sorted({scope.split('/')[0] for scope in changed_scopes & set(previous_hashes)}):
+        print(f"Cấu hình mapping của {name} đã đổi, xử lý lại nguồn này")
+    usable = {key: record for key, record in manifest.items()
+              if scope_name(item_scope(key)) not in changed_scopes}
+    tasks, items, scanned = collect_tasks(config, usable)
+
+    # Output của các file nguồn đã bị xóa / đổi -> xóa theo.
+    # Nguồn / tập con không được quét lần này (không có trong config, thư mục chưa mount...)
+    # thì giữ nguyên cả output lẫn bản ghi tới lần quét sau, trừ khi prune
+    for key, previous in manifest.items():
+        if key in items:
+            continue
+        if item_scope(key) not in scanned and not prune:
+            items[key] = previous
+            continue
+        for path in previous.get('outputs', []):
+            if os.path.exists(path):
+                os.remove(path)
+    source_hashes = {scope: value for scope, value in scope_hashes.items()
+                     if tuple(scope.split('/', 1)) in scanned}
+    if not prune:
+        for scope, value in previous_hashes.items():
+            source_hashes.setdefault(scope, value)
+
+    total = sum(len(t) for t in tasks.values())
+    print(f"Cần xử lý {total} label, bỏ qua {len(items)} label không đổi")
+
+    pool_cls = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    workers = workers or min(32, (os.cpu_count() or 1) * (1 if executor == 'process' else 4))
+    with pool_cls(max_workers=workers) as pool, tqdm(total=total, desc="Gộp dataset") as bar:
+        futures = []
+        for source_name, source_tasks in tasks.items():
+            mapping = config['sources'][source_name]['map']
+            # chunksize lớn giảm chi phí gửi việc sang process
+            chunk = 256 if executor == 'process' else 1
+            futures.append(pool.map(process_item, source_tasks,
+                                    [mapping] * len(source_tasks), [mode] * len(source_tasks),
+                                    chunksize=chunk))
+        unsaved = 0
+        for results in futures:
+            for key, record in results:
+                items[key] = record
+                bar.update(1)
+                unsaved += 1
+                if unsaved >= save_every:
+                    save_manifest(output_dir, source_hashes, items)
+                    unsaved = 0
+            # Xong một nguồn
+            save_manifest(output_dir, source_hashes, items)
+            unsaved = 0
+
+    save_manifest(output_dir, source_hashes, items)
+
+    counts = {}
+    for record in items.values():
+        counts[record['status']] = counts.get(record['status'], 0) + 1
+    print(f"\n✅ Hoàn tất! Đã gộp và xử lý {counts.get('copied', 0)} ảnh.")
+    if counts.get('missing_image'):
+        print(f"⚠️  {counts['missing_image']} label không có ảnh tương ứng (đã bỏ qua)")
+    print(f"Dữ liệu mới nằm tại: {output_dir}")
 
     # Tạo file data.yaml mới
-    create_yaml_file()
+    create_yaml_file(output_dir, config['names'])
+
 
-def create_yaml_file():
+def create_yaml_file(output_dir, names=CLASS_NAMES):
     # Cấu trúc file data.yaml chuẩn YOLOv8
     yaml_content = {
-        'path': OUTPUT_DIR,  # Đường dẫn tuyệt đối tới dataset
+        'path': os.path.abspath(output_dir),  # Đường dẫn tuyệt đối tới dataset
         'train': 'train/images',
         'val': 'val/images',
         'test': 'test/images',
-        'nc': 4,
-        'names': ['Airplane', 'Bird', 'Drone', 'Helicopter'] # Đã cập nhật thứ tự tên
+        'nc': len(names),
+        'names': list(names)
     }
-    
-    yaml_path = os.path.join(OUTPUT_DIR, 'data.yaml')
+
+    yaml_path = os.path.join(output_dir, 'data.yaml')
     with open(yaml_path, 'w') as f:
         yaml.dump(yaml_content, f, default_flow_style=False)
-    print("✅ Đã tạo file data.yaml mới với class names: ['Airplane', 'Bird', 'Drone', 'Helicopter']")
+    print(f"✅ Đã tạo file data.yaml mới với class names: {list(names)}")
+
 
 if __name__ == "__main__":
-    process_dataset()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Gộp các dataset YOLO và đổi class id")
+    parser.add_argument('--config', help="File YAML cấu hình (output_dir, sources, subsets, names)")
+    parser.add_argument('--source', action='append', metavar='TÊN=ĐƯỜNG_DẪN',
+                        help="Đường dẫn của một nguồn (ghi đè config), vd: Folder_A=/data/a")
+    parser.add_argument('--output', help="Thư mục dataset sau khi gộp (ghi đè config)")
+    parser.add_argument('--mode', default='copy', choices=['copy', 'hardlink', 'reflink'],
+                        help="Cách đưa ảnh sang thư mục đích")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--executor', default='thread', choices=['thread', 'process'])
+    parser.add_argument('--prune', action='store_true',
+                        help="Xóa output của các nguồn / tập con không có trong lần chạy này")
+    args = parser.parse_args()
+
+    process_dataset(load_config(args.config, args.source, args.output),
+                    mode=args.mode, workers=args.workers, executor=args.executor,
+                    prune=args.prune)
@@ -0,0 +1,193 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from utils.metrics import metrics
+
+BATCH_ITEMS = metrics.histogram('micro_batch_size', 'Samples per micro-batch', ('name',),
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+BATCH_WAIT = metrics.histogram('micro_batch_wait_seconds',
+                               'Time from submit until the sample entered a batch',
+                               ('name', 'priority'),
+                               buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                                        0.5, 1.0))
+PENDING_ITEMS = metrics.gauge('micro_batch_pending', 'Samples waiting for a batch',
+                              ('name',))
+
+
+class _Request:
+    __slots__ = ('items', 'results', 'remaining', 'offset', 'future', 'submitted',
+                 'priority', 'key')
+
+    def __init__(self, items, priority, key):
+        self.items = items
+        self.results = [None] * len(items)
+        self.remaining = len(items)
+        # Mẫu tiếp theo chưa được đưa vào batch
+        self.offset = 0
+        self.future = Future()
+        self.submitted = time.monotonic()
+        self.priority = priority
+        self.key = key
+
+
+class MicroBatcher:
+    """
+    Gom mẫu từ nhiều request (nhiều thread) thành micro-batch cho một worker duy nhất:
+    batch được chạy khi đủ max_batch mẫu hoặc khi mẫu đầu tiên đã chờ max_wait giây.
+    submit(items) -> Future, kết quả là list kết quả theo đúng thứ tự items.
+    Request lớn hơn max_batch được tách ra nhiều batch.
+
+    Ưu tiên: priority nhỏ chạy trước (0: live); request chờ quá max_delay giây được coi
+    như priority 0 để không bị bỏ đói. Chỉ các request cùng key (vd: cùng conf / iou)
+    mới được gom chung một batch.
+    max_wait / latency_budget có thể là số hoặc dict {priority: giây}. latency_budget giới hạn
+    số mẫu của batch chứa request priority đó theo thời gian chạy ước lượng mỗi mẫu.
+    Khi đang có request priority 0 chờ, hoặc mới có trong live_window giây (nguồn live gửi
+    frame đều đặn), batch của priority thấp hơn cũng bị giới hạn như batch priority 0 để frame
+    live tới giữa chừng không phải chờ cả một batch upload đầy.
+    """
+
+    def __init__(self, run_batch, max_batch=64, max_wait=0.01, name='batch',
+                 latency_budget=None, max_delay=1.0, live_window=1.0):
+        # run_batch(list mẫu, key) -> list kết quả cùng thứ tự
+        self.run_batch = run_batch
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait
+        self.latency_budget = latency_budget
+        self.max_delay = max_delay
+        self.live_window = live_window
+        self.name = name
+        self.batches = 0
+        # Thời gian chạy ước lượng cho một mẫu (trung bình trượt), None khi chưa đo
+        self.seconds_per_item = None
+        # Lần gần nhất có request priority 0 (monotonic)
+        self._last_live = None
+        self._pending = []
+        self._cond = threading.Condition()
+        self._worker = None
+        self._running = True
+        PENDING_ITEMS.set_function(self.pending_count, name=name)
+
+    def submit(self, items, priority=0, key=None):
+        request = _Request(list(items), priority, key)
+        if not request.items:
+            request.future.set_result([])
+            return request.future
+        with self._cond:
+            if not self._running:
+                raise RuntimeError(f"{self.name}: batcher đã dừng")
+            self._pending.append(request)
+            if priority == 0:
+                self._last_live = request.submitted
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._cond.notify_all()
+        return request.future
+
+    def __call__(self, items, priority=0, key=None):
+        return self.submit(items, priority, key).result()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def pending_count(self):
+        with self._cond:
+            return sum(len(r.items) - r.offset for r in self._pending)
+
+    @staticmethod
+    def _per_priority(value, priority):
+        if isinstance(value, dict):
+            return value.get(priority, max(value.values()) if value else None)
+        return value
+
+    def _order(self, now):
+        # Thứ tự phục vụ: priority (request chờ quá lâu được nâng lên 0), rồi tới trước
+        def rank(request):
+            priority = request.priority
+            if self.max_delay is not None and now - request.submitted > self.max_delay:
+                priority = 0
+            return priority, request.submitted
+        return sorted(self._pending, key=rank)
+
+    def _limit(self, priority):
+        # Priority không có trong dict latency_budget thì không bị giới hạn
+        budget = (self.latency_budget.get(priority) if isinstance(self.latency_budget, dict)
+                  else self.latency_budget)
+        if budget is None or not self.seconds_per_item:
+            return self.max_batch
+        return max(1, min(self.max_batch, int(budget / self.seconds_per_item)))
+
+    def _live_active(self, now):
+        if any(r.priority == 0 for r in self._pending):
+            return True
+        return (self._last_live is not None and self.live_window is not None
+                and now - self._last_live < self.live_window)
+
+    def _next_batch(self):
+        """
+        Chờ có mẫu, rồi chờ thêm (tối đa max_wait của request được phục vụ trước)
+        để batch đầy hơn; request ưu tiên cao tới sau vẫn được xét lại sau mỗi lần thức dậy
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending or not self._running)
+            if not self._pending:
+                return None, None
+            while True:
+                now = time.monotonic()
+                ordered = self._order(now)
+                head = ordered[0]
+                limit = self._limit(head.priority)
+                if head.priority != 0 and self._live_active(now):
+                    limit = min(limit, self._limit(0))
+                same_key = [r for r in ordered if r.key == head.key]
+                available = sum(len(r.items) - r.offset for r in same_key)
+                wait = self._per_priority(self.max_wait, head.priority) or 0
+                remaining = head.submitted + wait - now
+                if not self._running or available >= limit or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            for request in same_key:
+                if len(batch) >= limit:
+                    break
+                take = min(limit - len(batch), len(request.items) - request.offset)
+                batch.extend((request, request.offset + i) for i in range(take))
+                if request.offset == 0:
+                    BATCH_WAIT.observe(now - request.submitted, name=self.name,
+                                       priority=request.priority)
+                request.offset += take
+                if request.offset >= len(request.items):
+                    self._pending.remove(request)
+            return batch, head.key
+
+    def _run(self):
+        while True:
+            batch, key = self._next_batch()
+            if batch is None:
+                return
+            BATCH_ITEMS.observe(len(batch), name=self.name)
+            self.batches += 1
+            started = time.perf_counter()
+            try:
+                results = self.run_batch([request.items[index] for request, index in batch], key)
+            except Exception as e:
+                for request, _ in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                # Phần còn lại của request lỗi không cần chạy nữa
+                with self._cond:
+                    self._pending = [r for r in self._pending if not r.future.done()]
+                continue
+            per_item = (time.perf_counter() - started) / len(batch)
+            self.seconds_per_item = (per_item if self.seconds_per_item is None
+                                     else 0.8 * self.seconds_per_item + 0.2 * per_item)
+            for (request, index), result in zip(batch, results):
+                request.results[index] = result
+                request.remaining -= 1
+                if request.remaining == 0 and not request.future.done():
+                    request.future.set_result(request.results)
@@ -0,0 +1,191 @@
+import threading
+
+import cv2
+
+from utils.metrics import STAGE_SECONDS
+
+MJPEG_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+
+
+def mjpeg_chunk(jpeg):
+    """
+    Đóng gói ảnh JPEG theo chuẩn multipart/x-mixed-replace (MJPEG).
+    jpeg: bytes hoặc mảng NumPy từ encoder, chỉ copy MỘT lần vào chunk kết quả
+    (không tobytes() + nối chuỗi nhiều lần)
+    """
+    data = memoryview(jpeg).cast('B')
+    return b''.join((MJPEG_HEADER, str(data.nbytes).encode(), b'\r\n\r\n', data, b'\r\n'))
+
+
+class JpegEncoder:
+    """
+    Encode JPEG cho luồng MJPEG: dùng libjpeg-turbo trực tiếp (PyTurboJPEG) nếu có,
+    không thì cv2.imencode. backend: 'auto', 'turbojpeg' hoặc 'opencv'
+    """
+
+    def __init__(self, quality=80, backend='auto', fast_dct=True):
+        self.quality = quality
+        self.fast_dct = fast_dct
+        self._turbo = None
+        if backend in ('auto', 'turbojpeg'):
+            try:
+                from turbojpeg import TurboJPEG
+                self._turbo = TurboJPEG()
+            except (ImportError, OSError, RuntimeError) as e:
+                if backend == 'turbojpeg':
+                    raise
+                print(f"Không dùng được libjpeg-turbo ({e}), encode bằng OpenCV")
+        self.backend = 'turbojpeg' if self._turbo is not None else 'opencv'
+
+    def encode(self, frame, quality=None):
+        """
+        Frame BGR -> JPEG (bytes hoặc mảng uint8, đều dùng được với mjpeg_chunk)
+        """
+        quality = int(quality or self.quality)
+        if self._turbo is not None:
+            from turbojpeg import TJPF_BGR, TJSAMP_420, TJFLAG_FASTDCT
+            return self._turbo.encode(frame, quality=quality, pixel_format=TJPF_BGR,
+                                      jpeg_subsample=TJSAMP_420,
+                                      flags=TJFLAG_FASTDCT if self.fast_dct else 0)
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError("Không encode được JPEG")
+        return buffer
+
+
+_default_encoder = None
+_default_lock = threading.Lock()
+
+
+def get_encoder(quality=80, backend='auto'):
+    """
+    Encoder dùng chung trong process (chỉ dò libjpeg-turbo một lần)
+    """
+    global _default_encoder
+    with _default_lock:
+        if _default_encoder is None:
+            _default_encoder = JpegEncoder(quality, backend)
+        return _default_encoder
+
+
+class StreamProfile:
+    """
+    Chất lượng / độ phân giải gửi cho một client: width None = giữ nguyên kích thước frame
+    """
+
+    __slots__ = ('width', 'quality')
+
+    def __init__(self, width=None, quality=80):
+        self.width = int(width) if width else None
+        self.quality = int(quality)
+
+    @property
+    def key(self):
+        return self.width, self.quality
+
+
+class AdaptiveProfile:
+    """
+    Chọn profile cho một client theo tốc độ nhận của client đó: client bỏ lỡ nhiều frame
+    (mạng / trình duyệt chậm) thì giảm chất lượng / độ phân giải, theo kịp lâu thì tăng lại.
+    adaptive=False: luôn dùng profile đầu tiên của ladder
+    """
+
+    # Từ tốt nhất tới nhẹ nhất: (width, quality)
+    LADDER = ((None, 85), (None, 70), (1280, 70), (960, 60), (640, 50), (480, 40))
+
+    def __init__(self, max_width=None, quality=None, adaptive=True, ladder=LADDER,
+                 down_skip=0.5, up_skip=0.05, hold_frames=30):
+        levels = []
+        for width, level_quality in ladder:
+            if max_width and (width is None or width > max_width):
+                width = max_width
+            if quality:
+                level_quality = min(level_quality, quality)
+            if not levels or levels[-1].key != (width, level_quality):
+                levels.append(StreamProfile(width, level_quality))
+        self.levels = levels if adaptive else levels[:1]
+        self.level = 0
+        # Tỉ lệ frame bị bỏ lỡ (trung bình trượt) để giảm / tăng mức
+        self.down_skip = down_skip
+        self.up_skip = up_skip
+        self.hold_frames = hold_frames
+        self._skip_rate = 0.0
+        self._since_change = 0
+
+    @property
+    def current(self):
+        return self.levels[self.level]
+
+    def feedback(self, skipped):
+        """
+        skipped: số frame mới client đã bỏ lỡ trước frame vừa gửi
+        """
+        if len(self.levels) == 1:
+            return
+        self._skip_rate = 0.9 * self._skip_rate + 0.1 * (skipped / (skipped + 1))
+        self._since_change += 1
+        if self._since_change < self.hold_frames:
+            return
+        if self._skip_rate > self.down_skip and self.level < len(self.levels) - 1:
+            self._change(1)
+        elif self._skip_rate < self.up_skip and self.level > 0:
+            self._change(-1)
+
+    def _change(self, step):
+        self.level += step
+        self._since_change = 0
+        self._skip_rate = (self.down_skip + self.up_skip) / 2
+
+
+class MjpegOutput:
+    """
+    Encode frame mới nhất cho nhiều client: mỗi profile (width, quality) chỉ encode MỘT lần
+    mỗi frame dù nhiều client cùng xem; ảnh thu nhỏ được ghi vào buffer dùng lại
+    """
+
+    def __init__(self, encoder=None, pipeline='live'):
+        self.encoder = encoder or get_encoder()
+        self.pipeline = pipeline
+        self._lock = threading.Lock()
+        self._profile_locks = {}
+        self._chunks = {}       # profile key -> (seq, chunk)
+        self._buffers = {}      # profile key -> mảng đích của cv2.resize
+
+    def _profile_lock(self, key):
+        with self._lock:
+            lock = self._profile_locks.get(key)
+            if lock is None:
+                lock = self._profile_locks[key] = threading.Lock()
+            return lock
+
+    def chunk(self, seq, frame, profile):
+        key = profile.key
+        cached = self._chunks.get(key)
+        if cached is not None and cached[0] == seq:
+            return cached[1]
+        with self._profile_lock(key):
+            # Client khác cùng profile có thể vừa encode xong
+            cached = self._chunks.get(key)
+            if cached is not None and cached[0] == seq:
+                return cached[1]
+            with STAGE_SECONDS.time(pipeline=self.pipeline, stage='encode'):
+                chunk = mjpeg_chunk(self.encoder.encode(self._resize(frame, key),
+                                                        profile.quality))
+            self._chunks[key] = (seq, chunk)
+            return chunk
+
+    def _resize(self, frame, key):
+        width = key[0]
+        h, w = frame.shape[:2]
+        if not width or width >= w:
+            return frame
+        size = (width, max(1, int(round(h * width / w))))
+        buffer = self._buffers.get(key)
+        if buffer is None or buffer.shape[:2] != (size[1], size[0]):
+            buffer = None
+        # INTER_LINEAR: INTER_AREA chỉ nhanh khi thu nhỏ đúng 2 lần, tỉ lệ khác (1920 -> 1280,
+        # 1920 -> 640) còn chậm hơn cả encode JPEG ảnh gốc
+        buffer = cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_LINEAR)
+        self._buffers[key] = buffer
+        return buffer
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_YOLO_PATH = 'models/best.pt'
+
+
+def current_rss_mb():
+    """
+    Bộ nhớ (RSS) hiện tại của tiến trình, MB. None nếu không đo được
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class LockedModel:
+    """
+    Bọc model không an toàn khi gọi từ nhiều thread (vd: YOLO của ultralytics):
+    mỗi lần gọi đều giữ khóa. Các thuộc tính khác (names, ...) được chuyển thẳng vào model.
+    """
+
+    def __init__(self, model):
+        self._model = model
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            return self._model(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    @property
+    def unwrapped(self):
+        return self._model
+
+
+class ModelRegistry:
+    """
+    Nơi giữ model dùng chung cho cả app.py và VideoProcessor:
+    - model chỉ được load khi dùng lần đầu (lazy), mỗi model một instance
+    - có thể chạy warm-up để request đầu tiên không bị chậm
+    - ghi lại thời gian load / warm-up và bộ nhớ tăng thêm của từng model
+    """
+
+    def __init__(self):
+        self._specs = {}
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name, loader, warmup=None, thread_safe=True):
+        """
+        loader() -> model; warmup(model) chạy thử một lần;
+        thread_safe=False: model được bọc trong LockedModel
+        """
+        with self._lock:
+            self._specs[name] = (loader, warmup, thread_safe)
+            self._load_locks.setdefault(name, threading.Lock())
+
+    def is_registered(self, name):
+        return name in self._specs
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def get(self, name, warmup=False):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._specs:
+            raise KeyError(f"Model chưa được đăng ký: {name}")
+
+        # Khóa riêng từng model: hai request đồng thời không load trùng
+        with self._load_locks[name]:
+            if name in self._models:
+                return self._models[name]
+
+            loader, _, thread_safe = self._specs[name]
+            rss_before = current_rss_mb()
+            start = time.perf_counter()
+            model = loader()
+            load_seconds = time.perf_counter() - start
+            rss_after = current_rss_mb()
+
+            if not thread_safe:
+                model = LockedModel(model)
+            self._stats[name] = {
+                'loaded': True,
+                'load_seconds': round(load_seconds, 3),
+                'memory_mb': (round(rss_after - rss_before, 1)
+                              if rss_before is not None and rss_after is not None else None),
+                'warmup_seconds': None,
+            }
+            self._models[name] = model
+            print(f"Đã load model {name} trong {load_seconds:.2f}s")
+
+            if warmup:
+                self._warmup(name, model)
+        return model
+
+    def warmup(self, name):
+        self._warmup(name, self.get(name))
+
+    def _warmup(self, name, model):
+        warmup = self._specs[name][1]
+        if warmup is None:
+            return
+        start = time.perf_counter()
+        warmup(model)
+        self._stats[name]['warmup_seconds'] = round(time.perf_counter() - start, 3)
+
+    def preload(self, names=None, warmup=True, background=False):
+        """
+        Load (và warm-up) trước các model; background=True để không chặn lúc khởi động
+        """
+        names = list(self._specs) if names is None else list(names)
+
+        def load_all():
+            for name in names:
+                try:
+                    self.get(name, warmup=warmup)
+                except Exception as e:
+                    print(f"Không load được model {name}: {e}")
+
+        if background:
+            threading.Thread(target=load_all, daemon=True).start()
+        else:
+            load_all()
+
+    def stats(self):
+        return {name: dict(self._stats.get(name, {'loaded': False}))
+                for name in self._specs}
+
+    def register_yolo(self, path=DEFAULT_YOLO_PATH, imgsz=640):
+        """
+        Đăng ký model YOLO theo đường dẫn (chưa load), trả về tên trong registry
+        """
+        name = f'yolo:{path}'
+        if not self.is_registered(name):
+            self.register(name, lambda: load_yolo(path),
+                          warmup=lambda model: warmup_yolo(model, imgsz),
+                          thread_safe=False)
+        return name
+
+    def yolo(self, path=DEFAULT_YOLO_PATH, imgsz=640):
+        """
+        Model YOLO theo đường dẫn: cùng đường dẫn -> dùng chung một instance
+        """
+        return self.get(self.register_yolo(path, imgsz))
+
+
+def load_yolo(path):
+    # Import ở đây để tiến trình chỉ cần ảnh/audio không phải load Torch
+    from ultralytics import YOLO
+    return YOLO(path)
+
+
+def warmup_yolo(model, imgsz=640):
+    model(np.zeros((imgsz, imgsz, 3), np.uint8), imgsz=imgsz, verbose=False)
+
+
+def load_keras(path):
+    # Import ở đây để tiến trình không dùng audio không phải load TensorFlow
+    from tensorflow import keras
+    return keras.models.load_model(path)
+
+
+def warmup_keras(model):
+    model.predict(np.zeros((1,) + tuple(model.input_shape[1:]), np.float32), verbose=0)
+
+
+# Registry mặc định dùng chung trong cả tiến trình
+registry = ModelRegistry()
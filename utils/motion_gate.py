@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+
+from utils.metrics import metrics
+
+GATE_FRAMES = metrics.counter('motion_gate_frames_total',
+                              'Frames checked by the motion gate', ('pipeline', 'result'))
+
+
+class MotionGate:
+    """
+    Bộ lọc rẻ trước YOLO: so frame (xám, thu nhỏ) với nền (trung bình trượt) và chỉ
+    cho chạy detector khi phần ảnh thay đổi vượt ngưỡng, hoặc khi đã quá keep_alive giây
+    kể từ lần detect trước (để box của vật đứng yên vẫn được cập nhật).
+    method='diff': trừ nền trung bình trượt; 'mog2': BackgroundSubtractorMOG2 của OpenCV
+    """
+
+    def __init__(self, threshold=0.002, pixel_threshold=25, keep_alive=2.0, width=160,
+                 learning_rate=0.05, method='diff', name='video'):
+        # threshold: tỉ lệ pixel thay đổi tối thiểu để coi là có chuyển động
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.keep_alive = keep_alive
+        self.width = width
+        self.learning_rate = learning_rate
+        self.method = method
+        # Tên pipeline để đếm trong /metrics
+        self.name = name
+        self.checked = 0
+        self.skipped = 0
+        self.last_motion = 0.0
+        self._background = None
+        self._subtractor = None
+        self._last_detect = None
+
+    def reset(self):
+        self._background = None
+        self._subtractor = None
+        self._last_detect = None
+
+    def _prepare(self, frame):
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.width / w)
+        small = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        # Làm mờ để nhiễu cảm biến / nén không bị tính là chuyển động
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def motion(self, frame):
+        """
+        Tỉ lệ pixel thay đổi so với nền (0..1); frame đầu tiên trả về 1.0
+        """
+        gray = self._prepare(frame)
+        if self.method == 'mog2':
+            if self._subtractor is None:
+                self._subtractor = cv2.createBackgroundSubtractorMOG2(history=200,
+                                                                      detectShadows=False)
+                self._subtractor.apply(gray, learningRate=1.0)
+                return 1.0
+            mask = self._subtractor.apply(gray, learningRate=self.learning_rate)
+            return float(np.count_nonzero(mask)) / mask.size
+
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            return 1.0
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        changed = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+        cv2.accumulateWeighted(gray, self._background, self.learning_rate)
+        return changed
+
+    def should_detect(self, frame, timestamp):
+        """
+        True nếu nên chạy detector cho frame này (timestamp: giây)
+        """
+        self.checked += 1
+        self.last_motion = self.motion(frame)
+        due = self._last_detect is None or (self.keep_alive is not None
+                                            and timestamp - self._last_detect >= self.keep_alive)
+        if self.last_motion >= self.threshold or due:
+            self._last_detect = timestamp
+            GATE_FRAMES.inc(pipeline=self.name, result='detected')
+            return True
+        self.skipped += 1
+        GATE_FRAMES.inc(pipeline=self.name, result='skipped')
+        return False
+
+    def stats(self):
+        return {'checked': self.checked, 'skipped': self.skipped,
+                'skip_ratio': self.skipped / self.checked if self.checked else 0.0}
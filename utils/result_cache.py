@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+META_FILE = 'meta.json'
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    SHA-256 của file, đọc từng khối (không đưa cả file vào bộ nhớ)
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_version(path):
+    """
+    Phiên bản của file model (kích thước + thời gian sửa), thư mục thì gộp các file bên trong.
+    Thay model -> phiên bản đổi -> kết quả cache cũ không còn được dùng
+    """
+    if not path or not os.path.exists(path):
+        return 'missing'
+    if os.path.isdir(path):
+        parts = []
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                parts.append(f'{name}:{file_version(os.path.join(root, name))}')
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:16]
+    stat = os.stat(path)
+    return f'{stat.st_size}-{int(stat.st_mtime)}'
+
+
+def link_or_copy(src, dst):
+    """
+    Hard link nếu cùng ổ đĩa (không tốn thêm chỗ), ngược lại copy
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class CacheEntry:
+    def __init__(self, key, path, result, files, size):
+        self.key = key
+        self.path = path
+        self.result = result
+        # tên -> đường dẫn file trong thư mục cache
+        self.files = files
+        self.size = size
+
+
+class ResultCache:
+    """
+    Cache kết quả xử lý trên đĩa, khóa = hash nội dung file + phiên bản model + tham số.
+    Mỗi mục là một thư mục <root>/<key>/ gồm meta.json (kết quả) và các file output.
+    Tổng dung lượng bị giới hạn bởi max_bytes, vượt quá thì xóa mục lâu không dùng nhất (LRU).
+    """
+
+    def __init__(self, root='cache', max_bytes=2 * 2 ** 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(content_hash, **params):
+        payload = json.dumps({'content': content_hash, 'params': params},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _load(self):
+        # Đọc lại các mục có sẵn, sắp xếp theo lần dùng gần nhất (mtime của meta.json)
+        found = []
+        for key in os.listdir(self.root):
+            path = os.path.join(self.root, key)
+            meta_path = os.path.join(path, META_FILE)
+            if not os.path.isfile(meta_path):
+                # Mục ghi dở (tiến trình bị dừng giữa chừng)
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                entry = self._read_entry(key, path)
+            except (OSError, ValueError) as e:
+                print(f"Bỏ mục cache hỏng {key}: {e}")
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            found.append((os.path.getmtime(meta_path), entry))
+        for _, entry in sorted(found, key=lambda item: item[0]):
+            self._entries[entry.key] = entry
+            self._total += entry.size
+        self._evict()
+
+    def _read_entry(self, key, path):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        files = {name: os.path.join(path, filename) for name, filename in meta['files'].items()}
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        return CacheEntry(key, path, meta['result'], files, size)
+
+    def get(self, key):
+        """
+        CacheEntry hoặc None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not all(os.path.exists(p) for p in entry.files.values()):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            # Ghi lại thời điểm dùng để thứ tự LRU còn đúng sau khi khởi động lại
+            os.utime(os.path.join(entry.path, META_FILE))
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, result, files=None):
+        """
+        result: dict (JSON được); files: tên -> đường dẫn file output cần giữ lại
+        """
+        files = files or {}
+        final_path = os.path.join(self.root, key)
+        # Ghi vào thư mục tạm rồi đổi tên: không bao giờ đọc phải mục ghi dở
+        tmp_path = os.path.join(self.root, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(tmp_path)
+        try:
+            stored = {}
+            for name, src in files.items():
+                filename = name + os.path.splitext(src)[1]
+                link_or_copy(src, os.path.join(tmp_path, filename))
+                stored[name] = filename
+            with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+                json.dump({'result': result, 'files': stored}, f)
+
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._total -= old.size
+                    shutil.rmtree(old.path, ignore_errors=True)
+                os.rename(tmp_path, final_path)
+                entry = self._read_entry(key, final_path)
+                self._entries[key] = entry
+                self._total += entry.size
+                self._evict()
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._total -= entry.size
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._total,
+                    'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,201 @@
+import threading
+import time
+
+from utils.live_reader import LatestFrameReader
+from utils.metrics import LIVE_FRAMES, LIVE_DROPPED, STAGE_SECONDS, metrics
+from utils.mjpeg_output import AdaptiveProfile, MjpegOutput
+
+LIVE_VIEWERS = metrics.gauge('live_viewers', 'Connected clients per live source', ('source',))
+
+
+class FrameBroadcaster:
+    """
+    Một nguồn video (camera / RTSP / file) chỉ có MỘT thread đọc + chạy YOLO.
+    Frame mới nhất (đã vẽ) và detections của nó được giữ trong bộ đệm chung, mỗi client
+    (MJPEG: stream, NDJSON: records) tự lấy theo tốc độ của mình; client chậm sẽ bỏ qua
+    frame cũ chứ không làm chậm thread xử lý.
+    JPEG được encode theo profile (độ phân giải / chất lượng) của client, mỗi profile
+    một lần mỗi frame. Thread dừng khi người xem cuối cùng rời đi.
+    """
+
+    def __init__(self, source, render, output=None):
+        # render(frame, captured_at) -> (frame đã vẽ, Detections), None nếu bỏ frame
+        # render có thể có start() -> token / stop(token): gọi khi thread xử lý bắt đầu /
+        # kết thúc, stop chỉ dừng đúng phiên do start() của thread đó tạo ra
+        self.source = source
+        self.render = render
+        self.output = output or MjpegOutput(pipeline='live')
+        self._cond = threading.Condition()
+        self._latest = None     # (frame đã vẽ, detections, captured_at, index)
+        self._seq = 0
+        self._viewers = 0
+        self._running = False
+        self._generation = 0
+        self._thread = None
+        LIVE_VIEWERS.set_function(lambda: self._viewers, source=source)
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+    def subscribe(self):
+        with self._cond:
+            self._viewers += 1
+            if not self._running:
+                self._running = True
+                self._generation += 1
+                self._thread = threading.Thread(target=self._run,
+                                                args=(self._generation, self._thread),
+                                                daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self):
+        with self._cond:
+            self._viewers -= 1
+            if self._viewers <= 0:
+                self._viewers = 0
+                self._running = False
+                self._cond.notify_all()
+
+    def stream(self, profile=None):
+        """
+        Generator cho một client HTTP.
+        profile: AdaptiveProfile của client (mặc định: tự giảm / tăng chất lượng theo client)
+        """
+        profile = profile or AdaptiveProfile()
+        self.subscribe()
+        try:
+            last_seq = self._seq
+            while True:
+                item = self._wait_next(last_seq)
+                if item is None:
+                    break
+                seq, (frame, _, captured_at, _) = item
+                profile.feedback(seq - last_seq - 1)
+                last_seq = seq
+                chunk = self.output.chunk(seq, frame, profile.current)
+                # Độ trễ từ lúc đọc frame tới lúc chunk của client này sẵn sàng
+                STAGE_SECONDS.observe(time.monotonic() - captured_at, pipeline='live',
+                                      stage='end_to_end')
+                yield chunk
+        finally:
+            self.unsubscribe()
+
+    def records(self, min_conf=None):
+        """
+        Generator cho một client NDJSON: detections của frame mới nhất (không vẽ / encode,
+        dùng chung thread đọc + YOLO với luồng MJPEG nên không mở thêm capture).
+        min_conf: chỉ giữ box có confidence >= ngưỡng. 'time' là thời điểm đọc frame (epoch)
+        """
+        # Đổi thời gian monotonic của reader sang thời gian thực
+        clock_offset = time.time() - time.monotonic()
+        self.subscribe()
+        try:
+            last_seq = self._seq
+            started_at = None
+            while True:
+                item = self._wait_next(last_seq)
+                if item is None:
+                    break
+                last_seq, (_, detections, captured_at, index) = item
+                if started_at is None:
+                    started_at = captured_at
+                if min_conf:
+                    detections = detections.select(detections.conf >= min_conf)
+                record = detections.to_record(index, captured_at - started_at)
+                record['time'] = captured_at + clock_offset
+                yield record
+        finally:
+            self.unsubscribe()
+
+    def _wait_next(self, last_seq):
+        """
+        Chờ frame mới hơn last_seq -> (seq, latest); None nếu thread xử lý đã dừng.
+        Luôn trả về frame mới nhất, bỏ qua các frame client chưa kịp nhận
+        """
+        with self._cond:
+            while True:
+                self._cond.wait_for(lambda: self._seq != last_seq or not self._running,
+                                    timeout=1.0)
+                if self._seq != last_seq:
+                    return self._seq, self._latest
+                if not self._running:
+                    return None
+
+    def _is_current(self, generation):
+        return self._running and self._generation == generation
+
+    def _run(self, generation, previous=None):
+        # Client rời đi rồi vào lại ngay: thread cũ phải dừng hẳn (đã gọi render.stop) trước
+        # khi phiên mới dùng lại render (detector / tracker / fusion)
+        if previous is not None:
+            previous.join()
+        if not self._is_current(generation):
+            return
+        # Luôn lấy frame mới nhất của nguồn, frame cũ bị bỏ
+        reader = LatestFrameReader(self.source)
+        session = None
+        try:
+            if not reader.isOpened():
+                print(f"Error: Could not open source {self.source}")
+                return
+            reader.start()
+            if hasattr(self.render, 'start'):
+                session = self.render.start()
+
+            reader_dropped = 0
+            while self._is_current(generation):
+                item = reader.read(timeout=1.0)
+                if reader.dropped != reader_dropped:
+                    LIVE_DROPPED.inc(reader.dropped - reader_dropped,
+                                     source=self.source, reason='reader')
+                    reader_dropped = reader.dropped
+                if item is None:
+                    if reader.finished:
+                        break
+                    continue
+                frame, captured_at, index = item
+                rendered = self.render(frame, captured_at)
+                if rendered is None:
+                    LIVE_DROPPED.inc(source=self.source, reason='stale')
+                    continue
+                LIVE_FRAMES.inc(source=self.source)
+                annotated, detections = rendered
+                with self._cond:
+                    self._latest = (annotated, detections, captured_at, index)
+                    self._seq += 1
+                    self._cond.notify_all()
+        finally:
+            reader.release()
+            if session is not None and hasattr(self.render, 'stop'):
+                self.render.stop(session)
+            with self._cond:
+                if self._generation == generation:
+                    self._running = False
+                    self._cond.notify_all()
+
+
+class BroadcasterRegistry:
+    """
+    Quản lý một FrameBroadcaster cho mỗi nguồn video
+    """
+
+    def __init__(self, make_render):
+        # make_render(source) -> hàm render riêng cho nguồn đó (giữ trạng thái tracker)
+        self.make_render = make_render
+        self._broadcasters = {}
+        self._lock = threading.Lock()
+
+    def get(self, source):
+        with self._lock:
+            broadcaster = self._broadcasters.get(source)
+            if broadcaster is None:
+                broadcaster = FrameBroadcaster(source, self.make_render(source))
+                self._broadcasters[source] = broadcaster
+            return broadcaster
+
+    def stream(self, source, profile=None):
+        return self.get(source).stream(profile)
+
+    def records(self, source, min_conf=None):
+        return self.get(source).records(min_conf)
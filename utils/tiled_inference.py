@@ -0,0 +1,144 @@
+import math
+
+import numpy as np
+
+from utils.detections import Detections
+
+
+def tile_starts(length, tile, stride):
+    """
+    Vị trí bắt đầu các tile trên một trục; tile cuối được dời vào trong để không vượt ảnh
+    """
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - tile) / stride) + 1
+    starts = [min(i * stride, length - tile) for i in range(count)]
+    return sorted(set(starts))
+
+
+def tile_grid(width, height, tile=640, overlap=0.2, roi=None):
+    """
+    Các tile (x1, y1, x2, y2) chồng lấn nhau phủ kín vùng roi (mặc định cả ảnh)
+    """
+    rx1, ry1, rx2, ry2 = roi if roi is not None else (0, 0, width, height)
+    stride = max(1, int(tile * (1 - overlap)))
+    xs = tile_starts(rx2 - rx1, tile, stride)
+    ys = tile_starts(ry2 - ry1, tile, stride)
+    return [(rx1 + x, ry1 + y, min(rx1 + x + tile, rx2), min(ry1 + y + tile, ry2))
+            for y in ys for x in xs]
+
+
+def roi_pixels(roi, width, height):
+    """
+    ROI dạng tỉ lệ (0..1) -> pixel; None -> cả ảnh
+    """
+    if roi is None:
+        return 0, 0, width, height
+    x1, y1, x2, y2 = roi
+    return (int(x1 * width), int(y1 * height),
+            max(int(x2 * width), int(x1 * width) + 1), max(int(y2 * height), int(y1 * height) + 1))
+
+
+def merge_boxes(xyxy, conf, cls, threshold=0.5, max_det=300):
+    """
+    NMS toàn cục theo từng class sau khi ghép kết quả các tile.
+    Dùng IoS (giao / diện tích box nhỏ hơn) thay vì IoU: box bị cắt ở mép tile
+    nằm gần trọn trong box đầy đủ ở tile bên cạnh nên bị loại (giống SAHI)
+    """
+    if len(xyxy) == 0:
+        return np.zeros(0, np.int64)
+    areas = (xyxy[:, 2] - xyxy[:, 0]).clip(0) * (xyxy[:, 3] - xyxy[:, 1]).clip(0)
+    keep = []
+    for class_id in np.unique(cls):
+        index = np.flatnonzero(cls == class_id)
+        index = index[np.argsort(-conf[index])]
+        while len(index):
+            best, rest = index[0], index[1:]
+            keep.append(best)
+            if not len(rest):
+                break
+            top_left = np.maximum(xyxy[best, :2], xyxy[rest, :2])
+            bottom_right = np.minimum(xyxy[best, 2:], xyxy[rest, 2:])
+            inter = (bottom_right - top_left).clip(0).prod(axis=1)
+            ios = inter / np.maximum(np.minimum(areas[best], areas[rest]), 1e-6)
+            index = rest[ios < threshold]
+    keep = np.asarray(keep, np.int64)
+    return keep[np.argsort(-conf[keep])][:max_det]
+
+
+class TiledDetector:
+    """
+    Phát hiện vật nhỏ trên ảnh độ phân giải cao (kiểu SAHI):
+    mỗi frame được chia thành các tile tile_size x tile_size chồng lấn nhau,
+    TẤT CẢ tile (của mọi frame trong batch) được đưa vào detector trong một lần predict,
+    box được dời về tọa độ frame rồi NMS toàn cục.
+    Cùng giao diện predict(frames, conf, iou) với DetectorBackend nên dùng thay thế được.
+    """
+
+    def __init__(self, detector, tile_size=640, overlap=0.2, roi=None, full_frame=True,
+                 merge_threshold=0.5, max_batch=64):
+        self.detector = detector
+        self.tile_size = tile_size
+        self.overlap = overlap
+        # roi: (x1, y1, x2, y2) tỉ lệ 0..1, chỉ tìm trong vùng này để giới hạn số tile
+        self.roi = roi
+        # Thêm một lượt cả vùng (thu nhỏ) để không bỏ sót vật lớn hơn một tile
+        self.full_frame = full_frame
+        self.merge_threshold = merge_threshold
+        # Số tile tối đa mỗi lần gọi detector (giới hạn bộ nhớ), vẫn là batch
+        self.max_batch = max_batch
+        self.last_tile_count = 0
+
+    @property
+    def names(self):
+        return self.detector.names
+
+    def warmup(self):
+        self.detector.warmup()
+
+    def _crops(self, frame):
+        h, w = frame.shape[:2]
+        roi = roi_pixels(self.roi, w, h)
+        tiles = tile_grid(w, h, self.tile_size, self.overlap, roi)
+        # Vùng nhỏ hơn một tile -> chỉ cần một lượt, không cần tách
+        if len(tiles) == 1:
+            tiles = [roi]
+        elif self.full_frame:
+            tiles = [roi] + tiles
+        # Cắt bằng slicing (view, không copy)
+        return [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles], tiles
+
+    def predict(self, frames, conf=None, iou=None):
+        frames = list(frames)
+        crops, owners, offsets = [], [], []
+        for i, frame in enumerate(frames):
+            frame_crops, tiles = self._crops(frame)
+            crops.extend(frame_crops)
+            owners.extend([i] * len(frame_crops))
+            offsets.extend((x1, y1) for x1, y1, _, _ in tiles)
+        self.last_tile_count = len(crops)
+
+        results = []
+        for start in range(0, len(crops), self.max_batch):
+            results.extend(self.detector.predict(crops[start:start + self.max_batch],
+                                                 conf=conf, iou=iou))
+
+        # Ghép box của mọi tile: một lần nối mảng, dời tọa độ bằng phép cộng vector
+        counts = np.array([len(r) for r in results], np.int64)
+        owners = np.repeat(np.asarray(owners, np.int64), counts)
+        shift = np.repeat(np.asarray(offsets, np.float32).reshape(-1, 2), counts, axis=0)
+        if counts.sum():
+            xyxy = np.concatenate([r.xyxy for r in results]) + np.tile(shift, 2)
+            scores = np.concatenate([r.conf for r in results])
+            cls = np.concatenate([r.cls for r in results])
+        else:
+            xyxy, scores, cls = np.zeros((0, 4), np.float32), np.zeros(0), np.zeros(0, np.int64)
+
+        names = self.detector.names
+        detections = []
+        for i in range(len(frames)):
+            index = np.flatnonzero(owners == i)
+            keep = index[merge_boxes(xyxy[index], scores[index], cls[index],
+                                     self.merge_threshold)]
+            detections.append(Detections(xyxy[keep], scores[keep], cls[keep], names))
+        return detections
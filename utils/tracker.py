@@ -0,0 +1,296 @@
+import numpy as np
+
+from utils.detections import Detections
+from utils.late_fusion import class_index_map
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Ma trận IoU (N, M) giữa hai tập box xyxy
+    """
+    a = np.asarray(boxes_a, np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, np.float32).reshape(-1, 4)
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), np.float32)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def greedy_match(iou, threshold):
+    """
+    Ghép cặp (hàng, cột) theo IoU giảm dần, mỗi hàng / cột chỉ dùng một lần.
+    Trả về (các cặp, hàng chưa ghép, cột chưa ghép)
+    """
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols])
+    used_rows, used_cols, pairs = set(), set(), []
+    for r, c in zip(rows[order], cols[order]):
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        pairs.append((int(r), int(c)))
+    unmatched_rows = [r for r in range(iou.shape[0]) if r not in used_rows]
+    unmatched_cols = [c for c in range(iou.shape[1]) if c not in used_cols]
+    return pairs, unmatched_rows, unmatched_cols
+
+
+class KalmanBox:
+    """
+    Bộ lọc Kalman vận tốc không đổi cho một box: trạng thái (cx, cy, w, h, vx, vy, vw, vh),
+    nhiễu tỉ lệ theo kích thước box (như ByteTrack)
+    """
+
+    std_position = 1 / 20
+    std_velocity = 1 / 160
+
+    _F = np.eye(8)
+    _F[:4, 4:] = np.eye(4)
+    _H = np.eye(4, 8)
+
+    def __init__(self, xyxy):
+        z = _to_cxcywh(xyxy)
+        self.x = np.concatenate([z, np.zeros(4)])
+        size = max(z[2], z[3])
+        std = np.r_[[2 * self.std_position * size] * 4, [10 * self.std_velocity * size] * 4]
+        self.P = np.diag(std ** 2)
+
+    def predict(self):
+        size = max(self.x[2], self.x[3])
+        q = np.r_[[self.std_position * size] * 4, [self.std_velocity * size] * 4]
+        self.x = self._F @ self.x
+        self.P = self._F @ self.P @ self._F.T + np.diag(q ** 2)
+        # Không để box bị co về kích thước âm
+        self.x[2:4] = np.maximum(self.x[2:4], 1.0)
+
+    def update(self, xyxy):
+        z = _to_cxcywh(xyxy)
+        size = max(self.x[2], self.x[3])
+        R = np.diag((np.full(4, self.std_position * size)) ** 2)
+        S = self._H @ self.P @ self._H.T + R
+        K = self.P @ self._H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (z - self._H @ self.x)
+        self.P = (np.eye(8) - K @ self._H) @ self.P
+
+    @property
+    def xyxy(self):
+        cx, cy, w, h = self.x[:4]
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], np.float32)
+
+
+def _to_cxcywh(xyxy):
+    x1, y1, x2, y2 = (float(v) for v in xyxy)
+    return np.array([(x1 + x2) / 2, (y1 + y2) / 2, max(x2 - x1, 1.0), max(y2 - y1, 1.0)])
+
+
+class Track:
+    def __init__(self, track_id, xyxy, conf, cls, timestamp):
+        self.id = track_id
+        self.kalman = KalmanBox(xyxy)
+        self.conf = float(conf)
+        self.hits = 0
+        self.misses = 0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        # Phiếu bầu class: class id -> tổng confidence qua các frame
+        self.votes = {}
+        self.conf_sum = 0.0
+        self.audio_sum = None
+        self.audio_frames = 0
+        self._add_vote(cls, conf)
+
+    def _add_vote(self, cls, conf):
+        self.votes[int(cls)] = self.votes.get(int(cls), 0.0) + float(conf)
+        self.conf_sum += float(conf)
+        self.hits += 1
+
+    def update(self, xyxy, conf, cls, timestamp):
+        self.kalman.update(xyxy)
+        self.conf = float(conf)
+        self.misses = 0
+        self.last_seen = timestamp
+        self._add_vote(cls, conf)
+
+    def add_audio(self, probs):
+        probs = np.asarray(probs, np.float32)
+        self.audio_sum = probs.copy() if self.audio_sum is None else self.audio_sum + probs
+        self.audio_frames += 1
+
+    def class_scores(self, audio_index=None, visual_weight=1.0):
+        """
+        Điểm từng class của track: tỉ lệ phiếu visual (theo confidence),
+        trộn với xác suất audio trung bình nếu có
+        """
+        total = sum(self.votes.values()) or 1.0
+        scores = {cls: votes / total for cls, votes in self.votes.items()}
+        if audio_index is not None and self.audio_frames:
+            audio = self.audio_sum / self.audio_frames
+            for cls in range(len(audio_index)):
+                if audio_index[cls] < 0:
+                    continue
+                scores[cls] = (visual_weight * scores.get(cls, 0.0)
+                               + (1 - visual_weight) * float(audio[audio_index[cls]]))
+        return scores
+
+
+class ByteTracker:
+    """
+    Tracking kiểu ByteTrack sau YOLO:
+    - box dự đoán bằng Kalman, ghép với detection theo IoU
+    - ghép detection confidence cao trước, sau đó dùng detection confidence thấp
+      để giữ các track đang bị che / mờ
+    - class của track = bỏ phiếu theo confidence qua các frame (+ audio nếu có)
+    - frame không chạy YOLO: predict() trả về box nội suy bằng Kalman
+      (chỉ đưa vào update() kết quả thật của detector)
+    det_thresh: ngưỡng confidence của box được hiển thị (DETECT_CONF); ngưỡng cao / tạo track
+    mới mặc định bằng nó. Detector phải chạy ở detect_conf (= low_thresh) để có detection
+    confidence thấp cho lượt ghép thứ 2; detection thấp không ghép được track nào bị bỏ
+    """
+
+    def __init__(self, det_thresh=0.5, high_thresh=None, low_thresh=0.1, new_track_thresh=None,
+                 match_iou=0.3, low_match_iou=0.5, max_age=30, min_hits=1,
+                 class_labels=None, visual_weight=0.5):
+        self.high_thresh = det_thresh if high_thresh is None else high_thresh
+        self.low_thresh = min(low_thresh, self.high_thresh)
+        self.new_track_thresh = self.high_thresh if new_track_thresh is None else new_track_thresh
+        self.match_iou = match_iou
+        self.low_match_iou = low_match_iou
+        # Số lần update liên tiếp không thấy track trước khi bỏ
+        self.max_age = max_age
+        self.min_hits = min_hits
+        # class_labels: thứ tự class của xác suất audio (CLASS_LABELS của app)
+        self.class_labels = class_labels
+        self.visual_weight = visual_weight
+        self.names = {}
+        self.tracks = []
+        self.finished = []
+        self.updates = 0
+        self._next_id = 1
+        self._audio_index = None
+
+    @property
+    def detect_conf(self):
+        # conf cần truyền cho detector khi có tracker
+        return self.low_thresh
+
+    def update(self, detections, timestamp=None):
+        """
+        Detections của frame vừa chạy YOLO -> Detections có track_ids (class đã được làm mượt)
+        """
+        if detections.names and detections.names != self.names:
+            self.names = detections.names
+            self._audio_index = None
+        self.updates += 1
+        for track in self.tracks:
+            track.kalman.predict()
+
+        conf = detections.conf
+        high = np.flatnonzero(conf >= self.high_thresh)
+        low = np.flatnonzero((conf >= self.low_thresh) & (conf < self.high_thresh))
+        updated = set()
+
+        # 1. Detection confidence cao với mọi track
+        predicted = np.array([t.kalman.xyxy for t in self.tracks], np.float32).reshape(-1, 4)
+        pairs, free_tracks, free_high = greedy_match(
+            box_iou(predicted, detections.xyxy[high]), self.match_iou)
+        for t, d in pairs:
+            self._apply(self.tracks[t], detections, high[d], timestamp)
+            updated.add(t)
+
+        # 2. Detection confidence thấp với các track còn lại
+        pairs, free_tracks_2, _ = greedy_match(
+            box_iou(predicted[free_tracks], detections.xyxy[low]), self.low_match_iou)
+        for t, d in pairs:
+            self._apply(self.tracks[free_tracks[t]], detections, low[d], timestamp)
+            updated.add(free_tracks[t])
+
+        # 3. Track không được ghép -> tăng số lần mất; quá max_age thì kết thúc
+        alive = []
+        for i, track in enumerate(self.tracks):
+            if i not in updated:
+                track.misses += 1
+            if track.misses > self.max_age:
+                self.finished.append(track)
+            else:
+                alive.append(track)
+        self.tracks = alive
+
+        # 4. Detection confidence cao chưa có track -> track mới
+        for d in free_high:
+            index = high[d]
+            if conf[index] < self.new_track_thresh:
+                continue
+            self.tracks.append(Track(self._next_id, detections.xyxy[index], conf[index],
+                                     detections.cls[index], timestamp))
+            self._next_id += 1
+
+        return self._output(lambda track: track.misses == 0)
+
+    def predict(self, timestamp=None):
+        """
+        Frame không chạy YOLO: dời các track đang hoạt động theo Kalman
+        """
+        for track in self.tracks:
+            track.kalman.predict()
+            if track.misses == 0:
+                track.last_seen = timestamp
+        return self._output(lambda track: track.misses == 0)
+
+    def add_audio(self, probs):
+        """
+        Xác suất audio (theo class_labels) tại frame hiện tại, cộng vào các track đang thấy
+        """
+        if self.class_labels is None:
+            return
+        for track in self.tracks:
+            if track.misses == 0:
+                track.add_audio(probs)
+
+    def _apply(self, track, detections, index, timestamp):
+        track.update(detections.xyxy[index], detections.conf[index], detections.cls[index],
+                     timestamp)
+
+    def _confirmed(self, track):
+        # Những frame đầu tiên chưa đủ min_hits thì vẫn hiện track (tránh mất box lúc mở video)
+        return track.hits >= self.min_hits or self.updates <= self.min_hits
+
+    def _dominant(self, track):
+        if self.class_labels is not None and self._audio_index is None and self.names:
+            self._audio_index = class_index_map(self.names, self.class_labels)
+        audio_index = self._audio_index if self.class_labels is not None else None
+        scores = track.class_scores(audio_index, self.visual_weight)
+        cls = max(scores, key=scores.get)
+        return cls, scores[cls]
+
+    def _output(self, keep):
+        tracks = [t for t in self.tracks if keep(t) and self._confirmed(t)]
+        if not tracks:
+            return Detections(names=self.names)
+        return Detections([t.kalman.xyxy for t in tracks], [t.conf for t in tracks],
+                          [self._dominant(t)[0] for t in tracks], self.names,
+                          [t.id for t in tracks])
+
+    def summaries(self):
+        """
+        Tóm tắt từng track: lần đầu / cuối thấy, số frame, class chiếm ưu thế
+        """
+        result = []
+        for track in sorted(self.finished + self.tracks, key=lambda t: t.id):
+            if track.hits < self.min_hits:
+                continue
+            cls, score = self._dominant(track)
+            result.append({
+                'track_id': track.id,
+                'class': self.names.get(cls, str(cls)),
+                'class_id': cls,
+                'score': float(score),
+                'mean_confidence': track.conf_sum / track.hits,
+                'first_seen': track.first_seen,
+                'last_seen': track.last_seen,
+                'frames': track.hits,
+            })
+        return result
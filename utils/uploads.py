@@ -0,0 +1,84 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+
+def new_upload_id():
+    return uuid.uuid4().hex
+
+
+class HashingUploadFile:
+    """
+    File nhận dữ liệu upload trực tiếp từ bộ parse multipart:
+    ghi thẳng xuống đĩa, tính SHA-256 trong lúc ghi và dừng ngay khi vượt max_bytes
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._file = open(path, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge(
+                f"File vượt quá giới hạn {self.max_bytes // 2 ** 20} MB")
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # seek / read / tell / close ... dùng của file thật
+        return getattr(self._file, name)
+
+
+class StreamingUploadRequest(Request):
+    """
+    Request của Flask ghi file upload thẳng vào <upload_folder>/<upload_id>/<tên file>
+    thay vì bộ đệm tạm của Werkzeug. Mỗi request có thư mục riêng nên hai người
+    upload cùng tên file không ghi đè lên nhau.
+    Cần app.config['UPLOAD_FOLDER'] và app.config['MAX_UPLOAD_BYTES'].
+    """
+
+    upload_id = None
+
+    @property
+    def upload_dir(self):
+        from flask import current_app
+        if self.upload_id is None:
+            self.upload_id = new_upload_id()
+        return os.path.join(current_app.config['UPLOAD_FOLDER'], self.upload_id)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        from flask import current_app
+        os.makedirs(self.upload_dir, exist_ok=True)
+        name = secure_filename(filename or '') or 'upload'
+        path = os.path.join(self.upload_dir, name)
+        # Hai file cùng tên trong một request
+        if os.path.exists(path):
+            base, ext = os.path.splitext(name)
+            path = os.path.join(self.upload_dir, f'{base}_{uuid.uuid4().hex[:8]}{ext}')
+        return HashingUploadFile(path, current_app.config.get('MAX_UPLOAD_BYTES'))
+
+    def discard_uploads(self):
+        """
+        Xóa thư mục upload của request (file sai định dạng, dùng kết quả cache...)
+        """
+        if self.upload_id is not None:
+            shutil.rmtree(self.upload_dir, ignore_errors=True)
@@ -0,0 +1,254 @@
+import queue
+import subprocess
+import threading
+
+import cv2
+
+from utils.batch_inference import BatchedFrameInference, END_OF_STREAM, put_until_stopped
+from utils.metrics import STAGE_SECONDS, QUEUE_DEPTH
+
+# Hàng đợi của các pipeline đang chạy, tổng độ dài được xuất ra /metrics
+_active_queues = {'decode': set(), 'encode': set()}
+_active_lock = threading.Lock()
+
+
+def _queued(name):
+    with _active_lock:
+        return sum(q.qsize() for q in _active_queues[name])
+
+
+for _name in _active_queues:
+    QUEUE_DEPTH.set_function(lambda name=_name: _queued(name), pipeline='video', queue=_name)
+
+
+def get_ffmpeg_exe():
+    """
+    Lấy đường dẫn ffmpeg (ưu tiên bản đi kèm imageio-ffmpeg của moviepy)
+    """
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:
+        return 'ffmpeg'
+
+
+class FFmpegVideoWriter:
+    """
+    Ghi frame BGR qua pipe vào ffmpeg, encode H.264 tương thích web trong một lần.
+    Nếu có audio_source thì ghép luôn audio gốc (không cần file tạm).
+    """
+
+    def __init__(self, output_path, width, height, fps, audio_source=None,
+                 preset='veryfast', crf=23):
+        cmd = [get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+               '-s', f'{width}x{height}', '-r', f'{fps}', '-i', '-']
+        if audio_source:
+            # '?' : bỏ qua nếu file gốc không có audio
+            cmd += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?',
+                    '-c:a', 'aac', '-shortest']
+        cmd += ['-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+                # yuv420p cần kích thước chẵn
+                '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+                '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+                output_path]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        with STAGE_SECONDS.time(pipeline='video', stage='encode'):
+            self.proc.stdin.write(frame.tobytes())
+
+    def close(self):
+        _, err = self.proc.communicate()
+        if self.proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg lỗi: {err.decode(errors='ignore').strip()}")
+
+
+def plot_result(frame, detections, timestamp=None):
+    """
+    Cách vẽ mặc định: vẽ box lên frame
+    """
+    return detections.plot(frame, copy=False)
+
+
+class VideoPipeline:
+    """
+    Xử lý video theo 3 tầng chạy song song:
+    giải mã (decode) -> YOLO theo batch (infer) -> vẽ + encode H.264 (encode).
+    Các tầng nối với nhau bằng hàng đợi có giới hạn nên tầng nhanh sẽ tự chờ tầng chậm.
+    """
+
+    def __init__(self, detector, batch_size=8, conf=0.35, iou=0.5,
+                 queue_size=32, verify=False, detect_every=1, gate=None):
+        self.inference = BatchedFrameInference(detector, batch_size=batch_size,
+                                               conf=conf, iou=iou, queue_size=queue_size,
+                                               verify=verify)
+        self.queue_size = self.inference.queue_size
+        # Chỉ chạy YOLO mỗi detect_every frame; frame ở giữa lấy box từ tracker (nếu có)
+        # hoặc giữ nguyên kết quả lần detect gần nhất
+        self.detect_every = max(1, int(detect_every))
+        # gate: MotionGate (utils/motion_gate.py), bỏ qua YOLO ở các frame không có chuyển động
+        self.gate = gate
+
+    def run(self, input_path, output_path, annotate=plot_result, keep_audio=True,
+            progress=None, tracker=None):
+        """
+        Chạy pipeline cho một file video, trả về số frame đã xử lý.
+        annotate(frame, detections, timestamp) -> ảnh BGR để ghi ra (timestamp: giây trong video)
+        progress(done, total) được gọi sau mỗi frame đã encode
+        tracker: ByteTracker (utils/tracker.py) gán track id và nội suy box giữa các lần detect
+        """
+        cap = cv2.VideoCapture(input_path)
+        if not cap.isOpened():
+            raise IOError(f"Không mở được video: {input_path}")
+
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        writer = FFmpegVideoWriter(output_path, width, height, fps,
+                                   audio_source=input_path if keep_audio else None)
+
+        decode_queue = queue.Queue(maxsize=self.queue_size)
+        encode_queue = queue.Queue(maxsize=self.queue_size)
+        stop_event = threading.Event()
+        errors = []
+        done = [0]
+        with _active_lock:
+            _active_queues['decode'].add(decode_queue)
+            _active_queues['encode'].add(encode_queue)
+
+        def guarded(target):
+            def wrapper():
+                try:
+                    target()
+                except Exception as e:
+                    errors.append(e)
+                    stop_event.set()
+            return wrapper
+
+        def decode_stage():
+            try:
+                while not stop_event.is_set():
+                    with STAGE_SECONDS.time(pipeline='video', stage='decode'):
+                        ok, frame = cap.read()
+                    if not ok:
+                        break
+                    if not put_until_stopped(decode_queue, frame, stop_event):
+                        return
+            finally:
+                cap.release()
+                put_until_stopped(decode_queue, END_OF_STREAM, stop_event)
+
+        if self.gate is not None:
+            self.gate.reset()
+
+        def infer_stage():
+            try:
+                finished = False
+                index = 0
+                while not finished and not stop_event.is_set():
+                    # Gom frame đến khi đủ batch_size frame cần chạy YOLO
+                    # (tối đa queue_size frame để cảnh tĩnh dài không giữ quá nhiều frame)
+                    batch, keys = [], []
+                    while len(keys) < self.inference.batch_size and len(batch) < self.queue_size:
+                        item = _get_until_stopped(decode_queue, stop_event)
+                        if item is None or item is END_OF_STREAM:
+                            finished = True
+                            break
+                        if index % self.detect_every == 0 and (
+                                self.gate is None or self.gate.should_detect(item, index / fps)):
+                            keys.append(len(batch))
+                        batch.append(item)
+                        index += 1
+                    if batch:
+                        results = [None] * len(batch)
+                        if keys:
+                            with STAGE_SECONDS.time(pipeline='video', stage='infer'):
+                                detected = self.inference.infer_batch([batch[k] for k in keys])
+                            for k, detections in zip(keys, detected):
+                                results[k] = detections
+                        for pair in zip(batch, results):
+                            if not put_until_stopped(encode_queue, pair, stop_event):
+                                return
+            finally:
+                put_until_stopped(encode_queue, END_OF_STREAM, stop_event)
+
+        def encode_stage():
+            last_result = None
+            while True:
+                item = _get_until_stopped(encode_queue, stop_event)
+                if item is None or item is END_OF_STREAM:
+                    break
+                frame, result = item
+                timestamp = done[0] / fps
+                # result None: frame không chạy YOLO
+                if tracker is not None:
+                    with STAGE_SECONDS.time(pipeline='video', stage='track'):
+                        result = (tracker.update(result, timestamp) if result is not None
+                                  else tracker.predict(timestamp))
+                elif result is None:
+                    result = last_result
+                last_result = result
+                # Vẽ box (+ fusion với audio nếu annotate của app.py)
+                with STAGE_SECONDS.time(pipeline='video', stage='annotate'):
+                    annotated = annotate(frame, result, timestamp)
+                writer.write(annotated)
+                done[0] += 1
+                if progress is not None:
+                    progress(done[0], total)
+
+        threads = [threading.Thread(target=guarded(stage), daemon=True)
+                   for stage in (decode_stage, infer_stage, encode_stage)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        with _active_lock:
+            _active_queues['decode'].discard(decode_queue)
+            _active_queues['encode'].discard(encode_queue)
+
+        try:
+            writer.close()
+        except Exception as e:
+            errors.append(e)
+
+        if errors:
+            raise errors[0]
+        return done[0]
+
+    def detect(self, input_path):
+        """
+        Chỉ phát hiện, không vẽ / encode: generator (frame index, timestamp, Detections).
+        Decode vẫn chạy ở thread riêng, YOLO chạy theo batch
+        """
+        cap = cv2.VideoCapture(input_path)
+        if not cap.isOpened():
+            raise IOError(f"Không mở được video: {input_path}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+
+        def frames():
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    return
+                yield frame
+
+        try:
+            for index, (_, detections) in enumerate(self.inference.run(frames())):
+                yield index, index / fps, detections
+        finally:
+            cap.release()
+
+
+def _get_until_stopped(item_queue, stop_event):
+    """
+    Lấy item từ hàng đợi; trả về None nếu pipeline đã dừng vì lỗi
+    """
+    while not stop_event.is_set():
+        try:
+            return item_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
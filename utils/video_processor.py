@@ -1,84 +1,137 @@
 import cv2
 import numpy as np
 import os
-from ultralytics import YOLO
-from moviepy.editor import VideoFileClip
-import tempfile
+import time
+from utils.detector_backends import get_detector
+from utils.inference_server import ServedDetector, serve, PRIORITY_LIVE, PRIORITY_OFFLINE
+from utils.video_pipeline import VideoPipeline
+from utils.live_reader import LatestFrameReader, LiveDetector
+from utils.mjpeg_output import get_encoder, mjpeg_chunk
+from utils.tracker import ByteTracker
+from utils.motion_gate import MotionGate
+from utils.tiled_inference import TiledDetector
 
 class VideoProcessor:
-    def __init__(self, model_path='models/best.onnx'):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path=None, engine='torch', threads=None, precision='fp32', imgsz=640,
+                 tiled=False, tile_overlap=0.2, roi=None, server=None):
+        """
+        engine: 'torch', 'onnxruntime' hoặc 'openvino'; model_path None -> model mặc định của engine
+        tiled: chia ảnh / video độ phân giải cao thành các tile imgsz x imgsz (vật nhỏ),
+        roi: (x1, y1, x2, y2) tỉ lệ 0..1, chỉ tìm trong vùng này
+        server: dict tham số InferenceServer -> gom batch chung với các route khác
+        (live ưu tiên hơn ảnh / video file); None: gọi detector trực tiếp
+        """
+        self.model_path = model_path
+        self.engine = engine
+        self.threads = threads
+        self.precision = precision
+        self.imgsz = imgsz
+        self.tiled = tiled
+        self.tile_overlap = tile_overlap
+        self.roi = roi
+        self.server = server
+
+    def _detector(self, priority):
+        # Lấy từ registry: cùng engine + model với app.py -> dùng chung một instance,
+        # chỉ load khi dùng lần đầu
+        detector = get_detector(self.engine, self.model_path, imgsz=self.imgsz,
+                                threads=self.threads, precision=self.precision)
+        if self.server is None:
+            return detector
+        return ServedDetector(serve(detector, **self.server), priority)
+
+    @property
+    def model(self):
+        return self._detector(PRIORITY_LIVE)
+
+    @property
+    def file_model(self):
+        # Model cho ảnh / video file: bọc chế độ tile nếu bật (live vẫn chạy cả frame)
+        detector = self._detector(PRIORITY_OFFLINE)
+        if not self.tiled:
+            return detector
+        return TiledDetector(detector, tile_size=self.imgsz, overlap=self.tile_overlap,
+                             roi=self.roi)
      
 
-    def generate_frames(self, source=0, conf=0.40, iou=0.50):
+    def generate_frames(self, source=0, conf=0.40, iou=0.50, detect_every=1, max_latency=0.5,
+                        track=True, motion_threshold=None, jpeg_quality=None):
         """
         Hàm này mở camera, xử lý YOLO và trả về luồng dữ liệu ảnh (Stream)
         source: 0 (webcam laptop), 1 (cam ngoài), hoặc 'rtsp://...' (IP Camera)
+        detect_every: chạy YOLO mỗi N frame, ở giữa dời box bằng optical flow
+        max_latency: frame cũ hơn số giây này sẽ bị bỏ (luôn ưu tiên frame mới nhất)
+        track: gán track id cố định cho từng vật thể
+        motion_threshold: bật lọc chuyển động, chỉ chạy YOLO khi tỉ lệ pixel thay đổi >= ngưỡng
+        jpeg_quality: chất lượng JPEG (None: mặc định của encoder)
         """
-        cap = cv2.VideoCapture(source)
-        
-        while True:
-            success, frame = cap.read()
-            if not success:
-                break
-                
-            # 1. Chạy YOLO trên frame hiện tại
-            # stream=True giúp tối ưu bộ nhớ khi chạy liên tục
-            results = self.model(frame, stream=True, conf=conf, iou=iou)
-            
-            # 2. Vẽ kết quả lên frame
-            for result in results:
-                annotated_frame = result.plot()
-                
+        reader = LatestFrameReader(source)
+        if not reader.isOpened():
+            print(f"Error: Could not open source {source}")
+            return
+        reader.start()
+
+        tracker = ByteTracker(det_thresh=conf) if track else None
+        # Có tracker: YOLO chạy ở ngưỡng thấp, box conf thấp chỉ dùng để giữ track đang có
+        detect_conf = tracker.detect_conf if tracker is not None else conf
+
+        def detect(frame):
+            return self.model.predict([frame], conf=detect_conf, iou=iou)[0]
+
+        gate = MotionGate(threshold=motion_threshold, name='live') if motion_threshold else None
+        detector = LiveDetector(detect, detect_every=detect_every, max_latency=max_latency,
+                                gate=gate)
+
+        try:
+            while True:
+                item = reader.read(timeout=1.0)
+                if item is None:
+                    if reader.finished:
+                        break
+                    continue
+                frame, captured_at, _ = item
+
+                # 1. Chạy YOLO (hoặc tracker) trên frame mới nhất
+                detections = detector.process(frame, captured_at)
+                if detections is None:
+                    continue
+                if tracker is not None:
+                    # Box dời bằng optical flow không phải detection mới -> chỉ predict
+                    detections = (tracker.update(detections, captured_at) if detector.detected
+                                  else tracker.predict(captured_at))
+
+                # 2. Vẽ kết quả lên frame
+                annotated_frame = detections.plot(frame, copy=False)
+
                 # 3. Mã hóa ảnh sang định dạng JPEG để gửi qua web
-                ret, buffer = cv2.imencode('.jpg', annotated_frame)
-                frame_bytes = buffer.tobytes()
-                
+                jpeg = get_encoder().encode(annotated_frame, jpeg_quality)
+
                 # 4. Trả về frame theo chuẩn Multipart (MJPEG)
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                       
-        cap.release()
-    def process_video(self, input_path, output_path, conf = 0.4, iou=0.50):
+                yield mjpeg_chunk(jpeg)
+        finally:
+            reader.release()
+
+    def process_video(self, input_path, output_path, conf = 0.4, iou=0.50, batch_size=8,
+                      detect_every=1, track=True, motion_threshold=None):
         """
         Xử lý video và lưu kết quả dưới dạng MP4
+        detect_every: chạy YOLO mỗi N frame, frame ở giữa dùng box nội suy của tracker
+        motion_threshold: bỏ qua YOLO ở frame gần như không đổi (None: tắt)
         """
-        # Mở video input
-        cap = cv2.VideoCapture(input_path)
-        
-        # Lấy thông số video
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        
-        # Tạo VideoWriter cho MP4 (sử dụng codec H.264)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        
-        frame_count = 0
-        
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
-            # Chạy YOLO trên frame
-            results = self.model(frame, conf = conf, iou = iou)
-            
-            # Vẽ bounding boxes lên frame
-            annotated_frame = results[0].plot()
-            
-            # Ghi frame đã xử lý
-            out.write(annotated_frame)
-            
-            frame_count += 1
-        
-        # Giải phóng tài nguyên
-        cap.release()
-        out.release()
-        
-        # Đảm bảo video được encode đúng cách
-        self._ensure_mp4_compatibility(output_path)
+        # Pipeline 3 tầng (decode -> YOLO -> vẽ + encode) chạy song song,
+        # ghi thẳng H.264 tương thích web nên không cần encode lại lần hai
+        gate = MotionGate(threshold=motion_threshold) if motion_threshold else None
+        tracker = ByteTracker(det_thresh=conf) if track else None
+        pipeline = VideoPipeline(self.file_model, batch_size=batch_size,
+                                 conf=tracker.detect_conf if tracker is not None else conf,
+                                 iou=iou, detect_every=detect_every, gate=gate)
+        self.last_tracks = []
+        pipeline.run(input_path, output_path, keep_audio=True, tracker=tracker)
+        # Tóm tắt các track (lần đầu / cuối thấy, class chiếm ưu thế)
+        if tracker is not None:
+            self.last_tracks = tracker.summaries()
+        if gate is not None:
+            print(f"Motion gate: bỏ qua YOLO ở {gate.skipped}/{gate.checked} frame")
         
         return output_path
     
@@ -90,34 +143,82 @@ class VideoProcessor:
         img = cv2.imread(input_path)
         
         # Chạy YOLO
-        results = self.model(img, conf = conf, iou = iou)
+        detections = self.file_model.predict([img], conf = conf, iou = iou)[0]
         
         # Vẽ kết quả
-        annotated_img = results[0].plot()
+        annotated_img = detections.plot(img)
         
         # Lưu ảnh
         cv2.imwrite(output_path, annotated_img)
         
         return output_path
-    
-    def _ensure_mp4_compatibility(self, video_path):
+
+    # --- CHẾ ĐỘ CHỈ TRẢ VỀ DETECTIONS (không vẽ, không encode) ---
+
+    def detect_image(self, input_path, conf=0.4, iou=0.50):
+        """
+        Detections của một ảnh dạng dict JSON được
+        """
+        img = cv2.imread(input_path)
+        if img is None:
+            raise IOError(f"Không đọc được ảnh: {input_path}")
+        return self.detect_images([img], conf=conf, iou=iou)[0]
+
+    def detect_images(self, images, conf=0.4, iou=0.50):
         """
-        Đảm bảo video MP4 có thể phát được trên web
+        Detections của nhiều ảnh (đã decode) trong một lần chạy YOLO
         """
-        # Sử dụng moviepy để chuyển đổi nếu cần
+        results = self.file_model.predict(list(images), conf=conf, iou=iou)
+        records = []
+        for img, detections in zip(images, results):
+            record = detections.to_record(0, 0.0)
+            record['width'], record['height'] = img.shape[1], img.shape[0]
+            records.append(record)
+        return records
+
+    def detect_video(self, input_path, conf=0.4, iou=0.50, batch_size=8):
+        """
+        Generator: bản ghi detections của từng frame trong video (YOLO theo batch)
+        """
+        pipeline = VideoPipeline(self.file_model, batch_size=batch_size, conf=conf, iou=iou)
+        for index, timestamp, detections in pipeline.detect(input_path):
+            yield detections.to_record(index, timestamp)
+
+    def detect_stream(self, source=0, conf=0.40, iou=0.50, detect_every=1, max_latency=0.5):
+        """
+        Generator: bản ghi detections của nguồn live (webcam / RTSP / file).
+        Giống generate_frames nhưng bỏ bước vẽ và mã hóa JPEG.
+        'time' là thời điểm đọc frame (epoch, giây)
+        """
+        reader = LatestFrameReader(source)
+        if not reader.isOpened():
+            print(f"Error: Could not open source {source}")
+            return
+        reader.start()
+
+        def detect(frame):
+            return self.model.predict([frame], conf=conf, iou=iou)[0]
+
+        detector = LiveDetector(detect, detect_every=detect_every, max_latency=max_latency)
+        # Đổi thời gian monotonic của reader sang thời gian thực
+        clock_offset = time.time() - time.monotonic()
+        started_at = None
+
         try:
-            clip = VideoFileClip(video_path)
-            # Tạo file tạm
-            temp_output = video_path.replace('.mp4', '_compatible.mp4')
-            
-            # Xuất với codec phù hợp cho web
-            clip.write_videofile(temp_output, codec='libx264', 
-                                 audio_codec='aac', 
-                                 temp_audiofile='temp-audio.m4a', 
-                                 remove_temp=True)
-            
-            # Thay thế file cũ
-            os.replace(temp_output, video_path)
-            
-        except Exception as e:
-            print(f"Không thể tối ưu video: {e}")
\ No newline at end of file
+            while True:
+                item = reader.read(timeout=1.0)
+                if item is None:
+                    if reader.finished:
+                        break
+                    continue
+                frame, captured_at, index = item
+                detections = detector.process(frame, captured_at)
+                if detections is None:
+                    continue
+                if started_at is None:
+                    started_at = captured_at
+                record = detections.to_record(index, captured_at - started_at)
+                record['time'] = captured_at + clock_offset
+                yield record
+        finally:
+            reader.release()